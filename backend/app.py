@@ -1,17 +1,76 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects import postgresql, sqlite
 from flask_migrate import Migrate
 from flask_cors import CORS # <--- 1. IMPORTAR CORS
 import os
-from datetime import datetime
+import atexit
+import base64
+import csv
+import glob
+import heapq
+import io
+import itertools
+import json
+import math
+import queue
+import hashlib
+import shutil
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 import pickle
 import sys
 import tempfile
+from decimal import Decimal
+from operator import attrgetter, itemgetter
+from types import SimpleNamespace
 import werkzeug
 from werkzeug.utils import secure_filename
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # sin orjson se usa el proveedor JSON por defecto de Flask
+    orjson = None
+try:
+    import fcntl
+except ImportError:  # Windows: sin límite de extracciones por máquina, solo por proceso
+    fcntl = None
 
 # ------------------- CONFIGURACIÓN -------------------
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f'Tipo no serializable: {type(obj).__name__}')
+
+class OrjsonProvider(JSONProvider):
+    """Proveedor JSON de Flask basado en orjson (serializa datetime en ISO 8601)."""
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=self.OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_json_default, option=self.OPTIONS)
+        return self._app.response_class(body, mimetype='application/json')
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 CORS(app) # <--- 2. ACTIVAR CORS PARA TODA LA APP
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -26,7 +85,40 @@ migrate = Migrate(app, db)
 
 # ------------------- MODELOS DE LA BASE DE DATOS -------------------
 
-class Usuario(db.Model):
+class ColumnSerializer:
+    """
+    to_dict() generado a partir de las columnas de la tabla. El serializador
+    se construye una vez por modelo y sirve tanto para objetos ORM como para
+    filas de select_columns().
+    """
+    _serialize_exclude = ()
+    # Columnas que solo rellena el servidor: la ingesta masiva las ignora
+    _ingest_exclude = ()
+
+    @classmethod
+    def serializer(cls):
+        serialize = cls.__dict__.get('_serializer')
+        if serialize is None:
+            columns = [c for c in cls.__table__.c if c.key not in cls._serialize_exclude]
+            keys = tuple(c.key for c in columns)
+            date_keys = tuple(c.key for c in columns if isinstance(c.type, db.DateTime))
+            getter = attrgetter(*keys)
+
+            def serialize(obj):
+                data = dict(zip(keys, getter(obj)))
+                for key in date_keys:
+                    if data[key] is not None:
+                        data[key] = data[key].isoformat()
+                return data
+            cls._serializer = serialize
+        return serialize
+
+    def to_dict(self):
+        return self.serializer()(self)
+
+class Usuario(ColumnSerializer, db.Model):
+    _serialize_exclude = ('contrasena',)
+
     usuario_id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     correo = db.Column(db.String(100), unique=True, nullable=False)
@@ -40,14 +132,7 @@ class Usuario(db.Model):
     consentimiento = db.relationship('Consentimiento', backref='usuario', uselist=False, cascade="all, delete-orphan")
 
     def to_dict(self, include_profile=False):
-        data = {
-            'usuario_id': self.usuario_id,
-            'nombre': self.nombre,
-            'correo': self.correo,
-            'rol': self.rol,
-            'fecha_creacion': self.fecha_creacion.isoformat(),
-            'activo': self.activo
-        }
+        data = self.serializer()(self)
         if include_profile:
             if self.rol == 'Paciente' and self.paciente:
                 data['paciente'] = self.paciente.to_dict()
@@ -55,7 +140,11 @@ class Usuario(db.Model):
                 data['medico'] = self.medico.to_dict()
         return data
 
-class Paciente(db.Model):
+class Paciente(ColumnSerializer, db.Model):
+    __table_args__ = (
+        db.Index('ix_paciente_actualizado', 'actualizado_en', 'paciente_id'),
+    )
+
     paciente_id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.usuario_id'), nullable=False, unique=True)
     edad = db.Column(db.Integer)
@@ -63,34 +152,22 @@ class Paciente(db.Model):
     fecha_diagnostico = db.Column(db.String(50))
     contacto_emergencia = db.Column(db.String(100))
     notas_medicas = db.Column(db.Text)
+    actualizado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                               onupdate=datetime.utcnow, server_default=db.func.now())
     resultados = db.relationship('ResultadoPrueba', backref='paciente', lazy=True, cascade="all, delete-orphan")
 
-    def to_dict(self):
-        return {
-            'paciente_id': self.paciente_id,
-            'usuario_id': self.usuario_id,
-            'edad': self.edad,
-            'genero': self.genero,
-            'fecha_diagnostico': self.fecha_diagnostico,
-            'contacto_emergencia': self.contacto_emergencia,
-            'notas_medicas': self.notas_medicas
-        }
+class Medico(ColumnSerializer, db.Model):
+    __table_args__ = (
+        db.Index('ix_medico_actualizado', 'actualizado_en', 'medico_id'),
+    )
 
-class Medico(db.Model):
     medico_id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.usuario_id'), nullable=False, unique=True)
     especialidad = db.Column(db.String(100))
     centro_medico = db.Column(db.String(100))
     nro_colegiatura = db.Column(db.String(50))
-
-    def to_dict(self):
-        return {
-            'medico_id': self.medico_id,
-            'usuario_id': self.usuario_id,
-            'especialidad': self.especialidad,
-            'centro_medico': self.centro_medico,
-            'nro_colegiatura': self.nro_colegiatura
-        }
+    actualizado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                               onupdate=datetime.utcnow, server_default=db.func.now())
 
 class RelacionMedicoPaciente(db.Model):
     relacion_id = db.Column(db.Integer, primary_key=True)
@@ -98,27 +175,35 @@ class RelacionMedicoPaciente(db.Model):
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.paciente_id'), nullable=False)
     fecha_asignacion = db.Column(db.DateTime, default=datetime.utcnow)
 
-class ResultadoPrueba(db.Model):
+    __table_args__ = (
+        db.Index('ix_relacion_medico_paciente', 'medico_id', 'paciente_id'),
+        db.Index('ix_relacion_paciente', 'paciente_id'),
+    )
+
+class ResultadoPrueba(ColumnSerializer, db.Model):
+    _serialize_exclude = ('idempotency_key',)
+    _ingest_exclude = ('actualizado_en',)
+    __table_args__ = (
+        db.Index('ix_resultado_prueba_fecha_id', 'fecha', 'resultado_id'),
+        db.Index('ix_resultado_prueba_paciente_fecha', 'paciente_id', 'fecha', 'resultado_id'),
+        db.Index('ix_resultado_prueba_tipo_fecha', 'tipo_prueba', 'fecha', 'resultado_id'),
+        # Sincronización incremental: WHERE paciente_id = ? ORDER BY actualizado_en, resultado_id
+        db.Index('ix_resultado_prueba_paciente_actualizado', 'paciente_id', 'actualizado_en', 'resultado_id'),
+        db.UniqueConstraint('paciente_id', 'idempotency_key', name='uq_resultado_prueba_paciente_idempotency'),
+    )
+
     resultado_id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.paciente_id'), nullable=False)
     tipo_prueba = db.Column(db.String(50), nullable=False)
-    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    # NOT NULL: es la primera clave de la paginación por keyset
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     nivel_riesgo = db.Column(db.String(50))
     confianza = db.Column(db.Integer)
     observaciones = db.Column(db.Text)
     archivo_referencia = db.Column(db.String(200))
-
-    def to_dict(self):
-        return {
-            'resultado_id': self.resultado_id,
-            'paciente_id': self.paciente_id,
-            'tipo_prueba': self.tipo_prueba,
-            'fecha': self.fecha.isoformat(),
-            'nivel_riesgo': self.nivel_riesgo,
-            'confianza': self.confianza,
-            'observaciones': self.observaciones,
-            'archivo_referencia': self.archivo_referencia
-        }
+    idempotency_key = db.Column(db.String(100))
+    actualizado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                               onupdate=datetime.utcnow, server_default=db.func.now())
 
 class PruebaConfiguracion(db.Model):
     config_id = db.Column(db.Integer, primary_key=True)
@@ -133,10 +218,24 @@ class Consentimiento(db.Model):
     politica_version = db.Column(db.String(50))
     permisos_otorgados = db.Column(db.Boolean, default=False)
 
-class VoiceTest(db.Model):
+# Orden de las características de voz devueltas por extract_features
+FEATURE_NAMES = [
+    'fo', 'fhi', 'flo', 'jitter_percent', 'jitter_abs', 'rap', 'ppq', 'ddp',
+    'shimmer', 'shimmer_db', 'apq3', 'apq5', 'apq', 'dda', 'nhr', 'hnr',
+    'rpde', 'dfa', 'spread1', 'spread2', 'd2', 'ppe'
+]
+
+class VoiceTest(ColumnSerializer, db.Model):
+    _serialize_exclude = ('idempotency_key',)
+    _ingest_exclude = ('archivo_referencia', 'extractor_version', 'modelo_version', 'actualizado_en')
+    __table_args__ = (
+        # Reintentos del cliente con la misma clave no crean filas duplicadas
+        db.UniqueConstraint('user_id', 'idempotency_key', name='uq_voice_test_user_idempotency'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(100), nullable=False)
-    date = db.Column(db.String(50), nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
     probability = db.Column(db.Float, nullable=False)
     level = db.Column(db.String(50), nullable=False)
     fo = db.Column(db.Float)
@@ -161,44 +260,609 @@ class VoiceTest(db.Model):
     spread2 = db.Column(db.Float)
     d2 = db.Column(db.Float)
     ppe = db.Column(db.Float)
-    
-    def to_dict(self):
+    idempotency_key = db.Column(db.String(100))
+    # SHA-256 del audio en el almacén de audio (ver AudioStore)
+    archivo_referencia = db.Column(db.String(200))
+    # Versión del extractor (feature_store.extractor_version) y del modelo
+    # (model_version) con que se calcularon las características y la probabilidad
+    extractor_version = db.Column(db.String(16))
+    modelo_version = db.Column(db.String(16))
+    actualizado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                               onupdate=datetime.utcnow, server_default=db.func.now())
+
+# Historial por usuario: WHERE user_id = ? ORDER BY date DESC, id DESC
+db.Index('ix_voice_test_user_date', VoiceTest.user_id, VoiceTest.date.desc(), VoiceTest.id.desc())
+# Sincronización incremental: WHERE user_id = ? ORDER BY actualizado_en, id
+db.Index('ix_voice_test_user_actualizado', VoiceTest.user_id, VoiceTest.actualizado_en, VoiceTest.id)
+
+class FilaBorrada(ColumnSerializer, db.Model):
+    """
+    Fila de voice_test o resultado_prueba que ha salido de su tabla (archivada
+    o en una partición desacoplada). /sync la envía para que los clientes
+    también la borren; se guarda SYNC_BORRADOS_DIAS días.
+    """
+    __table_args__ = (
+        db.Index('ix_fila_borrada_borrado', 'borrado_en', 'id'),
+        db.Index('ix_fila_borrada_user', 'user_id', 'borrado_en', 'id'),
+        db.Index('ix_fila_borrada_paciente', 'paciente_id', 'borrado_en', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tabla = db.Column(db.String(50), nullable=False)
+    fila_id = db.Column(db.Integer, nullable=False)
+    # Propietario de la fila: user_id en voice_test, paciente_id en resultado_prueba
+    user_id = db.Column(db.String(100))
+    paciente_id = db.Column(db.Integer)
+    borrado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class VersionRecurso(db.Model):
+    """Contador de versión por recurso (p. ej. 'voice_results:<user_id>') para los ETag."""
+    clave = db.Column(db.String(150), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class TendenciaVoz(db.Model):
+    """
+    Resumen del historial de voz de un usuario, actualizado en cada insert
+    (ver voice_tests_inserted): estadísticas por característica en
+    `estadisticas` y las últimas pruebas en `ultimos`.
+    """
+    user_id = db.Column(db.String(100), primary_key=True)
+    n = db.Column(db.Integer, nullable=False, default=0)
+    ultima_fecha = db.Column(db.DateTime)
+    ultima_probabilidad = db.Column(db.Float)
+    ultimo_nivel = db.Column(db.String(50))
+    estadisticas = db.Column(db.JSON, nullable=False, default=dict)
+    ultimos = db.Column(db.JSON, nullable=False, default=list)
+
+class ResumenCohorte(db.Model):
+    """Agregados por cohorte materializados por refresh_cohort_summary()."""
+    dimension = db.Column(db.String(50), primary_key=True)
+    cohorte = db.Column(db.String(100), primary_key=True)
+    metrica = db.Column(db.String(50), primary_key=True)
+    pacientes = db.Column(db.Integer, nullable=False)
+    n = db.Column(db.Integer, nullable=False)
+    media = db.Column(db.Float)
+    desviacion = db.Column(db.Float)
+    p25 = db.Column(db.Float)
+    p50 = db.Column(db.Float)
+    p75 = db.Column(db.Float)
+    calculado_en = db.Column(db.DateTime, nullable=False)
+
+class TrabajoExtraccion(ColumnSerializer, db.Model):
+    """
+    Trabajo de la cola de extracción (ver COLA DE EXTRACCIÓN): el audio ya
+    está en el almacén de audio y un proceso scripts/extraction_worker.py
+    extrae las características, predice y, con guardar, guarda el VoiceTest.
+    """
+    _serialize_exclude = ('idempotency_key',)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'idempotency_key', name='uq_trabajo_extraccion_user_idempotency'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # pendiente, en_curso, hecho o fallido
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    archivo_referencia = db.Column(db.String(200), nullable=False)
+    user_id = db.Column(db.String(100))
+    fecha = db.Column(db.DateTime)
+    guardar = db.Column(db.Boolean, nullable=False, default=False)
+    idempotency_key = db.Column(db.String(100))
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    max_intentos = db.Column(db.Integer, nullable=False)
+    # No se reclama antes de esta fecha: fin del plazo del trabajador que lo
+    # tiene (en_curso) o espera antes del siguiente reintento (pendiente)
+    visible_desde = db.Column(db.DateTime, nullable=False)
+    trabajador = db.Column(db.String(100))
+    error = db.Column(db.Text)
+    # Misma respuesta que daría /predict_voice
+    resultado = db.Column(db.JSON)
+    creado = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    actualizado = db.Column(db.DateTime)
+
+# Reclamar trabajos: WHERE estado IN (...) AND visible_desde <= ? ORDER BY visible_desde, id
+db.Index('ix_trabajo_extraccion_cola', TrabajoExtraccion.estado, TrabajoExtraccion.visible_desde,
+         TrabajoExtraccion.id)
+
+# ------------------- PAGINACIÓN -------------------
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+class ApiError(Exception):
+    """Error de la API que se devuelve como {'error': mensaje} con su código HTTP."""
+    def __init__(self, mensaje, status=400, headers=None):
+        super().__init__(mensaje)
+        self.status = status
+        self.headers = headers or {}
+
+@app.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify({'error': str(e)}), e.status, e.headers
+
+def encode_cursor(values):
+    """Cursor opaco con los valores de la última fila de la página."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(columns):
+            raise ValueError
+        return [datetime.fromisoformat(v) if isinstance(c.type, db.DateTime) and v is not None else v
+                for c, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise ApiError('Cursor inválido')
+
+def parse_iso_datetime(value):
+    """Fecha ISO 8601 como datetime naive en UTC (las fechas sin zona se dejan tal cual)."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return parse_iso_datetime(value)
+    except ValueError:
+        raise ApiError(f"Fecha inválida en '{name}' (usar ISO 8601)")
+
+def pagination_requested():
+    return 'limit' in request.args or 'cursor' in request.args
+
+def keyset_after(stmt, columns, values, descending=False):
+    """Filtra las filas que van después de `values` en el orden de `columns`."""
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+    conditions = []
+    for i, column in enumerate(columns):
+        step = column < values[i] if descending else column > values[i]
+        conditions.append(db.and_(*[columns[j] == values[j] for j in range(i)], step))
+    return stmt.where(db.or_(*conditions))
+
+def keyset_page(stmt, columns, descending=False):
+    """
+    Aplica paginación por keyset sobre `columns` (la última debe ser única)
+    a una sentencia select(). Devuelve (filas, next_cursor); next_cursor es
+    None en la última página.
+    """
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    if cursor:
+        stmt = keyset_after(stmt, columns, decode_cursor(cursor, columns), descending)
+    order = [c.desc() if descending else c.asc() for c in columns]
+    rows = db.session.execute(stmt.order_by(*order).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+    return rows, next_cursor
+
+# ------------------- CONSULTAS -------------------
+
+def select_columns(model, columns=None):
+    """select() solo de las columnas que se serializan; no crea objetos ORM."""
+    if columns is None:
+        exclude = getattr(model, '_serialize_exclude', ())
+        columns = [c for c in model.__table__.c if c.key not in exclude]
+    return db.select(*columns)
+
+def row_to_dict(row):
+    """Convierte una fila de select_columns en un dict serializable."""
+    return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row._mapping.items()}
+
+def usuarios_con_perfil():
+    """Usuario con paciente/médico cargados en la misma consulta (sin lazy loads)."""
+    return Usuario.query.options(joinedload(Usuario.paciente), joinedload(Usuario.medico))
+
+# ------------------- RESPUESTAS EN STREAMING -------------------
+
+STREAM_BATCH_SIZE = 500
+
+def stream_json_array(stmt, serialize=row_to_dict, batch_size=STREAM_BATCH_SIZE, merge=None):
+    """
+    Devuelve un array JSON generado fila a fila. Las filas se leen con
+    yield_per (cursor de servidor en Postgres), así que la memoria no crece
+    con el tamaño del resultado y el primer byte sale de inmediato. `merge`,
+    si se indica, recibe el iterador de filas y devuelve el que se serializa.
+
+    La consulta y el primer lote se ejecutan antes de responder, así que un
+    error en ellos sale como un 500 normal. Un error posterior ya no puede
+    cambiar el código 200: se registra y el cliente recibe un array sin
+    cerrar, que no se puede parsear.
+    """
+    dumps = app.json.dumps
+    rows = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    if merge is not None:
+        rows = merge(rows)
+    rows = iter(rows)
+    first_chunk = [serialize(row) for row in itertools.islice(rows, batch_size)]
+
+    def generate():
+        # Se codifica cada lote completo y se quitan los corchetes
+        yield '[' + dumps(first_chunk)[1:-1]
+        first = not first_chunk
+        chunk = []
+        try:
+            for row in rows:
+                chunk.append(serialize(row))
+                if len(chunk) >= batch_size:
+                    yield ('' if first else ',') + dumps(chunk)[1:-1]
+                    first = False
+                    chunk = []
+        except Exception:
+            app.logger.exception('Error a mitad de una respuesta en streaming (%s)', request.path)
+            raise
+        if chunk:
+            yield ('' if first else ',') + dumps(chunk)[1:-1]
+        yield ']'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# ------------------- GET CONDICIONAL (ETag) -------------------
+
+# Cambiar si cambia el formato de las respuestas, para invalidar los ETag de los clientes
+ETAG_FORMATO = '4'
+
+def bump_version(*claves, conn=None):
+    """
+    Incrementa la versión de los recursos en la transacción actual (upsert),
+    o en la de `conn` si se pasa una conexión (solo Postgres y SQLite).
+    """
+    dialect = (conn if conn is not None else db.session.get_bind()).dialect.name
+    ejecutar = conn.execute if conn is not None else db.session.execute
+    for clave in claves:
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            ejecutar(
+                insert(VersionRecurso).values(clave=clave, version=1).on_conflict_do_update(
+                    index_elements=['clave'], set_={'version': VersionRecurso.version + 1}
+                )
+            )
+        else:
+            updated = db.session.execute(
+                db.update(VersionRecurso).where(VersionRecurso.clave == clave)
+                .values(version=VersionRecurso.version + 1)
+            ).rowcount
+            if not updated:
+                db.session.add(VersionRecurso(clave=clave, version=1))
+
+def conditional_response(clave, build, variante=''):
+    """
+    Responde 304 si el If-None-Match del cliente coincide con la versión
+    actual del recurso; si no, llama a build() para generar la respuesta.
+    Solo se consulta una fila de version_recurso en el caso 304. `variante`
+    distingue representaciones distintas del mismo recurso.
+    """
+    version = db.session.execute(
+        db.select(VersionRecurso.version).where(VersionRecurso.clave == clave)
+    ).scalar() or 0
+    return etag_response(version, build, variante)
+
+def etag_response(version, build, variante=''):
+    """Como conditional_response, con la versión ya leída (p. ej. de la propia fila)."""
+    etag = f'{ETAG_FORMATO}-{version}{variante}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = build()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# ------------------- ESCRITURA DIFERIDA (write-behind) -------------------
+
+# off: cada resultado se guarda con su propio commit
+# wait: se encola y la respuesta espera al commit del lote (201)
+# async: se encola y se responde en cuanto entra en la cola (202); lo que
+#        siga en la cola se pierde si el proceso muere
+app.config['VOICE_WRITE_BEHIND'] = os.environ.get('VOICE_WRITE_BEHIND', 'off')
+app.config['WRITE_BEHIND_MAX_ROWS'] = int(os.environ.get('WRITE_BEHIND_MAX_ROWS', 200))
+app.config['WRITE_BEHIND_INTERVAL_MS'] = int(os.environ.get('WRITE_BEHIND_INTERVAL_MS', 5))
+app.config['WRITE_BEHIND_QUEUE_SIZE'] = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 10000))
+app.config['WRITE_BEHIND_ACK_TIMEOUT'] = float(os.environ.get('WRITE_BEHIND_ACK_TIMEOUT', 10))
+
+class PendingWrite:
+    """Fila encolada; `hecho` se activa cuando su lote se ha guardado (o ha fallado)."""
+    __slots__ = ('fila', 'encolado', 'hecho', 'resultado', 'creado', 'error')
+
+    def __init__(self, fila):
+        self.fila = fila
+        self.encolado = time.perf_counter()
+        self.hecho = threading.Event()
+        self.resultado = None
+        self.creado = True
+        self.error = None
+
+class WriteBehindBuffer:
+    """
+    Cola acotada de filas de voice_test que un hilo de fondo guarda en lotes
+    de hasta `max_rows` filas o cada `interval_ms` milisegundos, con un solo
+    commit por lote. El hilo se arranca en el primer submit() de cada proceso.
+    """
+    def __init__(self, max_rows, interval_ms, capacidad):
+        self.max_rows = max_rows
+        self.interval = interval_ms / 1000
+        self.cola = queue.Queue(maxsize=capacidad)
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.lotes = 0
+        self.filas = 0
+        self.errores = 0
+        self.rechazadas = 0
+        self.flush_ms = deque(maxlen=1000)
+        self.espera_ms = deque(maxlen=1000)
+
+    def _ensure_started(self):
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+                self._pid = os.getpid()
+                self._hilo = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._hilo.start()
+
+    def submit(self, fila):
+        """Encola una fila; devuelve None si la cola está llena."""
+        self._ensure_started()
+        pendiente = PendingWrite(fila)
+        try:
+            self.cola.put_nowait(pendiente)
+        except queue.Full:
+            self.rechazadas += 1
+            return None
+        return pendiente
+
+    def close(self, timeout=5):
+        """Guarda lo que quede en la cola y detiene el hilo."""
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            self.cola.put(None)
+            self._hilo.join(timeout)
+
+    def _run(self):
+        parar = False
+        while not parar:
+            primero = self.cola.get()
+            if primero is None:
+                break
+            lote = [primero]
+            limite = time.monotonic() + self.interval
+            while len(lote) < self.max_rows:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self.cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if item is None:
+                    parar = True
+                    break
+                lote.append(item)
+            self._flush(lote)
+
+    def _flush(self, lote):
+        inicio = time.perf_counter()
+        with app.app_context():
+            try:
+                ids = db.session.execute(
+                    db.insert(VoiceTest.__table__).returning(VoiceTest.id, sort_by_parameter_order=True),
+                    [p.fila for p in lote]
+                ).scalars().all()
+                voice_tests_inserted([dict(p.fila, id=id_) for p, id_ in zip(lote, ids)])
+                db.session.commit()
+                for p, id_ in zip(lote, ids):
+                    p.resultado = VoiceTest(id=id_, **p.fila).to_dict()
+            except IntegrityError:
+                # Alguna clave de idempotencia ya estaba guardada: se resuelve fila a fila
+                db.session.rollback()
+                for p in lote:
+                    try:
+                        fila = p.fila
+                        resultado, p.creado = store_voice_test(fila['user_id'], fila['date'], fila['probability'],
+                                                        fila['level'], fila, fila['idempotency_key'])
+                        p.resultado = resultado.to_dict()
+                    except Exception as e:
+                        db.session.rollback()
+                        p.error = e
+            except Exception as e:
+                db.session.rollback()
+                for p in lote:
+                    p.error = e
+        fin = time.perf_counter()
+        self.lotes += 1
+        self.filas += len(lote)
+        self.flush_ms.append((fin - inicio) * 1000)
+        for p in lote:
+            if p.error is not None:
+                self.errores += 1
+                app.logger.error('Error guardando resultado diferido: %s', p.error)
+            self.espera_ms.append((fin - p.encolado) * 1000)
+            p.hecho.set()
+
+    def stats(self):
+        def percentiles(valores):
+            valores = sorted(valores)
+            if not valores:
+                return {'p50': None, 'p95': None, 'max': None}
+            return {'p50': round(valores[len(valores) // 2], 2),
+                    'p95': round(valores[int(len(valores) * 0.95)], 2),
+                    'max': round(valores[-1], 2)}
         return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'date': self.date,
-            'probability': self.probability,
-            'level': self.level,
-            'fo': self.fo,
-            'fhi': self.fhi,
-            'flo': self.flo,
-            'jitter_percent': self.jitter_percent,
-            'jitter_abs': self.jitter_abs,
-            'rap': self.rap,
-            'ppq': self.ppq,
-            'ddp': self.ddp,
-            'shimmer': self.shimmer,
-            'shimmer_db': self.shimmer_db,
-            'apq3': self.apq3,
-            'apq5': self.apq5,
-            'apq': self.apq,
-            'dda': self.dda,
-            'nhr': self.nhr,
-            'hnr': self.hnr,
-            'rpde': self.rpde,
-            'dfa': self.dfa,
-            'spread1': self.spread1,
-            'spread2': self.spread2,
-            'd2': self.d2,
-            'ppe': self.ppe
+            'modo': app.config['VOICE_WRITE_BEHIND'],
+            'profundidad': self.cola.qsize(),
+            'capacidad': self.cola.maxsize,
+            'lotes': self.lotes,
+            'filas': self.filas,
+            'filas_por_lote': round(self.filas / self.lotes, 1) if self.lotes else None,
+            'errores': self.errores,
+            'rechazadas': self.rechazadas,
+            'flush_ms': percentiles(self.flush_ms),
+            'espera_ms': percentiles(self.espera_ms),
         }
 
+write_behind = WriteBehindBuffer(app.config['WRITE_BEHIND_MAX_ROWS'],
+                                 app.config['WRITE_BEHIND_INTERVAL_MS'],
+                                 app.config['WRITE_BEHIND_QUEUE_SIZE'])
+atexit.register(write_behind.close)
+
+# ------------------- TENDENCIAS DE VOZ -------------------
+
+TREND_FEATURES = ['probability'] + FEATURE_NAMES
+TREND_EMA_ALPHA = 0.3
+# La línea base es la media de las primeras pruebas de cada característica
+TREND_BASELINE_N = 3
+TREND_LAST_N = 10
+
+def accumulate_trend(tendencia, fila):
+    """
+    Incorpora una prueba a la tendencia en O(1): media y varianza de
+    Welford, media móvil exponencial y línea base por característica, y
+    buffer con las TREND_LAST_N pruebas más recientes.
+    """
+    estadisticas = dict(tendencia.estadisticas or {})
+    for name in TREND_FEATURES:
+        x = fila.get(name)
+        if x is None:
+            continue
+        x = float(x)
+        st = estadisticas.get(name) or {'n': 0, 'media': 0.0, 'm2': 0.0, 'ema': None, 'base': None}
+        n = st['n'] + 1
+        delta = x - st['media']
+        media = st['media'] + delta / n
+        estadisticas[name] = {
+            'n': n,
+            'media': media,
+            'm2': st['m2'] + delta * (x - media),
+            'ema': x if st['ema'] is None else TREND_EMA_ALPHA * x + (1 - TREND_EMA_ALPHA) * st['ema'],
+            'base': media if n <= TREND_BASELINE_N else st['base'],
+        }
+    tendencia.estadisticas = estadisticas
+
+    fecha = fila['date']
+    ultimos = list(tendencia.ultimos or [])
+    ultimos.append({'id': fila['id'], 'date': fecha.isoformat(),
+                    'probability': fila['probability'], 'level': fila['level']})
+    # Los resultados sincronizados sin conexión pueden llegar desordenados
+    ultimos.sort(key=lambda u: (u['date'], u['id']))
+    tendencia.ultimos = ultimos[-TREND_LAST_N:]
+
+    tendencia.n = (tendencia.n or 0) + 1
+    if tendencia.ultima_fecha is None or fecha >= tendencia.ultima_fecha:
+        tendencia.ultima_fecha = fecha
+        tendencia.ultima_probabilidad = fila['probability']
+        tendencia.ultimo_nivel = fila['level']
+
+def voice_tests_inserted(filas):
+    """
+    Debe llamarse en la misma transacción en que se insertan filas de
+    voice_test (dicts con sus columnas e id): actualiza la versión del
+    historial (ETag) y la tendencia de cada usuario.
+
+    La media móvil y la línea base dependen del orden de las pruebas, que
+    es siempre (date, id): las filas se acumulan en ese orden y, si alguna
+    es anterior a la última prueba ya incorporada (resultados sincronizados
+    sin conexión), la tendencia de ese usuario se recalcula entera.
+    """
+    filas = sorted(filas, key=itemgetter('user_id', 'date', 'id'))
+    usuarios = sorted({f['user_id'] for f in filas})
+    bump_version(*[f'voice_results:{u}' for u in usuarios])
+    # Bloquear las filas en orden fijo evita interbloqueos entre lotes concurrentes
+    tendencias = {t.user_id: t for t in db.session.execute(
+        db.select(TendenciaVoz).where(TendenciaVoz.user_id.in_(usuarios))
+        .order_by(TendenciaVoz.user_id).with_for_update()
+    ).scalars()}
+    atrasados = set()
+    for fila in filas:
+        if fila['user_id'] in atrasados:
+            continue
+        tendencia = tendencias.get(fila['user_id'])
+        if tendencia is None:
+            tendencia = tendencias[fila['user_id']] = TendenciaVoz(user_id=fila['user_id'])
+            db.session.add(tendencia)
+        elif tendencia.ultima_fecha is not None and fila['date'] < tendencia.ultima_fecha:
+            atrasados.add(fila['user_id'])
+            continue
+        accumulate_trend(tendencia, fila)
+    if atrasados:
+        rebuild_trends(sorted(atrasados))
+
+def rebuild_trends(usuarios):
+    """
+    Recalcula las tendencias de estos usuarios desde voice_test y sus
+    pruebas archivadas, en orden (date, id), en la transacción actual (sin
+    commit) e invalida sus ETag. Devuelve (tendencias, pruebas leídas).
+    """
+    db.session.execute(db.delete(TendenciaVoz).where(TendenciaVoz.user_id.in_(usuarios)))
+    tendencias = {}
+    pruebas = 0
+
+    def acumular(user_id, filas):
+        nonlocal pruebas
+        for fila in merge_archived(filas, read_voice_archive(user_id, reverse=False), reverse=False):
+            tendencia = tendencias.get(user_id)
+            if tendencia is None:
+                tendencia = tendencias[user_id] = TendenciaVoz(user_id=user_id)
+            accumulate_trend(tendencia, fila._asdict() if hasattr(fila, '_asdict') else vars(fila))
+            pruebas += 1
+
+    stmt = (select_columns(VoiceTest).where(VoiceTest.user_id.in_(usuarios))
+            .order_by(VoiceTest.user_id, VoiceTest.date, VoiceTest.id))
+    vistos = set()
+    for user_id, grupo in itertools.groupby(db.session.execute(stmt), key=attrgetter('user_id')):
+        vistos.add(user_id)
+        acumular(user_id, grupo)
+    # Usuarios con todo el historial archivado
+    for user_id in sorted(set(usuarios) - vistos):
+        acumular(user_id, [])
+    db.session.add_all(tendencias.values())
+    # Invalida los ETag de /voice_trends (comparten versión con el historial)
+    bump_version(*[f'voice_results:{u}' for u in tendencias])
+    return len(tendencias), pruebas
+
+def trend_to_dict(tendencia):
+    def resumen(st):
+        varianza = st['m2'] / (st['n'] - 1) if st['n'] > 1 else None
+        return {
+            'n': st['n'],
+            'media': st['media'],
+            'desviacion': varianza ** 0.5 if varianza is not None else None,
+            'ema': st['ema'],
+            'base': st['base'],
+            'delta_base': st['ema'] - st['base'],
+        }
+    estadisticas = tendencia.estadisticas or {}
+    return {
+        'user_id': tendencia.user_id,
+        'n': tendencia.n,
+        'ultima_fecha': tendencia.ultima_fecha.isoformat() if tendencia.ultima_fecha else None,
+        'ultima_probabilidad': tendencia.ultima_probabilidad,
+        'ultimo_nivel': tendencia.ultimo_nivel,
+        'caracteristicas': {name: resumen(estadisticas[name]) for name in TREND_FEATURES if name in estadisticas},
+        'ultimos': tendencia.ultimos or [],
+    }
+
 # ------------------- RUTAS DE LA API -------------------
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'ok'}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Métricas del proceso: cola de escritura diferida (profundidad, latencia
+    de flush), almacén de audio, trabajos de la cola de extracción por estado
+    y saturación del control de admisión de /predict_voice.
+    """
+    return jsonify({'write_behind': write_behind.stats(), 'audio_store': audio_store.stats(),
+                    'cola_extraccion': extraction_queue_stats(),
+                    'admision_extraccion': admission_control.stats()}), 200
+
 @app.route('/registro.json', methods=['POST'])
 def registro():
     data = request.get_json()
@@ -207,34 +871,48 @@ def registro():
     if Usuario.query.filter_by(correo=data['correo']).first():
         return jsonify({'error': 'El correo ya está registrado'}), 409
     nuevo_usuario = Usuario(nombre=data['nombre'], correo=data['correo'], contrasena=data['contrasena'], rol=data['rol'])
-    db.session.add(nuevo_usuario)
-    db.session.flush()
+    # Asignar el perfil por la relación evita volver a cargarlo al serializar
     if data['rol'] == 'Paciente':
-        db.session.add(Paciente(usuario_id=nuevo_usuario.usuario_id))
+        nuevo_usuario.paciente = Paciente()
     elif data['rol'] == 'Médico':
-        db.session.add(Medico(usuario_id=nuevo_usuario.usuario_id))
+        nuevo_usuario.medico = Medico()
     if data.get('acepta_politicas', False):
-        db.session.add(Consentimiento(usuario_id=nuevo_usuario.usuario_id, politica_version="1.0", permisos_otorgados=True))
+        nuevo_usuario.consentimiento = Consentimiento(politica_version="1.0", permisos_otorgados=True)
+    db.session.add(nuevo_usuario)
+    db.session.flush()
+    # Serializar antes del commit: después los atributos expiran y se recargarían
+    usuario = nuevo_usuario.to_dict(include_profile=True)
     db.session.commit()
-    return jsonify({'mensaje': 'Usuario creado', 'usuario': nuevo_usuario.to_dict(include_profile=True)}), 201
+    return jsonify({'mensaje': 'Usuario creado', 'usuario': usuario}), 201
 
 @app.route('/login.json', methods=['POST'])
 def login():
     data = request.get_json()
-    usuario = Usuario.query.filter_by(correo=data.get('correo')).first()
+    usuario = usuarios_con_perfil().filter_by(correo=data.get('correo')).first()
     if not usuario or usuario.contrasena != data.get('contrasena'):
         return jsonify({'error': 'Credenciales inválidas'}), 401
     return jsonify({'mensaje': 'Login exitoso', 'usuario': usuario.to_dict(include_profile=True)})
 
 @app.route('/pacientes.json', methods=['GET'])
 def get_pacientes():
-    pacientes = Paciente.query.all()
-    return jsonify([p.to_dict() for p in pacientes])
+    """
+    Lista de pacientes. Con `limit` o `cursor` responde por páginas:
+    {'items': [...], 'next_cursor': ...}; sin ellos, la lista completa.
+    """
+    stmt = select_columns(Paciente)
+    if not pagination_requested():
+        return stream_json_array(stmt.order_by(Paciente.paciente_id), Paciente.serializer())
+    pacientes, next_cursor = keyset_page(stmt, [Paciente.paciente_id])
+    serialize = Paciente.serializer()
+    return jsonify({'items': [serialize(p) for p in pacientes], 'next_cursor': next_cursor})
 
 @app.route('/pacientes/<int:paciente_id>.json', methods=['GET'])
 def get_paciente(paciente_id):
-    paciente = Paciente.query.get_or_404(paciente_id)
-    return jsonify(paciente.to_dict())
+    """Perfil del paciente. El ETag sale de su actualizado_en: una sola consulta, también en el 304."""
+    paciente = db.session.get(Paciente, paciente_id)
+    if paciente is None:
+        raise ApiError('Paciente no encontrado', 404)
+    return etag_response(f'{paciente.actualizado_en:%Y%m%d%H%M%S%f}', lambda: jsonify(paciente.to_dict()))
 
 @app.route('/resultados.json', methods=['GET', 'POST'])
 def handle_resultados():
@@ -245,14 +923,289 @@ def handle_resultados():
             tipo_prueba=data['tipo_prueba'],
             nivel_riesgo=data.get('nivel_riesgo'),
             confianza=data.get('confianza'),
-            observaciones=data.get('observaciones')
+            observaciones=data.get('observaciones'),
+            archivo_referencia=data.get('archivo_referencia')
         )
         db.session.add(nuevo_resultado)
+        bump_version(f"resultados:{data['paciente_id']}")
         db.session.commit()
         return jsonify(nuevo_resultado.to_dict()), 201
     else:
-        resultados = ResultadoPrueba.query.all()
-        return jsonify([r.to_dict() for r in resultados])
+        # Filtros: paciente_id, tipo_prueba, desde, hasta (ISO 8601). Orden: más recientes primero
+        stmt = select_columns(ResultadoPrueba)
+        paciente_id = request.args.get('paciente_id', type=int)
+        if paciente_id is not None:
+            stmt = stmt.where(ResultadoPrueba.paciente_id == paciente_id)
+        tipo_prueba = request.args.get('tipo_prueba')
+        if tipo_prueba:
+            stmt = stmt.where(ResultadoPrueba.tipo_prueba == tipo_prueba)
+        desde = parse_date_arg('desde')
+        if desde is not None:
+            stmt = stmt.where(ResultadoPrueba.fecha >= desde)
+        hasta = parse_date_arg('hasta')
+        if hasta is not None:
+            stmt = stmt.where(ResultadoPrueba.fecha < hasta)
+
+        def build():
+            if not pagination_requested():
+                ordenado = stmt.order_by(ResultadoPrueba.fecha.desc(), ResultadoPrueba.resultado_id.desc())
+                return stream_json_array(ordenado, ResultadoPrueba.serializer())
+            resultados, next_cursor = keyset_page(
+                stmt, [ResultadoPrueba.fecha, ResultadoPrueba.resultado_id], descending=True
+            )
+            serialize = ResultadoPrueba.serializer()
+            return jsonify({'items': [serialize(r) for r in resultados], 'next_cursor': next_cursor})
+        if paciente_id is None:
+            return build()
+        # El historial de un paciente tiene su propia versión (resultados:<id>)
+        return conditional_response(f'resultados:{paciente_id}', build)
+
+# ------------------- PANEL DEL MÉDICO -------------------
+
+DASHBOARD_VOICE_COLUMNS = [VoiceTest.id, VoiceTest.date, VoiceTest.probability, VoiceTest.level]
+
+def latest_per_group(columns, group, order, where):
+    """
+    Subconsulta con la fila más reciente de cada grupo según `order`
+    (descendente). En Postgres usa DISTINCT ON, que recorre el índice
+    (group, order...) una vez; en el resto de bases, ROW_NUMBER() y el
+    llamador filtra rn = 1. Devuelve (subconsulta, condición de rn).
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        sub = (db.select(*columns).where(where).distinct(group)
+               .order_by(group, *[c.desc() for c in order]).subquery())
+        return sub, db.true()
+    rn = db.func.row_number().over(partition_by=group, order_by=[c.desc() for c in order])
+    sub = db.select(*columns, rn.label('rn')).where(where).subquery()
+    return sub, sub.c.rn == 1
+
+@app.route('/medicos/<int:medico_id>/dashboard.json', methods=['GET'])
+def medico_dashboard(medico_id):
+    """
+    Panel del médico: por cada paciente asignado, su último resultado de
+    prueba y su última prueba de voz, en una sola consulta. Paginado por
+    paciente_id: {'items': [...], 'next_cursor': ...}.
+    """
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    # Orden y cursor sobre la relación: el índice (medico_id, paciente_id) da ya el orden
+    clave = [RelacionMedicoPaciente.paciente_id]
+    pagina = (db.select(RelacionMedicoPaciente.paciente_id, Paciente.usuario_id, Usuario.nombre)
+              .join(Paciente, Paciente.paciente_id == RelacionMedicoPaciente.paciente_id)
+              .join(Usuario, Usuario.usuario_id == Paciente.usuario_id)
+              .where(RelacionMedicoPaciente.medico_id == medico_id))
+    cursor = request.args.get('cursor')
+    if cursor:
+        pagina = keyset_after(pagina, clave, decode_cursor(cursor, clave))
+    # Se limita primero la página de pacientes para buscar solo sus últimos resultados
+    pagina = pagina.order_by(*clave).limit(limit + 1).cte('pagina')
+
+    resultados = [c for c in select_columns(ResultadoPrueba).selected_columns]
+    ultimo_resultado, resultado_rn = latest_per_group(
+        resultados, ResultadoPrueba.paciente_id, [ResultadoPrueba.fecha, ResultadoPrueba.resultado_id],
+        ResultadoPrueba.paciente_id.in_(db.select(pagina.c.paciente_id)))
+    # voice_test.user_id guarda el usuario_id como texto
+    ultima_voz, voz_rn = latest_per_group(
+        [VoiceTest.user_id, *DASHBOARD_VOICE_COLUMNS], VoiceTest.user_id, [VoiceTest.date, VoiceTest.id],
+        VoiceTest.user_id.in_(db.select(db.cast(pagina.c.usuario_id, db.String))))
+
+    stmt = (db.select(pagina, *[ultimo_resultado.c[c.key].label(f'r_{c.key}') for c in resultados],
+                      *[ultima_voz.c[c.key].label(f'v_{c.key}') for c in DASHBOARD_VOICE_COLUMNS])
+            .outerjoin(ultimo_resultado, db.and_(ultimo_resultado.c.paciente_id == pagina.c.paciente_id, resultado_rn))
+            .outerjoin(ultima_voz, db.and_(ultima_voz.c.user_id == db.cast(pagina.c.usuario_id, db.String), voz_rn))
+            .order_by(pagina.c.paciente_id))
+    filas = db.session.execute(stmt).all()
+
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        next_cursor = encode_cursor([filas[-1].paciente_id])
+
+    def parte(fila, prefijo, columnas, clave):
+        datos = {c.key: getattr(fila, f'{prefijo}{c.key}') for c in columnas}
+        if datos[clave] is None:
+            return None
+        return {k: v.isoformat() if isinstance(v, datetime) else v for k, v in datos.items()}
+
+    items = [{
+        'paciente_id': fila.paciente_id,
+        'usuario_id': fila.usuario_id,
+        'nombre': fila.nombre,
+        'ultimo_resultado': parte(fila, 'r_', resultados, 'resultado_id'),
+        'ultima_prueba_voz': parte(fila, 'v_', DASHBOARD_VOICE_COLUMNS, 'id'),
+    } for fila in filas]
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+# ------------------- CONTROL DE ADMISIÓN -------------------
+
+# La extracción (pyin) ocupa una CPU durante segundos: sin límite, una ráfaga
+# de subidas deja todos los hilos del servidor dentro de ella y las rutas
+# ligeras (/login.json, /health) dejan de responder. Como mucho
+# EXTRACTION_MAX_PER_PROCESS extracciones a la vez por proceso (0: sin
+# límite) y EXTRACTION_MAX_PER_HOST entre todos los procesos de la máquina
+# (un fichero con flock por plaza, que se libera solo si el proceso muere).
+# Sin plaza libre, la petición espera como mucho EXTRACTION_QUEUE_TIMEOUT
+# segundos en una cola de EXTRACTION_QUEUE_SIZE; si no, 429 con Retry-After.
+app.config['EXTRACTION_MAX_PER_PROCESS'] = int(os.environ.get('EXTRACTION_MAX_PER_PROCESS', 2))
+app.config['EXTRACTION_MAX_PER_HOST'] = int(os.environ.get('EXTRACTION_MAX_PER_HOST',
+                                                           max(1, (os.cpu_count() or 2) - 1)))
+app.config['EXTRACTION_QUEUE_SIZE'] = int(os.environ.get('EXTRACTION_QUEUE_SIZE', 4))
+app.config['EXTRACTION_QUEUE_TIMEOUT'] = float(os.environ.get('EXTRACTION_QUEUE_TIMEOUT', 2))
+app.config['EXTRACTION_SLOTS_DIR'] = os.environ.get(
+    'EXTRACTION_SLOTS_DIR', os.path.join(tempfile.gettempdir(), 'parkinson_extraction_slots'))
+# La traza por etapa (X-Feature-Trace o ?trace=true en /predict_voice) activa
+# tracemalloc en todo el proceso y frena las demás extracciones: solo se
+# atiende con EXTRACTION_TRACE=1 o en modo debug.
+app.config['EXTRACTION_TRACE'] = os.environ.get('EXTRACTION_TRACE', '').lower() in ('1', 'true')
+
+HOST_SLOT_POLL_SECONDS = 0.05
+# Peso de cada extracción en la duración media (para Retry-After)
+DURATION_EMA_ALPHA = 0.2
+
+class AdmissionControl:
+    """Limita las extracciones simultáneas con una cola de espera acotada."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._en_curso = 0
+        self._esperando = 0
+        self._stats = {'admitidas': 0, 'rechazadas': 0, 'espera_total': 0.0}
+        self._duracion_media = None
+
+    @contextmanager
+    def slot(self):
+        """Ocupa una plaza de extracción mientras dura el bloque; sin plaza, ApiError 429."""
+        inicio = time.monotonic()
+        limite = inicio + app.config['EXTRACTION_QUEUE_TIMEOUT']
+        self._acquire_process(limite)
+        try:
+            plaza = self._acquire_host(limite)
+        except ApiError:
+            self._release_process(None)
+            raise
+        admitida = time.monotonic()
+        with self._cond:
+            self._stats['admitidas'] += 1
+            self._stats['espera_total'] += admitida - inicio
+        try:
+            yield
+        finally:
+            if plaza is not None:
+                plaza.close()  # libera el flock
+            self._release_process(time.monotonic() - admitida)
+
+    def _reject(self):
+        # Llamar con self._cond adquirido
+        self._stats['rechazadas'] += 1
+        raise ApiError('Servidor ocupado con otras extracciones; reintente más tarde', 429,
+                       {'Retry-After': str(self._retry_after())})
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._duracion_media or 1))
+
+    def _acquire_process(self, limite):
+        maximo = app.config['EXTRACTION_MAX_PER_PROCESS']
+        with self._cond:
+            if maximo > 0 and self._en_curso >= maximo:
+                if self._esperando >= app.config['EXTRACTION_QUEUE_SIZE']:
+                    self._reject()
+                self._esperando += 1
+                try:
+                    libre = self._cond.wait_for(lambda: self._en_curso < maximo,
+                                                timeout=max(0.0, limite - time.monotonic()))
+                finally:
+                    self._esperando -= 1
+                if not libre:
+                    self._reject()
+            self._en_curso += 1
+
+    def _release_process(self, duracion):
+        with self._cond:
+            self._en_curso -= 1
+            if duracion is not None:
+                self._duracion_media = (duracion if self._duracion_media is None else
+                                        DURATION_EMA_ALPHA * duracion
+                                        + (1 - DURATION_EMA_ALPHA) * self._duracion_media)
+            self._cond.notify()
+
+    def _host_slots(self):
+        maximo = app.config['EXTRACTION_MAX_PER_HOST']
+        if fcntl is None or maximo <= 0:
+            return []
+        directorio = app.config['EXTRACTION_SLOTS_DIR']
+        os.makedirs(directorio, exist_ok=True)
+        return [os.path.join(directorio, f'plaza-{i}.lock') for i in range(maximo)]
+
+    def _acquire_host(self, limite):
+        """Fichero abierto con el flock de una plaza libre de la máquina (None sin límite)."""
+        rutas = self._host_slots()
+        if not rutas:
+            return None
+        while True:
+            for ruta in rutas:
+                f = open(ruta, 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except BlockingIOError:
+                    f.close()
+            if time.monotonic() >= limite:
+                with self._cond:
+                    self._reject()
+            time.sleep(HOST_SLOT_POLL_SECONDS)
+
+    def _host_busy(self, rutas):
+        """
+        Plazas de la máquina ocupadas ahora, leídas de /proc/locks sin tocar
+        los flock: una sonda que los tomara haría que una extracción viera
+        su plaza ocupada y respondiera 429. None si no se puede saber
+        (fuera de Linux).
+        """
+        plazas = set()
+        for ruta in rutas:
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            plazas.add((os.major(st.st_dev), os.minor(st.st_dev), st.st_ino))
+        try:
+            with open('/proc/locks') as f:
+                lineas = f.read().splitlines()
+        except OSError:
+            return None
+        ocupadas = set()
+        for linea in lineas:
+            # "1: FLOCK  ADVISORY  WRITE 1234 fe:00:5678 0 EOF"; las esperas llevan "->" tras el número
+            campos = linea.split()
+            if len(campos) < 6 or campos[1] != 'FLOCK':
+                continue
+            mayor, menor, inodo = campos[5].split(':')
+            clave = (int(mayor, 16), int(menor, 16), int(inodo))
+            if clave in plazas:
+                ocupadas.add(clave)
+        return len(ocupadas)
+
+    def stats(self):
+        rutas = self._host_slots()
+        ocupadas = self._host_busy(rutas) if rutas else None
+        maximo = app.config['EXTRACTION_MAX_PER_PROCESS']
+        with self._cond:
+            admitidas = self._stats['admitidas']
+            return {
+                'en_curso': self._en_curso,
+                'esperando': self._esperando,
+                'limite_proceso': maximo,
+                'saturacion_proceso': round(self._en_curso / maximo, 3) if maximo > 0 else None,
+                'en_curso_maquina': ocupadas,
+                'limite_maquina': len(rutas) or None,
+                'saturacion_maquina': round(ocupadas / len(rutas), 3) if ocupadas is not None else None,
+                'admitidas': admitidas,
+                'rechazadas': self._stats['rechazadas'],
+                'espera_media_ms': round(self._stats['espera_total'] / admitidas * 1000, 1) if admitidas else None,
+                'duracion_media_s': round(self._duracion_media, 3) if self._duracion_media is not None else None,
+                'retry_after': self._retry_after(),
+            }
+
+admission_control = AdmissionControl()
 
 # ------------------- ENDPOINTS DE VOZ -------------------
 
@@ -274,10 +1227,165 @@ def load_model():
         print(f"Error cargando modelo: {e}")
         return None, None
 
+_model_version_cache = {}
+
+def model_version():
+    """Hash de model.pkl y scaler.pkl; se recalcula solo si cambian los ficheros."""
+    rutas = [os.path.join(basedir, 'model.pkl'), os.path.join(basedir, 'scaler.pkl')]
+    try:
+        firma = tuple((os.stat(r).st_mtime_ns, os.stat(r).st_size) for r in rutas)
+    except FileNotFoundError:
+        return None
+    if _model_version_cache.get('firma') != firma:
+        digest = hashlib.sha256()
+        for ruta in rutas:
+            digest.update(file_sha256(ruta).encode())
+        _model_version_cache.update(firma=firma, version=digest.hexdigest()[:16])
+    return _model_version_cache['version']
+
+def risk_level(probability):
+    if probability < 0.33:
+        return "Bajo"
+    elif probability < 0.66:
+        return "Medio"
+    return "Alto"
+
+def predict_features_batch(features):
+    """
+    Probabilidad y nivel de Parkinson para varios vectores de características
+    sin normalizar (uno por fila), con una sola llamada al modelo.
+    """
+    import numpy as np
+    model, scaler = load_model()
+    if model is None or scaler is None:
+        raise ApiError('Modelo no disponible. Ejecute train_model.py primero', 500)
+
+    features = np.array(features, dtype=float, ndmin=2)
+    # Normalizar features con clipping para evitar valores fuera de rango
+    if hasattr(scaler, 'mean_') and hasattr(scaler, 'scale_'):
+        n = min(features.shape[1], len(scaler.mean_), len(scaler.scale_))
+        mean = np.asarray(scaler.mean_[:n], dtype=float)
+        scale = np.asarray(scaler.scale_[:n], dtype=float)
+        clipped = np.clip(features[:, :n], mean - 3 * scale, mean + 3 * scale)
+        features[:, :n] = np.where(scale == 0, features[:, :n], clipped)
+
+    # Probabilidad de Parkinson
+    probabilities = model.predict_proba(scaler.transform(features))[:, 1]
+    return [(float(p), risk_level(p)) for p in probabilities]
+
+def predict_features(features):
+    """Probabilidad y nivel de Parkinson para un vector de características sin normalizar."""
+    return predict_features_batch([features])[0]
+
+def get_idempotency_key():
+    """Clave de idempotencia del cliente (cabecera Idempotency-Key o campo idempotency_key)."""
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if key is None and request.is_json:
+        key = (request.get_json(silent=True) or {}).get('idempotency_key')
+    if key is not None and not 0 < len(key) <= 100:
+        raise ApiError('Idempotency-Key inválida (1 a 100 caracteres)')
+    return key
+
+def find_voice_test(user_id, idempotency_key):
+    if idempotency_key is None:
+        return None
+    return VoiceTest.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
+
+def voice_test_row(user_id, fecha, probability, level, parametros, idempotency_key=None,
+                   archivo_referencia=None, extractor_version=None, modelo_version=None):
+    """Valores de columna de un VoiceTest (todas las claves, para inserciones por lotes)."""
+    return dict(
+        user_id=user_id,
+        date=fecha,
+        probability=probability,
+        level=level,
+        idempotency_key=idempotency_key,
+        archivo_referencia=archivo_referencia,
+        extractor_version=extractor_version,
+        modelo_version=modelo_version,
+        **{name: parametros.get(name) for name in FEATURE_NAMES}
+    )
+
+def store_voice_test(user_id, fecha, probability, level, parametros, idempotency_key=None,
+                     **columnas):
+    """
+    Guarda un VoiceTest y actualiza la versión del historial y la tendencia
+    en la misma transacción. Devuelve (resultado, creado); si ya existe una fila con la
+    misma clave de idempotencia se devuelve esa sin insertar otra.
+    """
+    existente = find_voice_test(user_id, idempotency_key)
+    if existente is not None:
+        return existente, False
+
+    fila = voice_test_row(user_id, fecha, probability, level, parametros, idempotency_key, **columnas)
+    resultado = VoiceTest(**fila)
+    db.session.add(resultado)
+    try:
+        db.session.flush()
+        voice_tests_inserted([dict(fila, id=resultado.id)])
+        db.session.commit()
+    except IntegrityError:
+        # Otra petición con la misma clave se guardó entre la consulta y el commit
+        db.session.rollback()
+        existente = find_voice_test(user_id, idempotency_key)
+        if existente is None:
+            raise
+        return existente, False
+    return resultado, True
+
+def voice_test_response(resultado, extra=None):
+    """Respuesta de predicción construida a partir de un VoiceTest guardado."""
+    respuesta = {
+        'probabilidad': resultado.probability,
+        'nivel': resultado.level,
+        'parametros': {name: getattr(resultado, name) for name in FEATURE_NAMES},
+        'resultado': resultado.to_dict(),
+    }
+    respuesta.update(extra or {})
+    return respuesta
+
+def flag_requested(name):
+    return (request.args.get(name, '').lower() in ('1', 'true')
+            or request.form.get(name, '').lower() in ('1', 'true'))
+
 @app.route('/predict_voice', methods=['POST'])
 def predict_voice():
-    """Endpoint para predecir Parkinson desde un archivo de audio"""
+    """
+    Endpoint para predecir Parkinson desde un archivo de audio.
+
+    Con save=true (query o campo del formulario) y el campo user_id, además
+    guarda el VoiceTest con las características calculadas en el servidor y
+    devuelve el registro en 'resultado' (201). Con Idempotency-Key, un
+    reintento devuelve el registro ya guardado (200) sin volver a extraer.
+    Si no se pueden extraer las características responde 422 y no guarda
+    nada.
+
+    Con save=true o store=true el audio se guarda en el almacén de audio y
+    su SHA-256 se devuelve (y guarda) en 'archivo_referencia'.
+
+    Con async=true la extracción no se hace en la petición: el audio se
+    guarda, se encola un TrabajoExtraccion y se responde 202 con el trabajo
+    (consultar en /trabajos/<id>).
+    """
     try:
+        save = flag_requested('save')
+        asincrono = flag_requested('async')
+        # Con store=true se guarda el audio aunque no se guarde el resultado
+        guardar_audio = save or asincrono or flag_requested('store')
+        user_id = request.form.get('user_id')
+        idempotency_key = None
+        if save:
+            if not user_id:
+                return jsonify({'error': 'Falta user_id para guardar el resultado'}), 400
+            idempotency_key = get_idempotency_key()
+            try:
+                fecha = parse_iso_datetime(request.form['date']) if request.form.get('date') else datetime.utcnow()
+            except ValueError:
+                return jsonify({'error': "Fecha inválida en 'date' (usar ISO 8601)"}), 400
+            existente = find_voice_test(user_id, idempotency_key)
+            if existente is not None:
+                return jsonify(voice_test_response(existente)), 200
+
         # Verificar que se envió un archivo
         if 'audio' not in request.files:
             return jsonify({'error': 'No se recibió archivo de audio'}), 400
@@ -290,69 +1398,80 @@ def predict_voice():
         with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
             file.save(tmp_file.name)
             tmp_path = tmp_file.name
-        
+        extension = os.path.splitext(secure_filename(file.filename))[1].lower() or '.wav'
+
+        if asincrono:
+            # La extracción la hace un proceso scripts/extraction_worker.py
+            try:
+                archivo_referencia = audio_store.put(tmp_path, extension)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            trabajo = enqueue_extraction(archivo_referencia, user_id, fecha if save else None,
+                                         save, idempotency_key)
+            return jsonify(trabajo.to_dict()), 202, {'Location': f'/trabajos/{trabajo.id}'}
+
+        archivo_referencia = None
         try:
             # Importar extractor de features
             sys.path.insert(0, os.path.join(basedir, 'scripts'))
             from extract_features import extract_features
+            from feature_store import extractor_version
             
-            # Extraer características
-            features = extract_features(tmp_path)
-            raw_features = list(features)
-            
-            # Cargar modelo, scaler y calibración
-            model, scaler = load_model()
-            if model is None or scaler is None:
-                return jsonify({'error': 'Modelo no disponible. Ejecute train_model.py primero'}), 500
-            
-            # Normalizar features con clipping para evitar valores fuera de rango
-            if hasattr(scaler, 'mean_') and hasattr(scaler, 'scale_'):
-                mean = scaler.mean_
-                scale = scaler.scale_
-                clipped_features = []
-                for idx, value in enumerate(features):
-                    if idx >= len(mean) or idx >= len(scale) or scale[idx] == 0:
-                        clipped_features.append(value)
-                        continue
-                    lower = mean[idx] - 3 * scale[idx]
-                    upper = mean[idx] + 3 * scale[idx]
-                    clipped_features.append(float(min(max(value, lower), upper)))
-                features = clipped_features
-            
-            features_array = scaler.transform([features])
-            
-            # Predecir
-            probability = model.predict_proba(features_array)[0][1]  # Probabilidad de Parkinson
-            
-            # Determinar nivel
-            if probability < 0.33:
-                level = "Bajo"
-            elif probability < 0.66:
-                level = "Medio"
-            else:
-                level = "Alto"
-            
-            # Mapear características a nombres
-            feature_names = [
-                'fo', 'fhi', 'flo', 'jitter_percent', 'jitter_abs', 'rap', 'ppq', 'ddp',
-                'shimmer', 'shimmer_db', 'apq3', 'apq5', 'apq', 'dda', 'nhr', 'hnr',
-                'rpde', 'dfa', 'spread1', 'spread2', 'd2', 'ppe'
-            ]
-            
-            parametros = {name: float(value) for name, value in zip(feature_names, raw_features)}
-            
-            return jsonify({
-                'probabilidad': float(probability),
-                'nivel': level,
-                'parametros': parametros
-            }), 200
-            
+            # Extraer características (con traza opcional por etapa); sin
+            # plaza libre, 429 con Retry-After
+            want_trace = ((app.config['EXTRACTION_TRACE'] or app.debug)
+                          and (request.headers.get('X-Feature-Trace', '').lower() in ('1', 'true')
+                               or flag_requested('trace')))
+            trace = None
+            try:
+                with admission_control.slot():
+                    # Con save=true un fallo no puede acabar guardado como 22 ceros
+                    if want_trace:
+                        features, trace = extract_features(tmp_path, trace=True, raise_errors=save)
+                    else:
+                        features = extract_features(tmp_path, raise_errors=save)
+            except ApiError:
+                raise
+            except Exception as e:
+                raise ApiError(f'No se pudieron extraer las características del audio: {str(e) or type(e).__name__}', 422)
+            if trace is not None:
+                app.logger.info('Traza de extracción: %s', trace.to_dict())
+
+            if guardar_audio:
+                # El fichero pasa al almacén de audio; se comprime fuera de la petición
+                archivo_referencia = audio_store.put(tmp_path, extension)
         finally:
             # Eliminar archivo temporal
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
-                
+
+        probability, level = predict_features(list(features))
+        parametros = {name: float(value) for name, value in zip(FEATURE_NAMES, features)}
+        extra = {'trace': trace.to_dict()} if trace is not None else None
+
+        if save:
+            resultado, creado = store_voice_test(user_id, fecha, probability, level,
+                                                 parametros, idempotency_key,
+                                                 archivo_referencia=archivo_referencia,
+                                                 extractor_version=extractor_version(),
+                                                 modelo_version=model_version())
+            return jsonify(voice_test_response(resultado, extra)), 201 if creado else 200
+
+        respuesta = {
+            'probabilidad': probability,
+            'nivel': level,
+            'parametros': parametros
+        }
+        if archivo_referencia is not None:
+            respuesta['archivo_referencia'] = archivo_referencia
+        respuesta.update(extra or {})
+        return jsonify(respuesta), 200
+
+    except ApiError:
+        raise
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Error procesando audio: {str(e)}'}), 500
 
 @app.route('/save_voice_result', methods=['POST'])
@@ -363,52 +1482,1482 @@ def save_voice_result():
         
         if not data or not data.get('user_id') or not data.get('probability') or not data.get('level'):
             return jsonify({'error': 'Faltan datos requeridos'}), 400
+        try:
+            fecha = parse_iso_datetime(data['date']) if data.get('date') else datetime.utcnow()
+        except (ValueError, TypeError, AttributeError):
+            return jsonify({'error': "Fecha inválida en 'date' (usar ISO 8601)"}), 400
         
-        nuevo_resultado = VoiceTest(
-            user_id=data['user_id'],
-            date=data.get('date', datetime.utcnow().isoformat()),
-            probability=data['probability'],
-            level=data['level'],
-            fo=data.get('parametros', {}).get('fo'),
-            fhi=data.get('parametros', {}).get('fhi'),
-            flo=data.get('parametros', {}).get('flo'),
-            jitter_percent=data.get('parametros', {}).get('jitter_percent'),
-            jitter_abs=data.get('parametros', {}).get('jitter_abs'),
-            rap=data.get('parametros', {}).get('rap'),
-            ppq=data.get('parametros', {}).get('ppq'),
-            ddp=data.get('parametros', {}).get('ddp'),
-            shimmer=data.get('parametros', {}).get('shimmer'),
-            shimmer_db=data.get('parametros', {}).get('shimmer_db'),
-            apq3=data.get('parametros', {}).get('apq3'),
-            apq5=data.get('parametros', {}).get('apq5'),
-            apq=data.get('parametros', {}).get('apq'),
-            dda=data.get('parametros', {}).get('dda'),
-            nhr=data.get('parametros', {}).get('nhr'),
-            hnr=data.get('parametros', {}).get('hnr'),
-            rpde=data.get('parametros', {}).get('rpde'),
-            dfa=data.get('parametros', {}).get('dfa'),
-            spread1=data.get('parametros', {}).get('spread1'),
-            spread2=data.get('parametros', {}).get('spread2'),
-            d2=data.get('parametros', {}).get('d2'),
-            ppe=data.get('parametros', {}).get('ppe')
+        parametros = data.get('parametros') or {}
+        idempotency_key = get_idempotency_key()
+        modo = app.config['VOICE_WRITE_BEHIND']
+        if modo in ('wait', 'async'):
+            existente = find_voice_test(data['user_id'], idempotency_key)
+            if existente is not None:
+                return jsonify({'mensaje': 'Resultado guardado', 'resultado': existente.to_dict()}), 200
+            # Cerrar la transacción de lectura antes de esperar: en SQLite bloquearía el commit del lote
+            db.session.rollback()
+            pendiente = write_behind.submit(voice_test_row(
+                data['user_id'], fecha, data['probability'], data['level'], parametros, idempotency_key
+            ))
+            # Con la cola llena se guarda directamente (contrapresión sobre el cliente)
+            if pendiente is not None:
+                if modo == 'async' or not pendiente.hecho.wait(app.config['WRITE_BEHIND_ACK_TIMEOUT']):
+                    return jsonify({'mensaje': 'Resultado en cola', 'pendiente': True}), 202
+                if pendiente.error is not None:
+                    return jsonify({'error': f'Error guardando resultado: {pendiente.error}'}), 500
+                return jsonify({'mensaje': 'Resultado guardado', 'resultado': pendiente.resultado}), 201 if pendiente.creado else 200
+
+        resultado, creado = store_voice_test(
+            data['user_id'], fecha, data['probability'], data['level'], parametros, idempotency_key
         )
         
-        db.session.add(nuevo_resultado)
-        db.session.commit()
-        
-        return jsonify({'mensaje': 'Resultado guardado', 'resultado': nuevo_resultado.to_dict()}), 201
+        return jsonify({'mensaje': 'Resultado guardado', 'resultado': resultado.to_dict()}), 201 if creado else 200
         
+    except ApiError:
+        raise
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Error guardando resultado: {str(e)}'}), 500
 
 @app.route('/voice_results/<user_id>', methods=['GET'])
 def get_voice_results(user_id):
-    """Obtener resultados de voz de un usuario"""
+    """
+    Obtener resultados de voz de un usuario. Con ?archivo=true se incluyen
+    también las pruebas antiguas movidas al archivo Parquet.
+    """
     try:
-        resultados = VoiceTest.query.filter_by(user_id=user_id).order_by(VoiceTest.date.desc()).all()
-        return jsonify([r.to_dict() for r in resultados]), 200
+        stmt = select_columns(VoiceTest).where(VoiceTest.user_id == user_id).order_by(VoiceTest.date.desc(), VoiceTest.id.desc())
+        if not flag_requested('archivo'):
+            return conditional_response(
+                f'voice_results:{user_id}',
+                lambda: stream_json_array(stmt, VoiceTest.serializer())
+            )
+        return conditional_response(
+            f'voice_results:{user_id}',
+            lambda: stream_json_array(stmt, VoiceTest.serializer(),
+                                      merge=lambda filas: merge_archived(filas, read_voice_archive(user_id))),
+            variante='-archivo'
+        )
     except Exception as e:
         return jsonify({'error': f'Error obteniendo resultados: {str(e)}'}), 500
 
+@app.route('/voice_trends/<user_id>', methods=['GET'])
+def get_voice_trends(user_id):
+    """
+    Tendencia del historial de voz de un usuario (media, desviación, media
+    móvil exponencial y variación respecto a la línea base por característica,
+    y últimas pruebas). Se lee una sola fila; no se recorre el historial.
+    """
+    def build():
+        tendencia = db.session.get(TendenciaVoz, user_id)
+        if tendencia is None:
+            raise ApiError('El usuario no tiene resultados de voz', 404)
+        return jsonify(trend_to_dict(tendencia))
+    # La tendencia cambia exactamente cuando cambia el historial
+    return conditional_response(f'voice_results:{user_id}', build)
+
+# ------------------- SINCRONIZACIÓN INCREMENTAL -------------------
+
+# Segundos que /sync deja sin entregar tras el horizonte (ver sync_horizon)
+app.config['SYNC_LAG_SECONDS'] = int(os.environ.get('SYNC_LAG_SECONDS', 5))
+# Días que se guardan las filas borradas (fila_borrada) para /sync
+app.config['SYNC_BORRADOS_DIAS'] = int(os.environ.get('SYNC_BORRADOS_DIAS', 90))
+
+SYNC_LIMIT = 500
+
+# tabla -> (modelo, columnas de la marca, filtros admitidos {parámetro: columna}).
+# Todas se siguen por (actualizado_en, id); 'borrados' son las filas de
+# voice_test y resultado_prueba que han salido de la tabla (FilaBorrada).
+SYNC_TABLAS = {
+    'voice_test': (VoiceTest, [VoiceTest.actualizado_en, VoiceTest.id], {'user_id': VoiceTest.user_id}),
+    'resultado_prueba': (ResultadoPrueba, [ResultadoPrueba.actualizado_en, ResultadoPrueba.resultado_id],
+                         {'paciente_id': ResultadoPrueba.paciente_id}),
+    'paciente': (Paciente, [Paciente.actualizado_en, Paciente.paciente_id],
+                 {'paciente_id': Paciente.paciente_id}),
+    'medico': (Medico, [Medico.actualizado_en, Medico.medico_id], {'medico_id': Medico.medico_id}),
+    'borrados': (FilaBorrada, [FilaBorrada.borrado_en, FilaBorrada.id],
+                 {'user_id': FilaBorrada.user_id, 'paciente_id': FilaBorrada.paciente_id}),
+}
+
+def sync_filters():
+    """
+    Filtros de /sync ({parámetro: valor}). user_id (el de voice_test, que es
+    el usuario_id) y paciente_id identifican a la misma persona: si llega uno
+    se deduce el otro y, de user_id, también el medico_id de su perfil de
+    médico. None indica que la persona no tiene perfil en esa tabla.
+    """
+    filtros = {}
+    for parametro in ('paciente_id', 'medico_id'):
+        valor = request.args.get(parametro)
+        if valor is not None:
+            if not valor.isdigit():
+                raise ApiError(f"'{parametro}' debe ser un entero")
+            filtros[parametro] = int(valor)
+    user_id = request.args.get('user_id')
+    if user_id is not None:
+        filtros['user_id'] = user_id
+        usuario_id = int(user_id) if user_id.isdigit() else None
+        if 'paciente_id' not in filtros:
+            filtros['paciente_id'] = db.session.execute(
+                db.select(Paciente.paciente_id).where(Paciente.usuario_id == usuario_id)).scalar()
+        if 'medico_id' not in filtros:
+            filtros['medico_id'] = db.session.execute(
+                db.select(Medico.medico_id).where(Medico.usuario_id == usuario_id)).scalar()
+    elif 'paciente_id' in filtros:
+        filtros['user_id'] = db.session.execute(
+            db.select(db.cast(Paciente.usuario_id, db.String))
+            .where(Paciente.paciente_id == filtros['paciente_id'])).scalar()
+    return filtros
+
+def sync_horizon():
+    """
+    Marca máxima que /sync puede entregar sin saltarse filas. actualizado_en
+    se fija al escribir, pero la fila solo se ve al confirmar la transacción:
+    otra más lenta puede confirmar después filas con una marca anterior a la
+    ya entregada (lo mismo que pasaba con los huecos de las secuencias). En
+    Postgres el horizonte es el inicio de la transacción abierta más antigua
+    de la base de datos, que no puede tener filas con una marca anterior;
+    SYNC_LAG_SECONDS cubre además la diferencia de reloj entre los servidores
+    y, en SQLite, la duración de una transacción de escritura.
+    """
+    horizonte = datetime.utcnow()
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Se consulta antes de leer las filas: en READ COMMITTED cada consulta
+        # posterior ve lo confirmado por las transacciones que ya no aparecen
+        inicio = db.session.execute(db.text(
+            "SELECT timezone('UTC', min(xact_start)) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND backend_type = 'client backend'"
+        )).scalar()
+        if inicio is not None:
+            horizonte = min(horizonte, inicio)
+    return horizonte - timedelta(seconds=app.config['SYNC_LAG_SECONDS'])
+
+def record_deleted(tabla, filas, conn=None):
+    """Guarda en fila_borrada las filas [(id, propietario)] que salen de `tabla`."""
+    propietario = PARTITION_VERSION_KEYS[tabla][0]
+    ahora = datetime.utcnow()
+    valores = [{'tabla': tabla, 'fila_id': fila_id, propietario: valor, 'borrado_en': ahora}
+               for fila_id, valor in filas]
+    if valores:
+        (conn or db.session).execute(db.insert(FilaBorrada.__table__), valores)
+
+def purge_deleted(conn=None):
+    """Borra de fila_borrada las filas de hace más de SYNC_BORRADOS_DIAS días."""
+    limite = datetime.utcnow() - timedelta(days=app.config['SYNC_BORRADOS_DIAS'])
+    return (conn or db.session).execute(db.delete(FilaBorrada).where(FilaBorrada.borrado_en < limite)).rowcount
+
+@app.route('/sync', methods=['GET'])
+def sync():
+    """
+    Devuelve solo las filas nuevas, modificadas o borradas desde la última
+    sincronización.
+
+    Por cada tabla se envía su marca (?voice_test=<marca>&paciente=<marca>...);
+    sin marca se devuelve desde el principio. Filtros: user_id, paciente_id y
+    medico_id (ver sync_filters); si se filtra, cada tabla pedida tiene que
+    quedar filtrada. `tablas` limita las tablas consultadas. Cada tabla
+    responde {'items', 'marca', 'completo'}: si 'completo' es false quedan más
+    cambios y se vuelve a pedir con la nueva marca. Los 'borrados' se aplican
+    después de los items de las demás tablas. Con una marca de una versión
+    anterior, o de 'borrados' más antigua que SYNC_BORRADOS_DIAS, responde 410:
+    hay que sincronizar desde el principio.
+    """
+    nombres = request.args.get('tablas')
+    nombres = nombres.split(',') if nombres else list(SYNC_TABLAS)
+    desconocidas = [n for n in nombres if n not in SYNC_TABLAS]
+    if desconocidas:
+        raise ApiError(f"Tablas desconocidas: {', '.join(desconocidas)}")
+    limit = max(1, min(request.args.get('limit', SYNC_LIMIT, type=int), MAX_PAGE_SIZE))
+
+    filtros = sync_filters()
+    sin_filtro = [n for n in nombres if not filtros.keys() & SYNC_TABLAS[n][2].keys()]
+    if filtros and sin_filtro:
+        raise ApiError(f"Sin filtro para: {', '.join(sin_filtro)} (limítelas con 'tablas')")
+    horizonte = sync_horizon()
+
+    respuesta = {}
+    for nombre in nombres:
+        model, columns, admitidos = SYNC_TABLAS[nombre]
+        stmt = select_columns(model).where(columns[0] < horizonte)
+        if filtros:
+            # Una persona sin perfil en la tabla (valor None) no tiene filas
+            stmt = stmt.where(db.or_(db.false(), *[columna == filtros[parametro]
+                                                   for parametro, columna in admitidos.items()
+                                                   if filtros.get(parametro) is not None]))
+        marca = request.args.get(nombre)
+        if marca:
+            try:
+                valores = decode_cursor(marca, columns)
+            except ApiError:
+                raise ApiError(f"Marca de '{nombre}' no válida o de una versión anterior: "
+                               f"sincronice desde el principio", 410)
+            retencion = timedelta(days=app.config['SYNC_BORRADOS_DIAS'])
+            if model is FilaBorrada and valores[0] < datetime.utcnow() - retencion:
+                raise ApiError("La marca de 'borrados' es anterior a los borrados guardados: "
+                               "sincronice desde el principio", 410)
+            stmt = keyset_after(stmt, columns, valores)
+        filas = db.session.execute(stmt.order_by(*columns).limit(limit + 1)).all()
+        completo = len(filas) <= limit
+        filas = filas[:limit]
+        if filas:
+            marca = encode_cursor([getattr(filas[-1], c.key) for c in columns])
+        serialize = model.serializer()
+        respuesta[nombre] = {'items': [serialize(f) for f in filas], 'marca': marca or None, 'completo': completo}
+    return jsonify({'tablas': respuesta, 'completo': all(t['completo'] for t in respuesta.values())}), 200
+
+# ------------------- TAREAS EN SEGUNDO PLANO -------------------
+
+class BackgroundJob:
+    """
+    Hilo que ejecuta run_once() cada app.config[intervalo_config] segundos
+    (0 lo desactiva). Se arranca en la primera petición de cada proceso,
+    también tras un fork de los workers.
+    """
+    nombre = None
+    intervalo_config = None
+
+    def __init__(self):
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self.ultimo_error = None
+
+    def enabled(self):
+        return bool(app.config[self.intervalo_config])
+
+    def wake(self):
+        """Adelanta la siguiente ejecución."""
+        self._despertar.set()
+
+    def ensure_started(self):
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        if not self.enabled():
+            return
+        with self._lock:
+            if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+                self._pid = os.getpid()
+                self._hilo = threading.Thread(target=self._run, name=self.nombre, daemon=True)
+                self._hilo.start()
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            with app.app_context():
+                try:
+                    self.run_once()
+                    self.ultimo_error = None
+                except Exception as e:
+                    db.session.rollback()
+                    self.ultimo_error = str(e)
+                    app.logger.error('Error en la tarea %s: %s', self.nombre, e)
+            self._despertar.wait(app.config[self.intervalo_config])
+            self._despertar.clear()
+
+@app.before_request
+def start_background_jobs():
+    cohort_scheduler.ensure_started()
+    partition_maintainer.ensure_started()
+    audio_store.ensure_started()
+
+# ------------------- ANALÍTICA POR COHORTES -------------------
+
+app.config['COHORT_REFRESH_SECONDS'] = int(os.environ.get('COHORT_REFRESH_SECONDS', 900))
+app.config['COHORT_CACHE_SECONDS'] = int(os.environ.get('COHORT_CACHE_SECONDS', 60))
+
+# Retry-After de la respuesta 503 mientras se calcula el primer resumen
+COHORT_RETRY_AFTER = 5
+
+COHORT_METRICS = ['probability', 'jitter_percent', 'shimmer', 'hnr', 'ppe']
+COHORT_QUANTILES = (('p25', 0.25), ('p50', 0.5), ('p75', 0.75))
+SIN_DATO = 'Sin dato'
+
+def cohort_dimensions():
+    """dimensión -> (expresión de la cohorte, joins adicionales sobre la consulta base)."""
+    edad = db.case(
+        (Paciente.edad < 40, '<40'),
+        (Paciente.edad < 50, '40-49'),
+        (Paciente.edad < 60, '50-59'),
+        (Paciente.edad < 70, '60-69'),
+        (Paciente.edad < 80, '70-79'),
+        (Paciente.edad >= 80, '80+'),
+        else_=SIN_DATO,
+    )
+
+    def por_centro(stmt):
+        # Un paciente con médicos de varios centros cuenta en cada uno
+        return (stmt.outerjoin(RelacionMedicoPaciente, RelacionMedicoPaciente.paciente_id == Paciente.paciente_id)
+                .outerjoin(Medico, Medico.medico_id == RelacionMedicoPaciente.medico_id))
+
+    return {
+        'edad': (edad, None),
+        'genero': (db.func.coalesce(Paciente.genero, SIN_DATO), None),
+        'centro_medico': (db.func.coalesce(Medico.centro_medico, SIN_DATO), por_centro),
+    }
+
+def cohort_aggregates(dimension):
+    """
+    Agrega en SQL las métricas de voz por cohorte de una dimensión. Devuelve
+    dicts con pacientes, n, media, desviación (poblacional) y cuartiles.
+    En Postgres la varianza es var_pop y los cuartiles percentile_cont. En
+    SQLite la varianza se calcula en dos pasadas (media de la cohorte con
+    AVG() OVER y después la media de las diferencias al cuadrado) y los
+    cuartiles son el valor de rango más cercano, con ROW_NUMBER()/COUNT()
+    por cohorte.
+    """
+    cohorte, joins = cohort_dimensions()[dimension]
+    base = (db.select(cohorte.label('cohorte'), Paciente.paciente_id,
+                      *[getattr(VoiceTest, m) for m in COHORT_METRICS])
+            .select_from(VoiceTest)
+            .join(Paciente, VoiceTest.user_id == db.cast(Paciente.usuario_id, db.String)))
+    if joins is not None:
+        base = joins(base)
+
+    postgres = db.session.get_bind().dialect.name == 'postgresql'
+    if not postgres:
+        extra = []
+        for m in COHORT_METRICS:
+            col = getattr(VoiceTest, m)
+            extra.append(db.func.row_number().over(partition_by=cohorte, order_by=col.asc().nulls_last()).label(f'rn_{m}'))
+            extra.append(db.func.count(col).over(partition_by=cohorte).label(f'cnt_{m}'))
+            extra.append(db.func.avg(col).over(partition_by=cohorte).label(f'avg_{m}'))
+        base = base.add_columns(*extra)
+    sub = base.subquery()
+
+    columnas = [sub.c.cohorte, db.func.count(db.distinct(sub.c.paciente_id)).label('pacientes')]
+    for m in COHORT_METRICS:
+        x = sub.c[m]
+        if postgres:
+            varianza = db.func.var_pop(x)
+        else:
+            # Sin cancelación catastrófica: la diferencia se hace antes de elevar al cuadrado
+            diferencia = x - sub.c[f'avg_{m}']
+            varianza = db.func.avg(diferencia * diferencia)
+        columnas += [db.func.count(x).label(f'{m}_n'), db.func.avg(x).label(f'{m}_media'),
+                     varianza.label(f'{m}_varianza')]
+        for nombre, q in COHORT_QUANTILES:
+            if postgres:
+                cuantil = db.func.percentile_cont(q).within_group(x)
+            else:
+                # El menor valor cuyo rango alcanza q * n (rango más cercano)
+                cuantil = db.func.min(db.case((sub.c[f'rn_{m}'] >= q * sub.c[f'cnt_{m}'], x)))
+            columnas.append(cuantil.label(f'{m}_{nombre}'))
+    filas = db.session.execute(db.select(*columnas).group_by(sub.c.cohorte)).all()
+
+    resultado = []
+    for fila in filas:
+        for m in COHORT_METRICS:
+            n = getattr(fila, f'{m}_n')
+            media = getattr(fila, f'{m}_media')
+            desviacion = None
+            if n:
+                media = float(media)
+                desviacion = max(float(getattr(fila, f'{m}_varianza')), 0.0) ** 0.5
+            resultado.append(dict(
+                dimension=dimension, cohorte=fila.cohorte, metrica=m, pacientes=fila.pacientes,
+                n=n, media=media if n else None, desviacion=desviacion,
+                **{nombre: getattr(fila, f'{m}_{nombre}') for nombre, _ in COHORT_QUANTILES}
+            ))
+    return resultado
+
+_cohort_refresh_lock = threading.Lock()
+
+def refresh_cohort_summary(max_age=None):
+    """
+    Recalcula resumen_cohorte en una transacción y devuelve la fecha de
+    cálculo. Con max_age (segundos), si una vez obtenido el bloqueo el
+    último cálculo guardado es más reciente, no se recalcula: lo acaba de
+    hacer otro proceso mientras este esperaba.
+    """
+    with _cohort_refresh_lock:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # Un solo refresco a la vez entre procesos (se libera con el commit)
+            db.session.execute(db.text("SELECT pg_advisory_xact_lock(hashtext('resumen_cohorte'))"))
+        if max_age is not None:
+            ultimo = db.session.execute(db.select(db.func.max(ResumenCohorte.calculado_en))).scalar()
+            if ultimo is not None and (datetime.utcnow() - ultimo).total_seconds() < max_age:
+                db.session.rollback()
+                return ultimo
+        calculado_en = datetime.utcnow()
+        filas = [dict(f, calculado_en=calculado_en) for d in cohort_dimensions() for f in cohort_aggregates(d)]
+        db.session.execute(db.delete(ResumenCohorte))
+        if filas:
+            db.session.execute(db.insert(ResumenCohorte.__table__), filas)
+        db.session.commit()
+        cohort_cache.clear()
+        return calculado_en
+
+class CohortScheduler(BackgroundJob):
+    """
+    Refresca resumen_cohorte cada COHORT_REFRESH_SECONDS. Con varios
+    procesos, cada uno solo refresca si el último cálculo guardado (de
+    cualquier proceso) ya ha vencido.
+    """
+    nombre = 'cohort-refresh'
+    intervalo_config = 'COHORT_REFRESH_SECONDS'
+
+    def __init__(self):
+        super().__init__()
+        # Última vez que este proceso vio terminado un refresco (aunque no
+        # hubiera pruebas que agregar y resumen_cohorte siga vacía)
+        self.ultimo_refresco = None
+
+    def run_once(self):
+        ultimo = db.session.execute(db.select(db.func.max(ResumenCohorte.calculado_en))).scalar()
+        intervalo = app.config[self.intervalo_config]
+        if ultimo is None or (datetime.utcnow() - ultimo).total_seconds() >= intervalo:
+            refresh_cohort_summary(max_age=intervalo)
+        self.ultimo_refresco = datetime.utcnow()
+
+cohort_scheduler = CohortScheduler()
+# dimensión -> (respuesta, momento de carga); se vacía en cada refresco local
+cohort_cache = {}
+
+def load_cohort_summary(dimension):
+    """Lee de resumen_cohorte los agregados de una dimensión, agrupados por cohorte."""
+    filas = db.session.execute(
+        db.select(ResumenCohorte).where(ResumenCohorte.dimension == dimension)
+        .order_by(ResumenCohorte.cohorte, ResumenCohorte.metrica)
+    ).scalars().all()
+    cohortes = {}
+    for f in filas:
+        cohorte = cohortes.setdefault(f.cohorte, {'cohorte': f.cohorte, 'pacientes': f.pacientes, 'metricas': {}})
+        cohorte['metricas'][f.metrica] = {'n': f.n, 'media': f.media, 'desviacion': f.desviacion,
+                                          'p25': f.p25, 'p50': f.p50, 'p75': f.p75}
+    calculado_en = max((f.calculado_en for f in filas), default=None)
+    return {'cohortes': list(cohortes.values()), 'calculado_en': calculado_en}
+
+@app.route('/analytics/cohortes', methods=['GET'])
+def get_cohort_analytics():
+    """
+    Distribución de la probabilidad y de las características principales de
+    voz por cohorte (?dimension=edad|genero|centro_medico). Se sirve desde
+    la tabla materializada resumen_cohorte, con caché en memoria; la
+    respuesta indica cuándo se calculó y si está obsoleta.
+    """
+    dimension = request.args.get('dimension', 'edad')
+    if dimension not in cohort_dimensions():
+        raise ApiError(f"Dimensión desconocida: {dimension} (usar {', '.join(cohort_dimensions())})")
+
+    ahora = time.monotonic()
+    entrada = cohort_cache.get(dimension)
+    cache = 'hit'
+    if entrada is None or ahora - entrada[1] > app.config['COHORT_CACHE_SECONDS']:
+        cache = 'miss'
+        datos = load_cohort_summary(dimension)
+        if datos['calculado_en'] is None and cohort_scheduler.ultimo_refresco is None:
+            # Primera vez: todavía no hay nada materializado
+            if cohort_scheduler.enabled():
+                # Lo calcula el hilo de refresco; la petición no espera
+                cohort_scheduler.wake()
+                raise ApiError('Calculando los agregados por cohorte; reintente en unos segundos', 503,
+                               {'Retry-After': str(COHORT_RETRY_AFTER)})
+            # Sin refresco en segundo plano: se calcula aquí, salvo que otro proceso ya lo haya hecho
+            refresh_cohort_summary(max_age=math.inf)
+            cohort_scheduler.ultimo_refresco = datetime.utcnow()
+            datos = load_cohort_summary(dimension)
+        entrada = cohort_cache[dimension] = (datos, ahora)
+    datos = entrada[0]
+
+    intervalo = app.config['COHORT_REFRESH_SECONDS']
+    antiguedad = (datetime.utcnow() - datos['calculado_en']).total_seconds() if datos['calculado_en'] else None
+    return jsonify({
+        'dimension': dimension,
+        'cohortes': datos['cohortes'],
+        'calculado_en': datos['calculado_en'].isoformat() if datos['calculado_en'] else None,
+        'antiguedad_s': round(antiguedad, 1) if antiguedad is not None else None,
+        'intervalo_refresco_s': intervalo,
+        # Un refresco perdido (p. ej. por error) deja los datos obsoletos
+        'obsoleto': bool(intervalo) and antiguedad is not None and antiguedad > 2 * intervalo,
+        'cache': cache,
+        'ultimo_error': cohort_scheduler.ultimo_error,
+    }), 200
+
+# ------------------- PARTICIONADO POR MES -------------------
+
+# En Postgres, voice_test y resultado_prueba están particionadas por rangos
+# mensuales de su fecha (migración e5c0a7d3b918), con una partición por
+# defecto para las fechas sin partición propia. Los modelos y las consultas
+# no cambian: Postgres enruta cada insert a su mes y descarta las particiones
+# que quedan fuera del rango consultado. En SQLite son tablas normales y el
+# mantenimiento no hace nada.
+app.config['PARTITION_MONTHS_AHEAD'] = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+app.config['PARTITION_RETENTION_MONTHS'] = int(os.environ.get('PARTITION_RETENTION_MONTHS', 0))
+app.config['PARTITION_MAINTENANCE_SECONDS'] = int(os.environ.get('PARTITION_MAINTENANCE_SECONDS', 6 * 3600))
+
+# tabla -> columna de partición
+PARTITIONED_TABLES = {'voice_test': 'date', 'resultado_prueba': 'fecha'}
+# tabla -> (columna, prefijo de la clave de versión) de los recursos con ETag
+# que dejan de incluir las filas de una partición desacoplada
+PARTITION_VERSION_KEYS = {'voice_test': ('user_id', 'voice_results:'),
+                          'resultado_prueba': ('paciente_id', 'resultados:')}
+PARTITION_NAME_RE = re.compile(r'^(?P<tabla>\w+)_p(?P<anio>\d{4})_(?P<mes>\d{2})$')
+
+def add_months(fecha, meses):
+    """Primer día del mes situado `meses` después del de `fecha`."""
+    indice = fecha.year * 12 + fecha.month - 1 + meses
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+def partition_name(tabla, mes):
+    return f'{tabla}_p{mes:%Y_%m}'
+
+def is_partitioned(conn, tabla):
+    if conn.dialect.name != 'postgresql':
+        return False
+    return bool(conn.execute(db.text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:tabla)"),
+                             {'tabla': tabla}).scalar())
+
+def list_partitions(conn, tabla):
+    """Particiones mensuales adjuntas a la tabla: {primer día del mes: nombre}."""
+    nombres = conn.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:tabla)"
+    ), {'tabla': tabla}).scalars()
+    meses = {}
+    for nombre in nombres:
+        m = PARTITION_NAME_RE.match(nombre)
+        if m and m['tabla'] == tabla:
+            meses[datetime(int(m['anio']), int(m['mes']), 1)] = nombre
+    return meses
+
+def set_lock_timeout(conn):
+    # ATTACH y DETACH bloquean la partición por defecto o la tabla padre: si
+    # esperasen tras una consulta larga, todas las demás harían cola detrás.
+    # Mejor fallar y reintentar en la siguiente pasada.
+    conn.execute(db.text("SET LOCAL lock_timeout = '5s'"))
+
+def create_partition(conn, tabla, mes):
+    """
+    Crea y adjunta la partición de un mes. Las filas de ese mes que hubieran
+    caído en la partición por defecto se mueven a la nueva en la misma
+    transacción (si no, el ATTACH fallaría).
+    """
+    columna = PARTITIONED_TABLES[tabla]
+    nombre = partition_name(tabla, mes)
+    desde, hasta = mes, add_months(mes, 1)
+    set_lock_timeout(conn)
+    conn.execute(db.text(f'CREATE TABLE {nombre} (LIKE {tabla} INCLUDING DEFAULTS)'))
+    conn.execute(db.text(
+        f'WITH movidas AS (DELETE FROM {tabla}_default WHERE {columna} >= :desde AND {columna} < :hasta '
+        f'RETURNING *) INSERT INTO {nombre} SELECT * FROM movidas'
+    ), {'desde': desde, 'hasta': hasta})
+    # Los índices y restricciones de la tabla padre se crean en la partición al adjuntarla
+    conn.execute(db.text(
+        f"ALTER TABLE {tabla} ATTACH PARTITION {nombre} "
+        f"FOR VALUES FROM ('{desde:%Y-%m-%d}') TO ('{hasta:%Y-%m-%d}')"
+    ))
+    return nombre
+
+def detach_partition(conn, tabla, nombre):
+    """
+    Desacopla una partición; queda como tabla suelta con sus datos. No se
+    usa DETACH ... CONCURRENTLY porque Postgres no lo permite cuando hay
+    partición por defecto. En la misma transacción invalida los ETag de los
+    usuarios o pacientes con filas en ella, que desaparecen de su historial,
+    y guarda sus filas en fila_borrada para /sync.
+    """
+    set_lock_timeout(conn)
+    columna, prefijo = PARTITION_VERSION_KEYS[tabla]
+    afectados = conn.execute(db.text(f'SELECT DISTINCT {columna} FROM {nombre} ORDER BY 1')).scalars()
+    bump_version(*[f'{prefijo}{valor}' for valor in afectados], conn=conn)
+    pk = db.metadata.tables[tabla].primary_key.columns.values()[0].name
+    conn.execute(db.text(
+        f"INSERT INTO fila_borrada (tabla, fila_id, {columna}, borrado_en) "
+        f"SELECT :tabla, {pk}, {columna}, :ahora FROM {nombre}"
+    ), {'tabla': tabla, 'ahora': datetime.utcnow()})
+    conn.execute(db.text(f'ALTER TABLE {tabla} DETACH PARTITION {nombre}'))
+
+def maintain_partitions(ahora=None):
+    """
+    Crea las particiones del mes actual y de los PARTITION_MONTHS_AHEAD
+    siguientes y, con PARTITION_RETENTION_MONTHS > 0, desacopla las de meses
+    anteriores a la retención; después purga fila_borrada. Devuelve {tabla:
+    {'creadas': [...], 'desacopladas': [...]}}; vacío si la base de datos no
+    está particionada.
+    """
+    ahora = ahora or datetime.utcnow()
+    actual = add_months(ahora, 0)
+    objetivo = [add_months(actual, i) for i in range(app.config['PARTITION_MONTHS_AHEAD'] + 1)]
+    retencion = app.config['PARTITION_RETENTION_MONTHS']
+    resumen = {}
+    with db.engine.connect() as conn:
+        if conn.dialect.name != 'postgresql':
+            return resumen
+        # Un solo mantenimiento a la vez entre procesos; los demás se lo saltan
+        if not conn.execute(db.text("SELECT pg_try_advisory_lock(hashtext('particiones'))")).scalar():
+            return resumen
+        try:
+            for tabla in PARTITIONED_TABLES:
+                if not is_partitioned(conn, tabla):
+                    continue
+                existentes = list_partitions(conn, tabla)
+                conn.commit()
+                hecho = resumen[tabla] = {'creadas': [], 'desacopladas': []}
+                for mes in objetivo:
+                    if mes not in existentes:
+                        with conn.begin():
+                            hecho['creadas'].append(create_partition(conn, tabla, mes))
+                if retencion > 0:
+                    limite = add_months(actual, -retencion)
+                    for mes, nombre in sorted(existentes.items()):
+                        if mes < limite:
+                            with conn.begin():
+                                detach_partition(conn, tabla, nombre)
+                            hecho['desacopladas'].append(nombre)
+            purge_deleted(conn)
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.execute(db.text("SELECT pg_advisory_unlock(hashtext('particiones'))"))
+            conn.commit()
+    return resumen
+
+class PartitionMaintainer(BackgroundJob):
+    """Mantiene las particiones mensuales cada PARTITION_MAINTENANCE_SECONDS (solo en Postgres)."""
+    nombre = 'partition-maintenance'
+    intervalo_config = 'PARTITION_MAINTENANCE_SECONDS'
+
+    def enabled(self):
+        return super().enabled() and db.engine.dialect.name == 'postgresql'
+
+    def run_once(self):
+        for tabla, hecho in maintain_partitions().items():
+            if hecho['creadas'] or hecho['desacopladas']:
+                app.logger.info('Particiones de %s: creadas %s, desacopladas %s',
+                                tabla, hecho['creadas'], hecho['desacopladas'])
+
+partition_maintainer = PartitionMaintainer()
+
+# ------------------- ARCHIVO DE PRUEBAS DE VOZ -------------------
+
+# Las pruebas de voz antiguas se mueven de voice_test a ficheros Parquet
+# (zstd) en VOICE_ARCHIVE_DIR/month=AAAA-MM/bucket=NN/, con el bucket sacado
+# de un hash del user_id: el historial archivado de un usuario solo lee su
+# bucket de cada mes. VOICE_ARCHIVE_BUCKETS no se puede cambiar una vez hay
+# datos archivados. Se archiva con scripts/archive_voice_tests.py y se lee
+# con /voice_results/<user_id>?archivo=true.
+app.config['VOICE_ARCHIVE_DIR'] = os.environ.get('VOICE_ARCHIVE_DIR', os.path.join(basedir, 'archive', 'voice_test'))
+app.config['VOICE_ARCHIVE_BUCKETS'] = int(os.environ.get('VOICE_ARCHIVE_BUCKETS', 16))
+
+ARCHIVE_BATCH_SIZE = 50000
+ARCHIVE_DELETE_CHUNK = 1000
+
+def archive_bucket(user_id):
+    # crc32 y no hash(): tiene que dar lo mismo en todos los procesos y ejecuciones
+    return zlib.crc32(str(user_id).encode()) % app.config['VOICE_ARCHIVE_BUCKETS']
+
+def arrow_schema(columnas):
+    """Esquema Arrow para [(nombre, tipo SQLAlchemy)]."""
+    import pyarrow as pa
+    tipos = [(db.Integer, pa.int64()), (db.Float, pa.float64()), (db.DateTime, pa.timestamp('us'))]
+    return pa.schema([
+        pa.field(nombre, next((t for clase, t in tipos if isinstance(tipo, clase)), pa.string()))
+        for nombre, tipo in columnas
+    ])
+
+def voice_archive_schema():
+    """Esquema Arrow con todas las columnas de voice_test."""
+    return arrow_schema([(c.key, c.type) for c in VoiceTest.__table__.c])
+
+def write_voice_archive(filas):
+    """
+    Escribe filas de voice_test (dicts) en el archivo, un fichero por mes y
+    bucket, ordenado por (user_id, date, id) para que las estadísticas del
+    fichero permitan saltárselo al buscar otro usuario. Se escribe con un
+    nombre oculto y se renombra tras el fsync: nunca se lee un fichero a
+    medias. Devuelve el número de ficheros escritos.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = voice_archive_schema()
+    grupos = {}
+    for fila in filas:
+        grupos.setdefault((f"{fila['date']:%Y-%m}", archive_bucket(fila['user_id'])), []).append(fila)
+    nombre = f"part-{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+    for (mes, bucket), grupo in grupos.items():
+        grupo.sort(key=itemgetter('user_id', 'date', 'id'))
+        directorio = os.path.join(app.config['VOICE_ARCHIVE_DIR'], f'month={mes}', f'bucket={bucket:02d}')
+        os.makedirs(directorio, exist_ok=True)
+        temporal = os.path.join(directorio, '.' + nombre)
+        pq.write_table(pa.Table.from_pylist(grupo, schema=schema), temporal, compression='zstd')
+        with open(temporal, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temporal, os.path.join(directorio, nombre))
+    return len(grupos)
+
+def read_voice_archive(user_id, reverse=True):
+    """
+    Pruebas archivadas de un usuario, en orden (date, id) descendente (o
+    ascendente). Se lee y se ordena un mes cada vez, así que la memoria la
+    marcan las pruebas del usuario en un mes, no todo su archivo.
+    """
+    bucket = f'bucket={archive_bucket(user_id):02d}'
+    # month=AAAA-MM: el orden alfabético es el cronológico
+    meses = sorted(glob.glob(os.path.join(app.config['VOICE_ARCHIVE_DIR'], 'month=*')), reverse=reverse)
+    schema = None
+    for mes in meses:
+        rutas = glob.glob(os.path.join(mes, bucket, '*.parquet'))
+        if not rutas:
+            continue
+        import pyarrow.dataset as ds
+        schema = schema or voice_archive_schema()
+        tabla = ds.dataset(rutas, schema=schema, format='parquet').to_table(
+            filter=ds.field('user_id') == str(user_id))
+        filas = [SimpleNamespace(**fila) for fila in tabla.to_pylist()]
+        filas.sort(key=attrgetter('date', 'id'), reverse=reverse)
+        yield from filas
+
+def merge_archived(filas, archivadas, reverse=True):
+    """
+    Mezcla el historial de voice_test (en orden date DESC, id DESC, o ASC con
+    reverse=False) con las filas archivadas en el mismo orden. Una fila que
+    esté en los dos sitios (archivado interrumpido antes del borrado) sale
+    una sola vez: las copias tienen la misma clave y quedan seguidas.
+    """
+    anterior = None
+    for fila in heapq.merge(filas, archivadas, key=attrgetter('date', 'id'), reverse=reverse):
+        if fila.id != anterior:
+            anterior = fila.id
+            yield fila
+
+def archive_voice_tests(antes_de, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Mueve al archivo las pruebas de voz con date < antes_de. Cada lote se
+    escribe en Parquet y después se borra de voice_test (por ids, en trozos)
+    en la misma transacción que sube la versión de los historiales afectados
+    y guarda las filas en fila_borrada. Al final purga fila_borrada.
+    Devuelve {'filas', 'ficheros', 'usuarios'}.
+    """
+    columnas = list(VoiceTest.__table__.c)
+    resumen = {'filas': 0, 'ficheros': 0}
+    afectados = set()
+    while True:
+        filas = [dict(f._mapping) for f in db.session.execute(
+            db.select(*columnas).where(VoiceTest.date < antes_de)
+            .order_by(VoiceTest.date, VoiceTest.id).limit(batch_size)
+        )]
+        if not filas:
+            break
+        resumen['ficheros'] += write_voice_archive(filas)
+        ids = [f['id'] for f in filas]
+        for i in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+            # La condición sobre date permite descartar particiones en Postgres
+            db.session.execute(db.delete(VoiceTest).where(
+                VoiceTest.date < antes_de, VoiceTest.id.in_(ids[i:i + ARCHIVE_DELETE_CHUNK])))
+        record_deleted('voice_test', [(f['id'], f['user_id']) for f in filas])
+        usuarios = sorted({f['user_id'] for f in filas})
+        bump_version(*(f'voice_results:{u}' for u in usuarios))
+        db.session.commit()
+        resumen['filas'] += len(filas)
+        afectados.update(usuarios)
+    purge_deleted()
+    db.session.commit()
+    return dict(resumen, usuarios=len(afectados))
+
+def archive_detached_partitions(batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Archiva las particiones mensuales de voice_test ya desacopladas
+    (maintain_partitions con PARTITION_RETENTION_MONTHS) y las borra. Una
+    partición desacoplada no recibe las columnas que las migraciones añaden
+    después a voice_test: se leen solo las que tiene y el resto queda nulo
+    en el Parquet. Devuelve {tabla: filas}; vacío fuera de Postgres.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return {}
+    tablas = db.session.execute(db.text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+        "AND relname ~ '^voice_test_p[0-9]{4}_[0-9]{2}$' ORDER BY relname"
+    )).scalars().all()
+    resumen = {}
+    for tabla in tablas:
+        existentes = set(db.session.execute(db.text(
+            'SELECT column_name FROM information_schema.columns '
+            'WHERE table_schema = current_schema() AND table_name = :tabla'
+        ), {'tabla': tabla}).scalars())
+        columnas = ', '.join(c.name for c in VoiceTest.__table__.c if c.name in existentes)
+        ultimo, usuarios, total = 0, set(), 0
+        while True:
+            filas = [dict(f._mapping) for f in db.session.execute(db.text(
+                f'SELECT {columnas} FROM {tabla} WHERE id > :ultimo ORDER BY id LIMIT :n'
+            ), {'ultimo': ultimo, 'n': batch_size})]
+            if not filas:
+                break
+            write_voice_archive(filas)
+            usuarios.update(f['user_id'] for f in filas)
+            ultimo = filas[-1]['id']
+            total += len(filas)
+        db.session.execute(db.text(f'DROP TABLE {tabla}'))
+        bump_version(*(f'voice_results:{u}' for u in sorted(usuarios)))
+        db.session.commit()
+        resumen[tabla] = total
+    return resumen
+
+# ------------------- ALMACÉN DE AUDIO -------------------
+
+# Las grabaciones subidas a /predict_voice (con save=true o store=true) se
+# guardan por contenido: la clave es el SHA-256 del fichero subido, así que
+# una subida repetida no ocupa más espacio. En la petición solo se calcula el
+# hash y se mueve el fichero a spool/; un hilo lo pasa a
+# objects/ab/cd/<sha256>.flac. El PCM entero se comprime a FLAC sin pérdida;
+# lo que FLAC no puede representar sin pérdida (PCM float o de 32 bits) o no
+# se sabe decodificar se guarda tal cual, con su extensión.
+app.config['AUDIO_STORE_DIR'] = os.environ.get('AUDIO_STORE_DIR', os.path.join(basedir, 'audio_store'))
+app.config['AUDIO_STORE_SCAN_SECONDS'] = int(os.environ.get('AUDIO_STORE_SCAN_SECONDS', 60))
+
+FLAC_SUBTYPES = {'PCM_S8': 'PCM_S8', 'PCM_U8': 'PCM_S8', 'PCM_16': 'PCM_16', 'PCM_24': 'PCM_24'}
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+HASH_CHUNK = 1 << 20
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+def _fsync_replace(temporal, destino):
+    with open(temporal, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(temporal, destino)
+
+class AudioStore(BackgroundJob):
+    """
+    Almacén de audio direccionado por contenido. put() se llama en la
+    petición; la compresión la hace run_once() en segundo plano, despertado
+    en cada subida y cada AUDIO_STORE_SCAN_SECONDS (recoge lo que quedase
+    en spool/ tras un reinicio).
+    """
+    nombre = 'audio-store'
+    intervalo_config = 'AUDIO_STORE_SCAN_SECONDS'
+
+    def __init__(self):
+        super().__init__()
+        self._stats_lock = threading.Lock()
+        self._stats = {'subidas': 0, 'duplicadas': 0, 'guardadas': 0, 'flac': 0,
+                       'bytes_subidos': 0, 'bytes_guardados': 0, 'errores': 0}
+
+    def _path(self, *partes):
+        return os.path.join(app.config['AUDIO_STORE_DIR'], *partes)
+
+    def _count(self, **incrementos):
+        with self._stats_lock:
+            for clave, n in incrementos.items():
+                self._stats[clave] += n
+
+    def find(self, sha):
+        """Ruta del audio con ese SHA-256 (guardado o aún en spool); None si no está."""
+        if not sha or not SHA256_RE.match(sha):
+            return None
+        rutas = (glob.glob(self._path('objects', sha[:2], sha[2:4], sha + '.*'))
+                 or glob.glob(self._path('spool', sha + '.*')))
+        return rutas[0] if rutas else None
+
+    def put(self, ruta, extension):
+        """
+        Mueve el fichero al almacén y devuelve su SHA-256. Si ya había uno
+        idéntico, el fichero se borra sin más.
+        """
+        sha = file_sha256(ruta)
+        self._count(subidas=1, bytes_subidos=os.path.getsize(ruta))
+        if self.find(sha) is not None:
+            os.unlink(ruta)
+            self._count(duplicadas=1)
+            return sha
+        spool = self._path('spool')
+        os.makedirs(spool, exist_ok=True)
+        # Primero con nombre oculto: el hilo nunca ve un fichero a medio copiar
+        temporal = os.path.join(spool, f'.{sha}.{uuid.uuid4().hex[:8]}')
+        shutil.move(ruta, temporal)
+        os.replace(temporal, os.path.join(spool, sha + extension))
+        self.ensure_started()
+        self.wake()
+        return sha
+
+    def run_once(self):
+        spool = self._path('spool')
+        if not os.path.isdir(spool):
+            return
+        for nombre in sorted(os.listdir(spool)):
+            if nombre.startswith('.'):
+                continue
+            try:
+                self._store(os.path.join(spool, nombre))
+            except FileNotFoundError:
+                pass  # lo guardó otro proceso
+            except Exception as e:
+                self._count(errores=1)
+                app.logger.error('Error guardando audio %s: %s', nombre, e)
+
+    def _store(self, ruta):
+        sha, extension = os.path.splitext(os.path.basename(ruta))
+        directorio = self._path('objects', sha[:2], sha[2:4])
+        if not glob.glob(os.path.join(directorio, sha + '.*')):
+            os.makedirs(directorio, exist_ok=True)
+            temporal = os.path.join(directorio, f'.{sha}.{uuid.uuid4().hex[:8]}')
+            if self._encode_flac(ruta, temporal):
+                extension = '.flac'
+                self._count(flac=1)
+            else:
+                shutil.copyfile(ruta, temporal)
+            _fsync_replace(temporal, os.path.join(directorio, sha + extension))
+            self._count(guardadas=1, bytes_guardados=os.path.getsize(os.path.join(directorio, sha + extension)))
+        os.unlink(ruta)
+
+    @staticmethod
+    def _encode_flac(ruta, destino):
+        """Comprime a FLAC por bloques si el audio es PCM entero; False si no se puede sin pérdida."""
+        try:
+            import soundfile as sf
+            info = sf.info(ruta)
+        except Exception:  # sin soundfile, o formato que libsndfile no lee (p. ej. m4a)
+            return False
+        if info.format == 'FLAC' or info.subtype not in FLAC_SUBTYPES:
+            return False
+        with sf.SoundFile(ruta) as entrada, sf.SoundFile(
+                destino, 'w', samplerate=entrada.samplerate, channels=entrada.channels,
+                format='FLAC', subtype=FLAC_SUBTYPES[info.subtype]) as salida:
+            for bloque in entrada.blocks(blocksize=1 << 16, dtype='int32', always_2d=True):
+                salida.write(bloque)
+        return True
+
+    def stats(self):
+        spool = self._path('spool')
+        pendientes = (sum(1 for n in os.listdir(spool) if not n.startswith('.'))
+                      if os.path.isdir(spool) else 0)
+        with self._stats_lock:
+            return dict(self._stats, pendientes=pendientes, ultimo_error=self.ultimo_error)
+
+audio_store = AudioStore()
+
+# ------------------- COLA DE EXTRACCIÓN -------------------
+
+# Cola duradera en la tabla trabajo_extraccion para separar la extracción
+# (CPU) de los servidores web: /predict_voice?async=true encola y cualquier
+# número de procesos scripts/extraction_worker.py, en cualquier máquina con
+# acceso a la base de datos y a AUDIO_STORE_DIR, reclaman trabajos. Un
+# trabajo reclamado queda oculto JOB_VISIBILITY_SECONDS; si el trabajador
+# muere sin terminarlo, vuelve a ser visible y lo reclama otro. Cada fallo
+# espera JOB_RETRY_SECONDS * 2^(intento - 1) y tras JOB_MAX_ATTEMPTS
+# intentos el trabajo queda como fallido.
+app.config['JOB_VISIBILITY_SECONDS'] = int(os.environ.get('JOB_VISIBILITY_SECONDS', 300))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+app.config['JOB_RETRY_SECONDS'] = int(os.environ.get('JOB_RETRY_SECONDS', 30))
+
+JOB_STATES = ('pendiente', 'en_curso', 'hecho', 'fallido')
+
+def enqueue_extraction(archivo_referencia, user_id=None, fecha=None, guardar=False, idempotency_key=None):
+    """
+    Encola la extracción de un audio del almacén. Con idempotency_key, un
+    reintento devuelve el trabajo ya encolado en lugar de crear otro.
+    """
+    if idempotency_key is not None:
+        existente = TrabajoExtraccion.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
+        if existente is not None:
+            return existente
+    trabajo = TrabajoExtraccion(archivo_referencia=archivo_referencia, user_id=user_id, fecha=fecha,
+                                guardar=guardar, idempotency_key=idempotency_key,
+                                max_intentos=app.config['JOB_MAX_ATTEMPTS'],
+                                visible_desde=datetime.utcnow())
+    db.session.add(trabajo)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existente = TrabajoExtraccion.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
+        if existente is None:
+            raise
+        return existente
+    return trabajo
+
+def _visible_jobs(ahora, limite, *condiciones):
+    """Ids de trabajos visibles, sin los que ya tenga bloqueados otro trabajador (Postgres)."""
+    stmt = (db.select(TrabajoExtraccion.id)
+            .where(TrabajoExtraccion.estado.in_(('pendiente', 'en_curso')),
+                   TrabajoExtraccion.visible_desde <= ahora, *condiciones)
+            .order_by(TrabajoExtraccion.visible_desde, TrabajoExtraccion.id)
+            .limit(limite))
+    if db.session.get_bind().dialect.name == 'postgresql':
+        stmt = stmt.with_for_update(skip_locked=True)
+    return stmt.scalar_subquery()
+
+def claim_extraction_jobs(trabajador, limite=1):
+    """
+    Reclama hasta `limite` trabajos para `trabajador` y los devuelve (filas
+    con todas las columnas). En Postgres, SELECT ... FOR UPDATE SKIP LOCKED:
+    los trabajadores no se esperan entre sí. En SQLite, BEGIN IMMEDIATE toma
+    el bloqueo de escritura antes de leer, así que las reclamaciones se
+    hacen de una en una. Debe llamarse sin transacción abierta.
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        db.session.rollback()
+        db.session.execute(db.text('BEGIN IMMEDIATE'))
+    ahora = datetime.utcnow()
+    # Trabajos cuyo trabajador murió en el último intento
+    db.session.execute(
+        db.update(TrabajoExtraccion)
+        .where(TrabajoExtraccion.id.in_(_visible_jobs(
+            ahora, 100, TrabajoExtraccion.intentos >= TrabajoExtraccion.max_intentos)))
+        .values(estado='fallido', actualizado=ahora,
+                error=db.func.coalesce(TrabajoExtraccion.error, 'Se agotaron los intentos'))
+        .execution_options(synchronize_session=False)
+    )
+    filas = db.session.execute(
+        db.update(TrabajoExtraccion)
+        .where(TrabajoExtraccion.id.in_(_visible_jobs(
+            ahora, limite, TrabajoExtraccion.intentos < TrabajoExtraccion.max_intentos)))
+        .values(estado='en_curso', trabajador=trabajador, intentos=TrabajoExtraccion.intentos + 1,
+                visible_desde=ahora + timedelta(seconds=app.config['JOB_VISIBILITY_SECONDS']),
+                actualizado=ahora)
+        .returning(*TrabajoExtraccion.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return sorted(filas, key=attrgetter('id'))
+
+def complete_job(trabajo_id, trabajador, resultado):
+    """Marca el trabajo como hecho si sigue siendo de `trabajador`. Devuelve si se marcó."""
+    actualizadas = db.session.execute(
+        db.update(TrabajoExtraccion)
+        .where(TrabajoExtraccion.id == trabajo_id, TrabajoExtraccion.trabajador == trabajador,
+               TrabajoExtraccion.estado == 'en_curso')
+        .values(estado='hecho', resultado=resultado, error=None, actualizado=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return actualizadas == 1
+
+def fail_job(trabajo_id, trabajador, error):
+    """Devuelve el trabajo a la cola con espera exponencial, o lo marca como fallido."""
+    trabajo = db.session.get(TrabajoExtraccion, trabajo_id, with_for_update=True)
+    if trabajo is None or trabajo.trabajador != trabajador or trabajo.estado != 'en_curso':
+        db.session.rollback()
+        return False
+    ahora = datetime.utcnow()
+    if trabajo.intentos >= trabajo.max_intentos:
+        trabajo.estado = 'fallido'
+    else:
+        trabajo.estado = 'pendiente'
+        trabajo.visible_desde = ahora + timedelta(
+            seconds=app.config['JOB_RETRY_SECONDS'] * 2 ** (trabajo.intentos - 1))
+    trabajo.error = str(error)[:1000]
+    trabajo.actualizado = ahora
+    db.session.commit()
+    return True
+
+def run_extraction_job(trabajo):
+    """
+    Extrae las características del audio del trabajo y predice; con
+    guardar, guarda el VoiceTest. Devuelve la misma respuesta que
+    /predict_voice. Un error de extracción lanza ValueError (el trabajo se
+    reintenta) en lugar de predecir sobre características a cero.
+    """
+    sys.path.insert(0, os.path.join(basedir, 'scripts'))
+    from extract_features import extract_features
+    from feature_store import extractor_version
+
+    ruta = audio_store.find(trabajo.archivo_referencia)
+    if ruta is None:
+        raise ValueError(f'Audio {trabajo.archivo_referencia} no encontrado en el almacén')
+    try:
+        features = extract_features(ruta, raise_errors=True)
+    except Exception as e:
+        if os.path.exists(ruta):
+            raise ValueError(f'Error extrayendo características: {e}')
+        # Se movió de spool/ a objects/ mientras tanto
+        ruta = audio_store.find(trabajo.archivo_referencia)
+        try:
+            features = extract_features(ruta, raise_errors=True)
+        except Exception as e:
+            raise ValueError(f'Error extrayendo características: {e}')
+
+    probability, level = predict_features(list(features))
+    parametros = {name: float(value) for name, value in zip(FEATURE_NAMES, features)}
+    if not trabajo.guardar:
+        return {'probabilidad': probability, 'nivel': level, 'parametros': parametros,
+                'archivo_referencia': trabajo.archivo_referencia}
+    # Si el trabajo se repite (p. ej. tras caducar el plazo), la clave evita un segundo VoiceTest
+    resultado, _ = store_voice_test(trabajo.user_id, trabajo.fecha or trabajo.creado, probability, level,
+                                    parametros, trabajo.idempotency_key or f'trabajo-{trabajo.id}',
+                                    archivo_referencia=trabajo.archivo_referencia,
+                                    extractor_version=extractor_version(),
+                                    modelo_version=model_version())
+    return voice_test_response(resultado)
+
+def extraction_queue_stats():
+    conteos = dict(db.session.execute(
+        db.select(TrabajoExtraccion.estado, db.func.count()).group_by(TrabajoExtraccion.estado)
+    ).all())
+    return {estado: conteos.get(estado, 0) for estado in JOB_STATES}
+
+@app.route('/trabajos/<int:trabajo_id>', methods=['GET'])
+def get_trabajo(trabajo_id):
+    """Estado de un trabajo de extracción; con estado 'hecho', 'resultado' lleva la respuesta."""
+    trabajo = db.session.get(TrabajoExtraccion, trabajo_id)
+    if trabajo is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(trabajo.to_dict()), 200
+
+# ------------------- EXPORTACIÓN -------------------
+
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+class _ChunkSink:
+    """Destino de escritura para pyarrow que acumula los bytes hasta vaciarlo."""
+    closed = False
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        datos, self._partes = b''.join(self._partes), []
+        return datos
+
+def stream_table(filas, columnas, formato, nombre_fichero):
+    """
+    Descarga en streaming de filas (listas en el orden de `columnas`, pares
+    (nombre, tipo SQLAlchemy)) como CSV o Parquet, con un row group por cada
+    EXPORT_BATCH_SIZE filas: la memoria no depende del tamaño de la exportación.
+    """
+    def lotes():
+        lote = []
+        for fila in filas:
+            lote.append(fila)
+            if len(lote) >= EXPORT_BATCH_SIZE:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([nombre for nombre, _ in columnas])
+        for lote in lotes():
+            writer.writerows([v.isoformat() if isinstance(v, datetime) else v for v in fila] for fila in lote)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_parquet():
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = arrow_schema(columnas)
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd')
+        for lote in lotes():
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(zip(*lote), schema)], schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+    generate = generate_parquet if formato == 'parquet' else generate_csv
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[formato])
+    response.headers['Content-Disposition'] = f'attachment; filename="{nombre_fichero}.{formato}"'
+    return response
+
+def export_patients():
+    """
+    Pacientes a exportar según la petición: ?paciente_id=N o ?dimension=...&cohorte=...
+    (las cohortes de /analytics/cohortes). Devuelve (subconsulta de paciente_id, nombre).
+    """
+    paciente_id = request.args.get('paciente_id', type=int)
+    dimension, cohorte = request.args.get('dimension'), request.args.get('cohorte')
+    if paciente_id is not None:
+        return db.select(Paciente.paciente_id).where(Paciente.paciente_id == paciente_id), f'paciente_{paciente_id}'
+    if dimension and cohorte:
+        if dimension not in cohort_dimensions():
+            raise ApiError(f"Dimensión desconocida: {dimension} (usar {', '.join(cohort_dimensions())})")
+        expresion, joins = cohort_dimensions()[dimension]
+        stmt = db.select(Paciente.paciente_id).select_from(Paciente)
+        if joins is not None:
+            stmt = joins(stmt)
+        nombre = re.sub(r'\W+', '_', cohorte).strip('_') or 'cohorte'
+        return stmt.where(expresion == cohorte), f'{dimension}_{nombre}'
+    raise ApiError('Indicar paciente_id, o dimension y cohorte')
+
+def check_export_format(formato):
+    if formato not in EXPORT_FORMATS:
+        raise ApiError(f"Formato desconocido: {formato} (usar {', '.join(EXPORT_FORMATS)})", 404)
+
+@app.route('/export/voice_tests.<formato>', methods=['GET'])
+def export_voice_tests(formato):
+    """
+    Pruebas de voz de un paciente o cohorte en CSV o Parquet, con las
+    columnas y el orden de data/parkinson_data.data para poder reentrenar
+    con ellas. name es <user_id>_<fecha>_<id> y status es 1 si el paciente
+    tiene fecha de diagnóstico. Las pruebas a las que les falta alguna
+    característica se omiten salvo con ?incompletas=true. Con ?archivo=true
+    incluye las pruebas archivadas.
+    """
+    check_export_format(formato)
+    if os.path.join(basedir, 'scripts') not in sys.path:
+        sys.path.insert(0, os.path.join(basedir, 'scripts'))
+    from batch_extract import DATASET_COLUMNS, dataset_row
+
+    pacientes, nombre = export_patients()
+    # user_id -> status; solo ids y una cadena por paciente, no el historial
+    estados = {str(u): 1 if diagnostico else 0 for u, diagnostico in db.session.execute(
+        db.select(Paciente.usuario_id, Paciente.fecha_diagnostico).where(Paciente.paciente_id.in_(pacientes)))}
+    stmt = (db.select(VoiceTest.id, VoiceTest.user_id, VoiceTest.date, *[getattr(VoiceTest, n) for n in FEATURE_NAMES])
+            .where(VoiceTest.user_id.in_(
+                db.select(db.cast(Paciente.usuario_id, db.String)).where(Paciente.paciente_id.in_(pacientes))))
+            .order_by(VoiceTest.user_id, VoiceTest.date, VoiceTest.id))
+    incompletas = flag_requested('incompletas')
+    if not incompletas:
+        stmt = stmt.where(*[getattr(VoiceTest, n).isnot(None) for n in FEATURE_NAMES])
+    archivo = flag_requested('archivo')
+
+    def pruebas():
+        filas = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        if not archivo:
+            yield from filas
+            return
+        vistos = set()
+        for user_id, grupo in itertools.groupby(filas, key=attrgetter('user_id')):
+            vistos.add(user_id)
+            yield from merge_archived(grupo, read_voice_archive(user_id, reverse=False), reverse=False)
+        for user_id in estados:
+            if user_id not in vistos:
+                yield from read_voice_archive(user_id, reverse=False)
+
+    filas = (dataset_row(f'{f.user_id}_{f.date:%Y%m%dT%H%M%S}_{f.id}',
+                         [getattr(f, n) for n in FEATURE_NAMES], estados[f.user_id])
+             for f in pruebas()
+             # Las archivadas se filtran aquí; las de voice_test ya vienen filtradas
+             if incompletas or all(getattr(f, n) is not None for n in FEATURE_NAMES))
+    columnas = [(c, db.String() if c == 'name' else db.Integer() if c == 'status' else db.Float())
+                for c in DATASET_COLUMNS]
+    return stream_table(filas, columnas, formato, f'voice_tests_{nombre}')
+
+@app.route('/export/resultados.<formato>', methods=['GET'])
+def export_resultados(formato):
+    """Resultados de prueba de un paciente o cohorte en CSV o Parquet, en el orden de columnas del modelo."""
+    check_export_format(formato)
+    pacientes, nombre = export_patients()
+    columnas = [c for c in ResultadoPrueba.__table__.c if c.key not in ResultadoPrueba._serialize_exclude]
+    stmt = (select_columns(ResultadoPrueba).where(ResultadoPrueba.paciente_id.in_(pacientes))
+            .order_by(ResultadoPrueba.paciente_id, ResultadoPrueba.fecha, ResultadoPrueba.resultado_id))
+
+    def filas():
+        for fila in db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE)):
+            yield list(fila)
+    return stream_table(filas(), [(c.key, c.type) for c in columnas], formato, f'resultados_{nombre}')
+
+# ------------------- INGESTA MASIVA -------------------
+
+MAX_BULK_RECORDS = 1000
+
+def validate_records(model, records, requeridos, rangos=None):
+    """
+    Valida una lista de dicts columna a columna (con pandas) usando los
+    tipos de las columnas del modelo. Las columnas de model._ingest_exclude
+    (las que rellena el servidor) se ignoran aunque vengan en el registro.
+    Devuelve (filas válidas como [(índice, dict)], {índice: error}).
+    """
+    import pandas as pd
+
+    errores = {}
+    columnas = [c for c in model.__table__.c if not c.primary_key and c.key not in model._ingest_exclude]
+    df = pd.DataFrame(records, columns=[c.key for c in columnas], dtype=object)
+    validos = pd.Series(True, index=df.index)
+
+    def marcar(mascara, mensaje):
+        nuevos = mascara & validos
+        for idx in df.index[nuevos]:
+            errores[int(idx)] = mensaje
+        validos[nuevos] = False
+
+    for col in columnas:
+        serie = df[col.key]
+        presente = serie.notna()
+        if col.key in requeridos:
+            marcar(~presente, f"Falta '{col.key}'")
+        if isinstance(col.type, db.DateTime):
+            texto = presente & serie.map(lambda v: isinstance(v, str))
+            fechas = pd.to_datetime(serie.where(texto), utc=True, errors='coerce', format='ISO8601')
+            marcar(presente & fechas.isna(), f"Fecha inválida en '{col.key}' (usar ISO 8601)")
+            df[col.key] = fechas.dt.tz_convert(None).astype(object)
+        elif isinstance(col.type, (db.Float, db.Integer)):
+            numeros = pd.to_numeric(serie, errors='coerce')
+            marcar(presente & numeros.isna(), f"'{col.key}' debe ser numérico")
+            if isinstance(col.type, db.Integer):
+                marcar(presente & numeros.notna() & (numeros % 1 != 0), f"'{col.key}' debe ser entero")
+            if rangos and col.key in rangos:
+                minimo, maximo = rangos[col.key]
+                marcar(presente & ((numeros < minimo) | (numeros > maximo)),
+                       f"'{col.key}' fuera de rango [{minimo}, {maximo}]")
+            df[col.key] = numeros
+        elif isinstance(col.type, db.String):
+            textos = serie.where(presente, None).map(lambda v: None if v is None else str(v))
+            if col.type.length:
+                marcar(textos.str.len() > col.type.length, f"'{col.key}' supera {col.type.length} caracteres")
+            marcar(presente & (textos.str.strip() == ''), f"'{col.key}' vacío")
+            df[col.key] = textos
+
+    df = df[validos].astype(object).where(df[validos].notna(), None)
+    filas = []
+    for idx, fila in zip(df.index, df.to_dict('records')):
+        for col in columnas:
+            valor = fila[col.key]
+            if hasattr(valor, 'to_pydatetime'):
+                fila[col.key] = valor.to_pydatetime()
+            elif isinstance(col.type, db.Integer) and valor is not None:
+                fila[col.key] = int(valor)
+            elif isinstance(col.type, db.Float) and valor is not None:
+                fila[col.key] = float(valor)
+        filas.append((int(idx), fila))
+    return filas, errores
+
+def bulk_ingest(model, records, owner, requeridos, defaults=None, rangos=None, owner_existe=None, al_insertar=None,
+                anidado=None):
+    """
+    Inserta un lote de registros en una sola transacción con un INSERT
+    multi-fila. Cada registro lleva una idempotency_key obligatoria: los que
+    ya estaban guardados (o se repiten dentro del lote) se marcan como
+    duplicados en lugar de insertarse. Los campos del objeto anidado (p. ej.
+    'parametros') se suben al registro. al_insertar(filas) se llama con las
+    filas insertadas (con su id) antes del commit. Devuelve el estado de
+    cada registro en el orden recibido.
+    """
+    if not isinstance(records, list):
+        raise ApiError("Se esperaba una lista en 'registros'")
+    if len(records) > MAX_BULK_RECORDS:
+        raise ApiError(f'Máximo {MAX_BULK_RECORDS} registros por petición', 413)
+
+    estados = [None] * len(records)
+    dicts = []
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            estados[i] = {'indice': i, 'estado': 'invalido', 'error': 'El registro debe ser un objeto'}
+            record = {}
+        elif anidado is not None and record.get(anidado) is not None:
+            if not isinstance(record[anidado], dict):
+                estados[i] = {'indice': i, 'estado': 'invalido', 'error': f"'{anidado}' debe ser un objeto"}
+                record = {}
+            else:
+                record = dict(record[anidado], **{k: v for k, v in record.items() if k != anidado})
+        dicts.append(record)
+    filas, errores = validate_records(model, dicts, set(requeridos) | {'idempotency_key'}, rangos)
+    for i, error in errores.items():
+        if estados[i] is None:
+            estados[i] = {'indice': i, 'estado': 'invalido', 'error': error}
+    filas = [(i, fila) for i, fila in filas if estados[i] is None]
+
+    if owner_existe is not None and filas:
+        existentes = owner_existe({fila[owner.key] for _, fila in filas})
+        for i, fila in filas:
+            if fila[owner.key] not in existentes:
+                estados[i] = {'indice': i, 'estado': 'invalido', 'error': f"'{owner.key}' no existe"}
+        filas = [(i, fila) for i, fila in filas if estados[i] is None]
+
+    # Duplicados dentro del propio lote
+    vistos = {}
+    for i, fila in filas:
+        clave = (fila[owner.key], fila['idempotency_key'])
+        if clave in vistos:
+            estados[i] = {'indice': i, 'estado': 'duplicado', 'duplicado_de': vistos[clave]}
+        else:
+            vistos[clave] = i
+    filas = [(i, fila) for i, fila in filas if estados[i] is None]
+
+    pk = model.__mapper__.primary_key[0]
+    for intento in range(2):
+        pendientes = filas
+        claves = [(fila[owner.key], fila['idempotency_key']) for _, fila in pendientes]
+        if claves:
+            guardados = {(o, k): id_ for o, k, id_ in db.session.execute(
+                db.select(owner, model.idempotency_key, pk)
+                .where(db.tuple_(owner, model.idempotency_key).in_(claves))
+            )}
+            for i, fila in pendientes:
+                id_ = guardados.get((fila[owner.key], fila['idempotency_key']))
+                if id_ is not None:
+                    estados[i] = {'indice': i, 'estado': 'duplicado', pk.key: id_}
+            pendientes = [(i, fila) for i, fila in pendientes if estados[i] is None]
+
+        try:
+            if pendientes:
+                defaults = defaults or {}
+                valores = [{k: defaults.get(k) if v is None else v for k, v in fila.items()}
+                           for _, fila in pendientes]
+                # SQLAlchemy agrupa el lote en INSERT ... VALUES (...), (...) RETURNING; las
+                # filas devueltas se asocian a cada registro por su clave, no por su orden
+                creados = {(o, k): id_ for id_, o, k in db.session.execute(
+                    db.insert(model.__table__).returning(pk, owner, model.idempotency_key), valores
+                )}
+                insertadas = []
+                for (i, fila), valor in zip(pendientes, valores):
+                    id_ = creados[(fila[owner.key], fila['idempotency_key'])]
+                    estados[i] = {'indice': i, 'estado': 'creado', pk.key: id_}
+                    insertadas.append(dict(valor, **{pk.key: id_}))
+                if al_insertar is not None:
+                    al_insertar(insertadas)
+            db.session.commit()
+            break
+        except IntegrityError:
+            # Otra sincronización guardó alguna de las claves a la vez; se reclasifica el lote
+            db.session.rollback()
+            for i, _ in pendientes:
+                estados[i] = None
+            if intento:
+                raise ApiError('Conflicto al guardar el lote; reenvíelo', 409)
+
+    resumen = {f"{e}s": sum(1 for estado in estados if estado['estado'] == e)
+               for e in ('creado', 'duplicado', 'invalido')}
+    return dict(resumen, registros=estados)
+
+@app.route('/ingest/voice_results', methods=['POST'])
+def ingest_voice_results():
+    """
+    Guarda un lote de resultados de voz: {"registros": [...]}, cada uno con
+    los campos de /save_voice_result y su idempotency_key.
+    """
+    data = request.get_json(silent=True) or {}
+    resultado = bulk_ingest(
+        VoiceTest, data.get('registros'), VoiceTest.user_id,
+        requeridos={'user_id', 'probability', 'level'},
+        defaults={'date': datetime.utcnow()},
+        rangos={'probability': (0, 1)},
+        al_insertar=voice_tests_inserted,
+        # Aceptar el formato de /save_voice_result (características en 'parametros')
+        anidado='parametros',
+    )
+    return jsonify(resultado), 200
+
+@app.route('/ingest/resultados', methods=['POST'])
+def ingest_resultados():
+    """Guarda un lote de resultados de pruebas: {"registros": [...]}, cada uno con su idempotency_key."""
+    data = request.get_json(silent=True) or {}
+
+    def pacientes_existentes(ids):
+        return set(db.session.execute(
+            db.select(Paciente.paciente_id).where(Paciente.paciente_id.in_(ids))
+        ).scalars())
+
+    resultado = bulk_ingest(
+        ResultadoPrueba, data.get('registros'), ResultadoPrueba.paciente_id,
+        requeridos={'paciente_id', 'tipo_prueba'},
+        defaults={'fecha': datetime.utcnow()},
+        owner_existe=pacientes_existentes,
+        al_insertar=lambda filas: bump_version(*sorted({f"resultados:{f['paciente_id']}" for f in filas})),
+    )
+    return jsonify(resultado), 200
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -4,7 +4,7 @@
 CREATE TABLE IF NOT EXISTS voice_test (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id VARCHAR(100) NOT NULL,
-    date VARCHAR(50) NOT NULL,
+    date TIMESTAMP NOT NULL,
     probability REAL NOT NULL,
     level VARCHAR(50) NOT NULL,
     fo REAL,
@@ -31,6 +31,8 @@ CREATE TABLE IF NOT EXISTS voice_test (
     ppe REAL
 );
 
+CREATE INDEX IF NOT EXISTS ix_voice_test_user_date ON voice_test (user_id, date DESC, id DESC);
+
 
 
 
@@ -1,4 +1,5 @@
 import logging
+import re
 from logging.config import fileConfig
 
 from flask import current_app
@@ -51,6 +52,24 @@ def get_metadata():
     return target_db.metadata
 
 
+# voice_test y resultado_prueba están particionadas por mes en Postgres
+# (e5c0a7d3b918): las particiones no están en los modelos, y la clave
+# primaria, las restricciones únicas y resultado_prueba.fecha incluyen la
+# columna de partición. Autogenerate no debe intentar deshacerlo.
+PARTITION_TABLE_RE = re.compile(r'^(voice_test|resultado_prueba)_(p\d{4}_\d{2}|default)$')
+PARTITION_CONSTRAINTS = {'uq_voice_test_user_idempotency', 'uq_resultado_prueba_paciente_idempotency'}
+
+
+def include_partitioned_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and name and PARTITION_TABLE_RE.match(name):
+        return False
+    if type_ == 'unique_constraint' and name in PARTITION_CONSTRAINTS:
+        return False
+    if type_ == 'column' and name == 'fecha' and object.table.name == 'resultado_prueba':
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -93,11 +112,14 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        configure_args = dict(current_app.extensions['migrate'].configure_args)
+        if connection.dialect.name == 'postgresql':
+            configure_args.setdefault('include_object', include_partitioned_object)
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
-            **current_app.extensions['migrate'].configure_args
+            **configure_args
         )
 
         with context.begin_transaction():
@@ -0,0 +1,39 @@
+"""Fecha de resultado_prueba obligatoria
+
+resultado_prueba.fecha es la primera clave de la paginación por keyset de
+/resultados.json: una fila con NULL no cumple (fecha, id) < cursor y cortaba
+la paginación sin aviso. Las filas sin fecha toman 1970-01-01, como al
+particionar en Postgres, donde la columna ya era NOT NULL.
+
+Revision ID: 11eea6bdefe5
+Revises: cc1518cc230f
+Create Date: 2026-10-19 15:45:06.605613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '11eea6bdefe5'
+down_revision = 'cc1518cc230f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE resultado_prueba SET fecha = '1970-01-01 00:00:00' WHERE fecha IS NULL")
+    with op.batch_alter_table('resultado_prueba', schema=None) as batch_op:
+        batch_op.alter_column('fecha',
+               existing_type=sa.DateTime(),
+               nullable=False)
+
+
+def downgrade():
+    # En Postgres la tabla particionada la necesita NOT NULL (forma parte de la clave primaria)
+    if op.get_bind().dialect.name == 'postgresql':
+        return
+    with op.batch_alter_table('resultado_prueba', schema=None) as batch_op:
+        batch_op.alter_column('fecha',
+               existing_type=sa.DateTime(),
+               nullable=True)
@@ -0,0 +1,30 @@
+"""Índices de resultado_prueba para filtros y paginación
+
+Revision ID: 3f2a9c1d7b45
+Revises: 8117bfd3ede6
+Create Date: 2026-10-19 10:12:31.418205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b45'
+down_revision = '8117bfd3ede6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('resultado_prueba', schema=None) as batch_op:
+        batch_op.create_index('ix_resultado_prueba_fecha_id', ['fecha', 'resultado_id'], unique=False)
+        batch_op.create_index('ix_resultado_prueba_paciente_fecha', ['paciente_id', 'fecha', 'resultado_id'], unique=False)
+        batch_op.create_index('ix_resultado_prueba_tipo_fecha', ['tipo_prueba', 'fecha', 'resultado_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('resultado_prueba', schema=None) as batch_op:
+        batch_op.drop_index('ix_resultado_prueba_tipo_fecha')
+        batch_op.drop_index('ix_resultado_prueba_paciente_fecha')
+        batch_op.drop_index('ix_resultado_prueba_fecha_id')
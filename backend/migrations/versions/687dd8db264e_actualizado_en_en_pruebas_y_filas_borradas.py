@@ -0,0 +1,108 @@
+"""actualizado_en en voice_test y resultado_prueba y tabla fila_borrada
+
+/sync sigue ahora todas las tablas por (actualizado_en, id): las pruebas
+recalculadas (rescore_voice_tests.py) o corregidas vuelven a enviarse, y la
+marca ya no depende del orden de confirmación de los ids. Las filas
+existentes toman la fecha de la migración. Los índices por id de /sync se
+cambian por índices por (propietario, actualizado_en, id).
+
+fila_borrada guarda las filas archivadas o en particiones desacopladas para
+que /sync también las borre en los clientes.
+
+En Postgres los índices se crean sin bloquear escrituras: en una tabla
+particionada, primero en la tabla padre (ON ONLY) y después con CREATE
+INDEX CONCURRENTLY en cada partición, que se adjunta al índice padre.
+
+Revision ID: 687dd8db264e
+Revises: 11eea6bdefe5
+Create Date: 2026-10-19 15:53:08.470955
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '687dd8db264e'
+down_revision = '11eea6bdefe5'
+branch_labels = None
+depends_on = None
+
+TABLAS = [
+    # (tabla, índice nuevo, columnas, índice anterior, columnas anteriores)
+    ('voice_test', 'ix_voice_test_user_actualizado', ['user_id', 'actualizado_en', 'id'],
+     'ix_voice_test_user_id', ['user_id', 'id']),
+    ('resultado_prueba', 'ix_resultado_prueba_paciente_actualizado', ['paciente_id', 'actualizado_en', 'resultado_id'],
+     'ix_resultado_prueba_paciente_id', ['paciente_id', 'resultado_id']),
+]
+
+
+def _create_index_pg(bind, nombre, tabla, columnas):
+    """CREATE INDEX sin bloquear escrituras, también en tablas particionadas."""
+    particiones = bind.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:tabla) ORDER BY 1"
+    ), {'tabla': tabla}).scalars().all()
+    lista = ', '.join(columnas)
+    if not particiones:
+        with op.get_context().autocommit_block():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {tabla} ({lista})")
+        return
+    op.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON ONLY {tabla} ({lista})")
+    with op.get_context().autocommit_block():
+        for particion in particiones:
+            indice = f"{particion}_{nombre.removeprefix(f'ix_{tabla}_')}"
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {indice} ON {particion} ({lista})")
+            op.execute(f"ALTER INDEX {nombre} ATTACH PARTITION {indice}")
+
+
+def upgrade():
+    op.create_table('fila_borrada',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tabla', sa.String(length=50), nullable=False),
+    sa.Column('fila_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.String(length=100), nullable=True),
+    sa.Column('paciente_id', sa.Integer(), nullable=True),
+    sa.Column('borrado_en', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('fila_borrada', schema=None) as batch_op:
+        batch_op.create_index('ix_fila_borrada_borrado', ['borrado_en', 'id'], unique=False)
+        batch_op.create_index('ix_fila_borrada_paciente', ['paciente_id', 'borrado_en', 'id'], unique=False)
+        batch_op.create_index('ix_fila_borrada_user', ['user_id', 'borrado_en', 'id'], unique=False)
+
+    bind = op.get_bind()
+    for tabla, indice, columnas, anterior, _ in TABLAS:
+        if bind.dialect.name == 'postgresql':
+            # now() no es volátil: Postgres no reescribe la tabla ni sus particiones
+            op.add_column(tabla, sa.Column('actualizado_en', sa.DateTime(),
+                                           server_default=sa.func.now(), nullable=False))
+            _create_index_pg(bind, indice, tabla, columnas)
+            op.drop_index(anterior, table_name=tabla, if_exists=True)
+        else:
+            with op.batch_alter_table(tabla, schema=None) as batch_op:
+                batch_op.add_column(sa.Column('actualizado_en', sa.DateTime(),
+                                              server_default=sa.func.now(), nullable=False))
+                batch_op.drop_index(anterior)
+                batch_op.create_index(indice, columnas, unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for tabla, indice, _, anterior, columnas_anteriores in reversed(TABLAS):
+        if bind.dialect.name == 'postgresql':
+            _create_index_pg(bind, anterior, tabla, columnas_anteriores)
+            op.drop_index(indice, table_name=tabla)
+            op.drop_column(tabla, 'actualizado_en')
+        else:
+            with op.batch_alter_table(tabla, schema=None) as batch_op:
+                batch_op.drop_index(indice)
+                batch_op.create_index(anterior, columnas_anteriores, unique=False)
+                batch_op.drop_column('actualizado_en')
+
+    with op.batch_alter_table('fila_borrada', schema=None) as batch_op:
+        batch_op.drop_index('ix_fila_borrada_user')
+        batch_op.drop_index('ix_fila_borrada_paciente')
+        batch_op.drop_index('ix_fila_borrada_borrado')
+
+    op.drop_table('fila_borrada')
@@ -0,0 +1,65 @@
+"""Sincronización incremental: actualizado_en en perfiles e índices de /sync
+
+Añade actualizado_en a paciente y médico (las filas existentes toman la
+fecha de la migración) y los índices por marca que usa /sync. Los índices
+de voice_test y resultado_prueba se crean con CREATE INDEX CONCURRENTLY en
+Postgres para no bloquear escrituras.
+
+Revision ID: 8343ca82555b
+Revises: d693e1335627
+Create Date: 2026-10-19 14:49:00.197566
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8343ca82555b'
+down_revision = 'd693e1335627'
+branch_labels = None
+depends_on = None
+
+PERFILES = [
+    # (tabla, índice, clave primaria)
+    ('paciente', 'ix_paciente_actualizado', 'paciente_id'),
+    ('medico', 'ix_medico_actualizado', 'medico_id'),
+]
+
+INDEXES = [
+    # (nombre, tabla, columnas)
+    ('ix_resultado_prueba_paciente_id', 'resultado_prueba', ['paciente_id', 'resultado_id']),
+    ('ix_voice_test_user_id', 'voice_test', ['user_id', 'id']),
+]
+
+
+def upgrade():
+    for tabla, indice, pk in PERFILES:
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('actualizado_en', sa.DateTime(),
+                                          server_default=sa.func.now(), nullable=False))
+            batch_op.create_index(indice, ['actualizado_en', pk], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, unique=False,
+                                postgresql_concurrently=True, if_not_exists=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
+
+    for tabla, indice, _ in reversed(PERFILES):
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.drop_index(indice)
+            batch_op.drop_column('actualizado_en')
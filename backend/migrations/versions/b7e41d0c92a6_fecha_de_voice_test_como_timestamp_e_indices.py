@@ -0,0 +1,140 @@
+"""voice_test.date como timestamp e índices de historial
+
+Convierte voice_test.date de VARCHAR(50) a TIMESTAMP (con backfill desde la
+cadena ISO 8601 guardada) y añade los índices usados por el historial de voz
+y por las relaciones médico-paciente. En Postgres los índices se crean con
+CREATE INDEX CONCURRENTLY para no bloquear escrituras.
+
+Los índices de resultado_prueba (paciente_id, fecha) ya se crearon en
+3f2a9c1d7b45.
+
+Revision ID: b7e41d0c92a6
+Revises: 3f2a9c1d7b45
+Create Date: 2026-10-19 11:02:47.530114
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e41d0c92a6'
+down_revision = '3f2a9c1d7b45'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 5000
+# Para cadenas que no se pueden interpretar como fecha
+FALLBACK_DATE = datetime(1970, 1, 1)
+
+INDEXES = [
+    # (nombre, tabla, columnas)
+    ('ix_voice_test_user_date', 'voice_test', ['user_id', sa.text('date DESC'), sa.text('id DESC')]),
+    ('ix_relacion_medico_paciente', 'relacion_medico_paciente', ['medico_id', 'paciente_id']),
+    ('ix_relacion_paciente', 'relacion_medico_paciente', ['paciente_id']),
+]
+
+
+def _create_voice_test_if_missing(bind):
+    # voice_test se creó originalmente con add_voice_test_table.sql, fuera de Alembic
+    if sa.inspect(bind).has_table('voice_test'):
+        return
+    feature_columns = [
+        'fo', 'fhi', 'flo', 'jitter_percent', 'jitter_abs', 'rap', 'ppq', 'ddp',
+        'shimmer', 'shimmer_db', 'apq3', 'apq5', 'apq', 'dda', 'nhr', 'hnr',
+        'rpde', 'dfa', 'spread1', 'spread2', 'd2', 'ppe'
+    ]
+    op.create_table('voice_test',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.String(length=100), nullable=False),
+    sa.Column('date', sa.String(length=50), nullable=False),
+    sa.Column('probability', sa.Float(), nullable=False),
+    sa.Column('level', sa.String(length=50), nullable=False),
+    *[sa.Column(name, sa.Float(), nullable=True) for name in feature_columns],
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def _parse(value):
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return FALLBACK_DATE
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def _backfill(bind):
+    voice_test = sa.table('voice_test', sa.column('id'), sa.column('date'), sa.column('date_ts'))
+    if bind.dialect.name == 'postgresql':
+        # Como _parse: las fechas con zona se pasan a UTC, las que no la llevan se
+        # toman como UTC y lo que no se puede interpretar (aunque empiece como
+        # una fecha, p. ej. '2024-13-45') queda en la fecha por defecto en lugar
+        # de abortar la migración
+        op.execute(
+            "CREATE FUNCTION pg_temp.voice_test_fecha(valor text) RETURNS timestamp "
+            "LANGUAGE plpgsql SET timezone TO 'UTC' AS $$ "
+            "BEGIN RETURN CAST(valor AS timestamptz) AT TIME ZONE 'UTC'; "
+            "EXCEPTION WHEN others THEN RETURN TIMESTAMP 'epoch'; END $$"
+        )
+        op.execute(
+            "UPDATE voice_test SET date_ts = CASE "
+            "WHEN date ~ '^\\d{4}-\\d{2}-\\d{2}' THEN pg_temp.voice_test_fecha(date) "
+            "ELSE TIMESTAMP 'epoch' END"
+        )
+        op.execute("DROP FUNCTION pg_temp.voice_test_fecha(text)")
+        return
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(voice_test.c.id, voice_test.c.date)
+            .where(voice_test.c.id > last_id)
+            .order_by(voice_test.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            voice_test.update().where(voice_test.c.id == sa.bindparam('row_id')),
+            [{'row_id': row_id, 'date_ts': _parse(date)} for row_id, date in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    bind = op.get_bind()
+    _create_voice_test_if_missing(bind)
+
+    with op.batch_alter_table('voice_test', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('date_ts', sa.DateTime(), nullable=True))
+    _backfill(bind)
+    with op.batch_alter_table('voice_test', schema=None) as batch_op:
+        batch_op.drop_column('date')
+        batch_op.alter_column('date_ts', new_column_name='date', existing_type=sa.DateTime(), nullable=False)
+
+    if bind.dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, unique=False,
+                                postgresql_concurrently=True, if_not_exists=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
+
+    with op.batch_alter_table('voice_test', schema=None) as batch_op:
+        batch_op.alter_column('date', existing_type=sa.DateTime(), type_=sa.String(length=50),
+                              postgresql_using="to_char(date, 'YYYY-MM-DD\"T\"HH24:MI:SS.US')")
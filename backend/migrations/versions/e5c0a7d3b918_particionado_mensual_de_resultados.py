@@ -0,0 +1,129 @@
+"""Particionado mensual de voice_test y resultado_prueba (solo Postgres)
+
+Reconstruye voice_test (por date) y resultado_prueba (por fecha) como tablas
+particionadas por rangos mensuales: una partición por cada mes con datos,
+las del mes actual y los PARTITIONS_AHEAD siguientes, y una partición por
+defecto para fechas sin partición propia. Las siguientes las crea y las
+desacopla la aplicación (maintain_partitions / scripts/maintain_partitions.py).
+
+Postgres exige que la clave primaria y las restricciones únicas incluyan la
+columna de partición, así que pasan a ser (id, date) y (user_id,
+idempotency_key, date) en voice_test, y (resultado_id, fecha) y (paciente_id,
+idempotency_key, fecha) en resultado_prueba, donde fecha pasa a NOT NULL
+(las filas sin fecha toman 1970-01-01). Los ids siguen saliendo de la misma
+secuencia.
+
+La copia reescribe ambas tablas dentro de la transacción de la migración y
+las bloquea mientras dura: aplicarla en una ventana de mantenimiento. En
+SQLite no hace nada (las tablas siguen siendo normales).
+
+Revision ID: e5c0a7d3b918
+Revises: 2ddc682e289b
+Create Date: 2026-10-19 15:31:08.442710
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c0a7d3b918'
+down_revision = '2ddc682e289b'
+branch_labels = None
+depends_on = None
+
+PARTITIONS_AHEAD = 3
+
+TABLES = {
+    'voice_test': {
+        'columna': 'date',
+        'pk': 'id',
+        'unique': ('uq_voice_test_user_idempotency', ['user_id', 'idempotency_key']),
+        'fk': None,
+        'indexes': [
+            ('ix_voice_test_user_date', 'user_id, date DESC, id DESC'),
+            ('ix_voice_test_user_id', 'user_id, id'),
+        ],
+    },
+    'resultado_prueba': {
+        'columna': 'fecha',
+        'pk': 'resultado_id',
+        'unique': ('uq_resultado_prueba_paciente_idempotency', ['paciente_id', 'idempotency_key']),
+        'fk': ('resultado_prueba_paciente_id_fkey', 'paciente_id', 'paciente (paciente_id)'),
+        'indexes': [
+            ('ix_resultado_prueba_fecha_id', 'fecha, resultado_id'),
+            ('ix_resultado_prueba_paciente_fecha', 'paciente_id, fecha, resultado_id'),
+            ('ix_resultado_prueba_tipo_fecha', 'tipo_prueba, fecha, resultado_id'),
+            ('ix_resultado_prueba_paciente_id', 'paciente_id, resultado_id'),
+        ],
+    },
+}
+
+
+def _add_months(fecha, meses):
+    indice = fecha.year * 12 + fecha.month - 1 + meses
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+
+def _add_constraints(tabla, spec, particionada):
+    columna = spec['columna']
+    extra = [columna] if particionada else []
+    op.execute(f"ALTER TABLE {tabla} ADD CONSTRAINT {tabla}_pkey PRIMARY KEY ({', '.join([spec['pk']] + extra)})")
+    nombre, columnas = spec['unique']
+    op.execute(f"ALTER TABLE {tabla} ADD CONSTRAINT {nombre} UNIQUE ({', '.join(columnas + extra)})")
+    if spec['fk']:
+        nombre, columna_fk, destino = spec['fk']
+        op.execute(f"ALTER TABLE {tabla} ADD CONSTRAINT {nombre} FOREIGN KEY ({columna_fk}) REFERENCES {destino}")
+    for nombre, columnas in spec['indexes']:
+        op.execute(f"CREATE INDEX {nombre} ON {tabla} ({columnas})")
+
+
+def _swap(bind, tabla, spec, particionada):
+    """Reconstruye la tabla (particionada o no) copiando las filas de la actual."""
+    columna = spec['columna']
+    anterior = f'{tabla}_anterior'
+    secuencia = bind.execute(sa.text("SELECT pg_get_serial_sequence(:t, :c)"),
+                             {'t': tabla, 'c': spec['pk']}).scalar()
+    op.execute(f"ALTER TABLE {tabla} RENAME TO {anterior}")
+    if particionada:
+        op.execute(f"CREATE TABLE {tabla} (LIKE {anterior} INCLUDING DEFAULTS) PARTITION BY RANGE ({columna})")
+        op.execute(f"ALTER TABLE {tabla} ALTER COLUMN {columna} SET NOT NULL")
+        meses = set(bind.execute(sa.text(
+            f"SELECT DISTINCT date_trunc('month', {columna}) FROM {anterior}"
+        )).scalars())
+        actual = _add_months(datetime.utcnow(), 0)
+        meses.update(_add_months(actual, i) for i in range(PARTITIONS_AHEAD + 1))
+        for mes in sorted(meses):
+            op.execute(f"CREATE TABLE {tabla}_p{mes:%Y_%m} PARTITION OF {tabla} "
+                       f"FOR VALUES FROM ('{mes:%Y-%m-%d}') TO ('{_add_months(mes, 1):%Y-%m-%d}')")
+        op.execute(f"CREATE TABLE {tabla}_default PARTITION OF {tabla} DEFAULT")
+    else:
+        op.execute(f"CREATE TABLE {tabla} (LIKE {anterior} INCLUDING DEFAULTS)")
+    op.execute(f"INSERT INTO {tabla} SELECT * FROM {anterior}")
+    if secuencia:
+        op.execute(f"ALTER SEQUENCE {secuencia} OWNED BY {tabla}.{spec['pk']}")
+    # Con la tabla particionada se borran también sus particiones
+    op.execute(f"DROP TABLE {anterior}")
+    _add_constraints(tabla, spec, particionada)
+    op.execute(f"ANALYZE {tabla}")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    op.execute("UPDATE resultado_prueba SET fecha = TIMESTAMP 'epoch' WHERE fecha IS NULL")
+    for tabla, spec in TABLES.items():
+        _swap(bind, tabla, spec, particionada=True)
+
+
+def downgrade():
+    # Las particiones ya desacopladas quedan como tablas sueltas y no se copian
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    for tabla, spec in TABLES.items():
+        _swap(bind, tabla, spec, particionada=False)
+    op.execute("ALTER TABLE resultado_prueba ALTER COLUMN fecha DROP NOT NULL")
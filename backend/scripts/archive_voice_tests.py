@@ -0,0 +1,55 @@
+"""
+Mueve las pruebas de voz antiguas de voice_test al archivo Parquet
+(VOICE_ARCHIVE_DIR/month=AAAA-MM/bucket=NN/part-*.parquet, zstd).
+
+Las filas con date anterior al corte se escriben por lotes y se borran de
+voice_test tras escribir cada lote; si el proceso se interrumpe entre ambos
+pasos, basta con volver a lanzarlo (la lectura no devuelve filas repetidas).
+Con --detached, en Postgres, también se archivan y se borran las particiones
+mensuales ya desacopladas (scripts/maintain_partitions.py --retention).
+
+Las filas archivadas se siguen leyendo con /voice_results/<user_id>?archivo=true.
+Las tendencias no cambian al archivar: scripts/rebuild_voice_trends.py
+también lee las pruebas archivadas.
+
+Uso:
+    python scripts/archive_voice_tests.py [--older-than-days 365] [--batch 50000] [--detached]
+    python scripts/archive_voice_tests.py --before 2025-01-01
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, ARCHIVE_BATCH_SIZE, archive_detached_partitions, archive_voice_tests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archiva pruebas de voz antiguas en Parquet')
+    corte = parser.add_mutually_exclusive_group()
+    corte.add_argument('--before', type=datetime.fromisoformat, help='Archivar las anteriores a esta fecha (ISO 8601)')
+    corte.add_argument('--older-than-days', type=int, default=365)
+    parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH_SIZE, help='Filas por lote')
+    parser.add_argument('--detached', action='store_true', help='Archivar también las particiones desacopladas')
+    args = parser.parse_args()
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise SystemExit('Para archivar en Parquet instale pyarrow: pip install pyarrow')
+
+    antes_de = args.before or datetime.utcnow() - timedelta(days=args.older_than_days)
+    with app.app_context():
+        print(f"Archivando pruebas anteriores a {antes_de:%Y-%m-%d %H:%M} en {app.config['VOICE_ARCHIVE_DIR']}")
+        resumen = archive_voice_tests(antes_de, args.batch)
+        print(f"[OK] {resumen['filas']} filas de {resumen['usuarios']} usuarios en {resumen['ficheros']} ficheros")
+        if args.detached:
+            for tabla, filas in archive_detached_partitions(args.batch).items():
+                print(f"[OK] {tabla}: {filas} filas archivadas, tabla borrada")
+
+
+if __name__ == '__main__':
+    main()
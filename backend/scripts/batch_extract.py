@@ -0,0 +1,443 @@
+"""
+Extracción de características por lotes sobre directorios de grabaciones.
+
+Recorre un directorio (o un manifiesto CSV con columnas path[,name,status]),
+ejecuta extract_features en un pool de procesos y escribe los resultados de
+forma incremental con las mismas columnas y orden que data/parkinson_data.data
+(CSV o Parquet).
+
+El progreso se guarda en un manifiesto SQLite: si la ejecución se interrumpe,
+al relanzarla continúa con los archivos pendientes. Varias máquinas pueden
+compartir el mismo manifiesto; cada una reclama lotes de archivos con un
+lease que caduca si el proceso muere. La salida se indexa por `name`: las
+filas se escriben antes de marcarlas como terminadas y, al reanudar, las
+que ya están en la salida no se repiten.
+
+Con --trace se mide cada etapa de la extracción (tiempo y memoria con
+tracemalloc, que la ralentiza) y se muestra un resumen al terminar.
+
+Uso:
+    python scripts/batch_extract.py run --input grabaciones/ --manifest lote.sqlite --output salida.csv
+    python scripts/batch_extract.py run --manifest /compartido/lote.sqlite --output hostB.csv --worker-id hostB
+    python scripts/batch_extract.py status --manifest lote.sqlite
+    python scripts/batch_extract.py export --manifest lote.sqlite --output dataset.csv
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from feature_store import DEFAULT_DB_PATH
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.mp3', '.ogg', '.m4a')
+
+# Orden de columnas de data/parkinson_data.data
+DATASET_COLUMNS = [
+    'name', 'MDVP:Fo(Hz)', 'MDVP:Fhi(Hz)', 'MDVP:Flo(Hz)', 'MDVP:Jitter(%)',
+    'MDVP:Jitter(Abs)', 'MDVP:RAP', 'MDVP:PPQ', 'Jitter:DDP',
+    'MDVP:Shimmer', 'MDVP:Shimmer(dB)', 'Shimmer:APQ3', 'Shimmer:APQ5',
+    'MDVP:APQ', 'Shimmer:DDA', 'NHR', 'HNR', 'status', 'RPDE', 'DFA',
+    'spread1', 'spread2', 'D2', 'PPE'
+]
+# Posición de 'status' dentro del vector de 22 características (entre HNR y RPDE)
+STATUS_POSITION = 16
+
+
+def parse_status(label):
+    """
+    Etiqueta 'status' del manifiesto como 0, 1 o None (sin etiqueta), igual
+    que en data/parkinson_data.data. Acepta '1.0'; otra cosa es ValueError.
+    """
+    if label is None or str(label).strip() == '':
+        return None
+    try:
+        value = float(label)
+    except ValueError:
+        value = None
+    if value not in (0.0, 1.0):
+        raise ValueError(f"status debe ser 0 o 1, no {label!r}")
+    return int(value)
+
+
+def dataset_row(name, features, status):
+    """Convierte el vector de 22 características en una fila del dataset."""
+    values = list(features)
+    return [name] + values[:STATUS_POSITION] + [status] + values[STATUS_POSITION:]
+
+
+# ------------------- MANIFIESTO -------------------
+
+class Manifest:
+    """Manifiesto SQLite con estado y lease por archivo."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        # Sin WAL: el manifiesto puede estar en un sistema de archivos compartido
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                path TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                status_label TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                features TEXT,
+                error TEXT,
+                updated_at REAL
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ix_items_state ON items (state, lease_expires)')
+
+    def add(self, entries):
+        """Registra (path, name, status) nuevos; los ya existentes se ignoran."""
+        rows = []
+        for path, name, status in entries:
+            try:
+                rows.append((path, name, parse_status(status)))
+            except ValueError as e:
+                raise SystemExit(f"[ERROR] {path}: {e}")
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO items (path, name, status_label) VALUES (?, ?, ?)',
+            rows
+        )
+        self.conn.execute('COMMIT')
+
+    def claim(self, owner, count, lease_seconds, retry_failed=False, max_attempts=3):
+        """Reclama hasta `count` archivos pendientes o con lease caducado."""
+        now = time.time()
+        states = ('pending', 'leased', 'failed') if retry_failed else ('pending', 'leased')
+        self.conn.execute('BEGIN IMMEDIATE')
+        rows = self.conn.execute(
+            f"""SELECT path, name, status_label FROM items
+                WHERE state IN ({','.join('?' * len(states))})
+                  AND (state != 'leased' OR lease_expires < ?)
+                  AND attempts < ?
+                ORDER BY path LIMIT ?""",
+            (*states, now, max_attempts, count)
+        ).fetchall()
+        self.conn.executemany(
+            """UPDATE items SET state = 'leased', lease_owner = ?, lease_expires = ?,
+                   attempts = attempts + 1, updated_at = ? WHERE path = ?""",
+            [(owner, now + lease_seconds, now, r[0]) for r in rows]
+        )
+        self.conn.execute('COMMIT')
+        return rows
+
+    def complete(self, owner, results, lease_seconds):
+        """Marca resultados como terminados y renueva el lease del resto del lote."""
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany(
+            """UPDATE items SET state = ?, features = ?, error = ?, lease_owner = NULL,
+                   lease_expires = NULL, updated_at = ? WHERE path = ? AND lease_owner = ?""",
+            [('failed' if error else 'done', json.dumps(features) if not error else None,
+              error, now, path, owner) for path, features, error in results]
+        )
+        self.conn.execute(
+            "UPDATE items SET lease_expires = ? WHERE state = 'leased' AND lease_owner = ?",
+            (now + lease_seconds, owner)
+        )
+        self.conn.execute('COMMIT')
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM items GROUP BY state').fetchall())
+
+    def done_rows(self):
+        return self.conn.execute(
+            "SELECT name, features, status_label FROM items WHERE state = 'done' ORDER BY path"
+        )
+
+
+def discover(input_path):
+    """Devuelve (path, name, status) desde un directorio o un manifiesto CSV."""
+    entries = []
+    if os.path.isdir(input_path):
+        for root, _, files in os.walk(input_path):
+            for filename in sorted(files):
+                if filename.lower().endswith(AUDIO_EXTENSIONS):
+                    path = os.path.abspath(os.path.join(root, filename))
+                    entries.append((path, os.path.splitext(filename)[0], None))
+    else:
+        base = os.path.dirname(os.path.abspath(input_path))
+        with open(input_path, newline='') as f:
+            # Las etiquetas se validan aquí, antes de extraer nada
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                path = row['path'] if os.path.isabs(row['path']) else os.path.join(base, row['path'])
+                name = row.get('name') or os.path.splitext(os.path.basename(path))[0]
+                try:
+                    status = parse_status(row.get('status'))
+                except ValueError as e:
+                    raise SystemExit(f"[ERROR] {input_path}, línea {line}: {e}")
+                entries.append((path, name, status))
+    return entries
+
+
+# ------------------- ESCRITORES -------------------
+
+class CsvWriter:
+    def __init__(self, path):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        # Nombres ya escritos por una ejecución anterior
+        self.names = set()
+        if not new_file:
+            with open(path, newline='') as f:
+                self.names = {row['name'] for row in csv.DictReader(f)}
+        self.f = open(path, 'a', newline='')
+        self.writer = csv.writer(self.f)
+        if new_file:
+            self.writer.writerow(DATASET_COLUMNS)
+
+    def write(self, rows):
+        rows = _new_rows(self.names, rows)
+        if not rows:
+            return
+        self.writer.writerows(rows)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    """Escribe un row group por lote; cada ejecución crea un archivo part-*.parquet nuevo."""
+
+    def __init__(self, path, worker_id):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit('Para escribir Parquet instale pyarrow: pip install pyarrow')
+        self.pa = pa
+        os.makedirs(path, exist_ok=True)
+        self.names = set()
+        for existing in sorted(os.listdir(path)):
+            if existing.endswith('.parquet'):
+                try:
+                    table = pq.read_table(os.path.join(path, existing), columns=['name'])
+                except Exception as e:
+                    # Parte de una ejecución que no llegó a cerrarse (o en curso en otra máquina)
+                    print(f"[AVISO] {existing} no se puede leer: {e}")
+                    continue
+                self.names.update(table.column('name').to_pylist())
+        filename = f'part-{worker_id}-{int(time.time())}.parquet'
+        fields = [pa.field('name', pa.string())]
+        for col in DATASET_COLUMNS[1:]:
+            fields.append(pa.field(col, pa.int64() if col == 'status' else pa.float64()))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(os.path.join(path, filename), self.schema, compression='zstd')
+
+    def write(self, rows):
+        rows = _new_rows(self.names, rows)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        arrays = []
+        for col, values in zip(DATASET_COLUMNS, columns):
+            if col == 'status':
+                # Los manifiestos anteriores guardaban la etiqueta sin validar
+                values = [parse_status(v) for v in values]
+            arrays.append(self.pa.array(values, type=self.schema.field(col).type))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _new_rows(names, rows):
+    """Filtra las filas cuyo nombre ya está en la salida y registra las nuevas."""
+    new = []
+    for row in rows:
+        if row[0] not in names:
+            names.add(row[0])
+            new.append(row)
+    return new
+
+
+def open_writer(output, fmt, worker_id):
+    if fmt == 'parquet':
+        return ParquetWriter(output, worker_id)
+    return CsvWriter(output)
+
+
+# ------------------- EJECUCIÓN -------------------
+
+_store = None
+_trace = False
+
+
+def _init_worker(cache_path, trace):
+    global extract_features, _store, _trace
+    from extract_features import extract_features
+    _trace = trace
+    if cache_path and not trace:
+        from feature_store import FeatureStore
+        _store = FeatureStore(cache_path)
+
+
+def _extract_one(path):
+    """Se ejecuta en el proceso hijo. Devuelve (path, features, error, etapas de la traza o None)."""
+    if not os.path.exists(path):
+        return path, None, 'archivo no encontrado', None
+    if _store is not None:
+        features, error, _ = _store.extract(path)
+        return path, features, error, None
+    if _trace:
+        features, trace = extract_features(path, trace=True)
+        return path, features, trace.error, trace.stages
+    try:
+        return path, extract_features(path, raise_errors=True), None, None
+    except Exception as e:
+        return path, None, str(e) or type(e).__name__, None
+
+
+def _add_stages(totals, stages):
+    for stage in stages:
+        total = totals.setdefault(stage['stage'], {'n': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0, 'peak_bytes': 0})
+        total['n'] += 1
+        total['wall_ms'] += stage['wall_ms']
+        total['cpu_ms'] += stage['cpu_ms']
+        total['peak_bytes'] = max(total['peak_bytes'], stage['peak_bytes'] or 0)
+
+
+def _print_stages(totals):
+    print("\n=== Etapas (--trace) ===")
+    for name, total in totals.items():
+        print(f"  {name:12s} {total['wall_ms'] / total['n']:9.1f} ms pared  "
+              f"{total['cpu_ms'] / total['n']:9.1f} ms CPU  pico {total['peak_bytes'] / 1e6:7.1f} MB")
+
+
+def run(args):
+    manifest = Manifest(args.manifest)
+    if args.input:
+        entries = discover(args.input)
+        manifest.add(entries)
+        print(f"Registrados {len(entries)} archivos en {args.manifest}")
+        repeated = len(entries) - len({name for _, name, _ in entries})
+        if repeated:
+            print(f"[AVISO] {repeated} archivos repiten nombre: en la salida solo se escribe el primero")
+
+    worker_id = args.worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    writer = open_writer(args.output, args.format, worker_id)
+    processed = 0
+    start = time.time()
+    stages = {}
+
+    # Con --trace no se usa la caché: se mide la extracción de cada archivo
+    cache_path = None if args.no_cache else args.cache
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(cache_path, args.trace)) as pool:
+        while True:
+            claimed = manifest.claim(worker_id, args.claim_size, args.lease_seconds,
+                                     args.retry_failed, args.max_attempts)
+            if not claimed:
+                break
+            labels = {path: (name, status) for path, name, status in claimed}
+            pending = []
+            for path, features, error, trace in pool.imap_unordered(_extract_one, list(labels),
+                                                                    chunksize=args.chunksize):
+                if trace:
+                    _add_stages(stages, trace)
+                pending.append((path, features, error))
+                if len(pending) >= args.flush_every:
+                    processed += _flush(manifest, writer, worker_id, pending, labels, args.lease_seconds)
+                    pending = []
+            if pending:
+                processed += _flush(manifest, writer, worker_id, pending, labels, args.lease_seconds)
+            elapsed = time.time() - start
+            print(f"  {processed} archivos procesados ({processed / elapsed:.2f}/s) - {manifest.counts()}")
+
+    writer.close()
+    if stages:
+        _print_stages(stages)
+    print(f"\n[OK] Ejecución terminada: {manifest.counts()}")
+
+
+def _flush(manifest, writer, worker_id, results, labels, lease_seconds):
+    # Primero la salida y después el manifiesto: si el proceso muere entre
+    # ambos, al reanudar se vuelve a extraer y el escritor descarta la fila repetida
+    rows = []
+    for path, features, error in results:
+        if error:
+            print(f"[ERROR] {path}: {error}")
+            continue
+        name, status = labels[path]
+        rows.append(dataset_row(name, features, status))
+    if rows:
+        writer.write(rows)
+    manifest.complete(worker_id, results, lease_seconds)
+    return len(results)
+
+
+def status(args):
+    print(Manifest(args.manifest).counts())
+
+
+def export(args):
+    """Reconstruye la tabla completa desde el manifiesto (útil al combinar varias máquinas)."""
+    manifest = Manifest(args.manifest)
+    if args.format == 'csv' and os.path.exists(args.output):
+        os.remove(args.output)
+    writer = open_writer(args.output, args.format, 'export')
+    batch = []
+    total = 0
+    for name, features, status_label in manifest.done_rows():
+        batch.append(dataset_row(name, json.loads(features), status_label))
+        if len(batch) >= 1000:
+            writer.write(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        writer.write(batch)
+        total += len(batch)
+    writer.close()
+    print(f"[OK] {total} filas exportadas a {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extracción de características por lotes')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_run = sub.add_parser('run', help='Procesar archivos pendientes del manifiesto')
+    p_run.add_argument('--input', help='Directorio de grabaciones o manifiesto CSV (path[,name,status])')
+    p_run.add_argument('--manifest', required=True, help='Manifiesto SQLite (puede ser compartido)')
+    p_run.add_argument('--output', required=True, help='Archivo CSV o directorio Parquet de salida')
+    p_run.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    p_run.add_argument('--workers', type=int, default=os.cpu_count())
+    p_run.add_argument('--chunksize', type=int, default=4, help='Tareas por envío al pool')
+    p_run.add_argument('--claim-size', type=int, default=256, help='Archivos reclamados por lease')
+    p_run.add_argument('--flush-every', type=int, default=32, help='Resultados por escritura')
+    p_run.add_argument('--lease-seconds', type=float, default=900)
+    p_run.add_argument('--worker-id', help='Identificador de esta máquina/proceso')
+    p_run.add_argument('--retry-failed', action='store_true')
+    p_run.add_argument('--max-attempts', type=int, default=3)
+    p_run.add_argument('--cache', default=DEFAULT_DB_PATH, help='Caché persistente de características')
+    p_run.add_argument('--no-cache', action='store_true', help='Extraer siempre, sin consultar la caché')
+    p_run.add_argument('--trace', action='store_true',
+                       help='Medir tiempo y memoria por etapa (más lento; no usa la caché)')
+    p_run.set_defaults(func=run)
+
+    p_status = sub.add_parser('status', help='Mostrar el progreso del manifiesto')
+    p_status.add_argument('--manifest', required=True)
+    p_status.set_defaults(func=status)
+
+    p_export = sub.add_parser('export', help='Exportar todos los resultados terminados')
+    p_export.add_argument('--manifest', required=True)
+    p_export.add_argument('--output', required=True)
+    p_export.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    p_export.set_defaults(func=export)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
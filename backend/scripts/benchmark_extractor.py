@@ -0,0 +1,213 @@
+"""
+Benchmark del extractor de características sobre un corpus sintético.
+
+Genera vocales con F0, jitter, shimmer, ruido, duración y frecuencia de
+muestreo controlados, mide cada etapa de extract_features con su traza y
+añade el resultado a un historial JSON Lines. Termina con código 1 si alguna
+etapa es más lenta que la mediana de las ejecuciones anteriores en la misma
+máquina (arquitectura y CPU), con la misma versión de Python y la misma
+rejilla, por encima del umbral. Una ejecución con regresiones no se añade al
+historial (no pasa a formar parte de la referencia) salvo con --accept.
+
+Uso:
+    python scripts/benchmark_extractor.py [--repeats 3] [--threshold 0.25]
+    python scripts/benchmark_extractor.py --accept    # aceptar la nueva referencia
+    python scripts/benchmark_extractor.py --check-kernels
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(__file__))
+from extract_features import extract_features
+from synthetic_voice import build_grid, generate_corpus
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'extractor_benchmark_history.jsonl')
+
+# Índices en el vector de 22 características
+JITTER_PERCENT_IDX = 3
+SHIMMER_IDX = 8
+
+# (índice, parámetro, ¿se exige en el punto?) de la comprobación de kernels.
+# El jitter se calcula por tramas: con ruido lo dominan el ruido y el
+# shimmer, y en la rejilla por defecto (ruido 0.05, shimmer 0.08) baja aunque
+# el real suba, así que solo se exige en los puntos sin ruido. El shimmer se
+# exige siempre.
+KERNEL_CHECKS = (
+    (JITTER_PERCENT_IDX, 'jitter', lambda params: params['noise'] == 0),
+    (SHIMMER_IDX, 'shimmer', lambda params: True),
+)
+
+
+def run_benchmark(corpus, repeats):
+    """Ejecuta el extractor sobre el corpus y devuelve la mediana por etapa (ms)."""
+    stage_times = {}
+    results = []
+    for item in corpus:
+        for _ in range(repeats):
+            features, trace = extract_features(item['path'], trace=True)
+            if trace.error:
+                print(f"[ERROR] {os.path.basename(item['path'])}: {trace.error}")
+            for stage in trace.stages:
+                stage_times.setdefault(stage['stage'], []).append(stage['wall_ms'])
+        results.append({'item': item, 'features': features})
+    medians = {name: statistics.median(times) for name, times in stage_times.items()}
+    return medians, results
+
+
+def environment():
+    """Máquina y versión de Python con que se comparan las ejecuciones."""
+    cpu = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            cpu = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), cpu)
+    except OSError:
+        pass
+    return {
+        'python': '.'.join(platform.python_version_tuple()[:2]),
+        'machine': platform.machine(),
+        'cpu': cpu,
+    }
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def find_regressions(medians, history, grid_key, env, threshold, min_ms, window):
+    """
+    Compara contra la mediana de las últimas `window` ejecuciones con la
+    misma rejilla en el mismo entorno (ver environment()).
+    """
+    previous = [h for h in history
+                if h.get('grid_key') == grid_key and all(h.get(k) == v for k, v in env.items())][-window:]
+    regressions = []
+    for stage, current in medians.items():
+        past = [h['stages'][stage] for h in previous if stage in h['stages']]
+        if not past:
+            continue
+        baseline = statistics.median(past)
+        if current > baseline * (1 + threshold) and current - baseline > min_ms:
+            regressions.append((stage, baseline, current))
+    return regressions
+
+
+def check_kernels(results):
+    """
+    Verifica que el jitter y shimmer extraídos crecen con los valores reales
+    del corpus (mismos demás parámetros), en los puntos que indica
+    KERNEL_CHECKS; el resto se muestra sin exigirlo. Devuelve la lista de
+    fallos.
+    """
+    failures = []
+    for idx, key, required in KERNEL_CHECKS:
+        groups = {}
+        for r in results:
+            params = r['item']['params']
+            other = tuple(sorted((k, v) for k, v in params.items() if k != key))
+            groups.setdefault(other, []).append((r['item']['truth'][key], r['features'][idx]))
+        for other, points in groups.items():
+            points.sort()
+            strict = required(dict(other))
+            for truth, value in points:
+                print(f"  {key:8s} real={truth:.5f} extraído={value:.6f} {dict(other)}"
+                      f"{'' if strict else ' (informativo)'}")
+            if not strict:
+                continue
+            for (t_lo, v_lo), (t_hi, v_hi) in zip(points, points[1:]):
+                if t_hi > t_lo and v_hi < v_lo:
+                    failures.append(f"{key}: real {t_lo:.4f}->{t_hi:.4f} pero extraído {v_lo:.6f}->{v_hi:.6f} ({dict(other)})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de extract_features sobre voz sintética')
+    parser.add_argument('--f0', type=float, nargs='+', default=[100.0, 200.0])
+    parser.add_argument('--jitter', type=float, nargs='+', default=[0.002, 0.01])
+    parser.add_argument('--shimmer', type=float, nargs='+', default=[0.02, 0.08])
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.0, 0.05])
+    parser.add_argument('--duration', type=float, nargs='+', default=[2.0])
+    parser.add_argument('--sr', type=int, nargs='+', default=[22050])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Regresión relativa tolerada por etapa (0.25 = 25 %%)')
+    parser.add_argument('--min-ms', type=float, default=5.0,
+                        help='Diferencia absoluta mínima para considerar regresión')
+    parser.add_argument('--window', type=int, default=5,
+                        help='Número de ejecuciones previas usadas como referencia')
+    parser.add_argument('--history', default=HISTORY_PATH)
+    parser.add_argument('--no-save', action='store_true', help='No añadir al historial')
+    parser.add_argument('--accept', action='store_true',
+                        help='Añadir la ejecución al historial aunque tenga regresiones')
+    parser.add_argument('--check-kernels', action='store_true',
+                        help='Comprobar jitter/shimmer extraídos contra los valores reales')
+    args = parser.parse_args()
+
+    grid = build_grid(args.f0, args.jitter, args.shimmer, args.noise, args.duration, args.sr)
+    grid_key = json.dumps(grid, sort_keys=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"Generando corpus sintético: {len(grid)} archivos")
+        corpus = generate_corpus(tmp_dir, grid)
+        print(f"Ejecutando extractor ({args.repeats} repeticiones)...")
+        medians, results = run_benchmark(corpus, args.repeats)
+
+    print("\n=== Mediana por etapa (ms) ===")
+    for stage, ms in medians.items():
+        print(f"  {stage:10s} {ms:10.2f}")
+
+    exit_code = 0
+    history = load_history(args.history)
+    env = environment()
+    regressions = find_regressions(medians, history, grid_key, env, args.threshold, args.min_ms, args.window)
+    if regressions:
+        print("\n[ERROR] Regresiones detectadas:")
+        for stage, baseline, current in regressions:
+            print(f"  {stage}: {baseline:.2f} ms -> {current:.2f} ms ({(current / baseline - 1) * 100:+.1f}%)")
+        exit_code = 1
+
+    if args.check_kernels:
+        print("\n=== Comprobación de jitter/shimmer ===")
+        failures = check_kernels(results)
+        if failures:
+            print("\n[ERROR] Jitter/shimmer no siguen a los valores reales:")
+            for failure in failures:
+                print(f"  {failure}")
+            exit_code = 1
+
+    if not args.no_save:
+        if regressions and not args.accept:
+            print("\nHistorial sin cambios: la ejecución tiene regresiones (usar --accept para añadirla)")
+        else:
+            append_history(args.history, {
+                'timestamp': datetime.utcnow().isoformat(),
+                **env,
+                'grid_key': grid_key,
+                'repeats': args.repeats,
+                'stages': medians,
+                'regressions': [stage for stage, _, _ in regressions],
+            })
+            print(f"\nHistorial actualizado: {args.history}")
+
+    if exit_code == 0:
+        print("\n[OK] Sin regresiones")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark de serialización de respuestas con 10k filas de voice_test.
+
+Compara el camino anterior (objetos ORM + to_dict escrito a mano + json de
+la librería estándar) con el serializador generado por columnas sobre filas
+proyectadas y el proveedor JSON basado en orjson, tanto por separado como de
+extremo a extremo en /voice_results/<user_id>.
+
+Uso:
+    python scripts/benchmark_serialization.py [--rows 10000] [--repeats 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import app, db, FEATURE_NAMES, VoiceTest, OrjsonProvider, orjson, select_columns
+
+
+def legacy_to_dict(obj):
+    """Equivalente al VoiceTest.to_dict escrito a mano que había antes."""
+    data = {'id': obj.id, 'user_id': obj.user_id, 'date': obj.date.isoformat(),
+            'probability': obj.probability, 'level': obj.level}
+    for name in FEATURE_NAMES:
+        data[name] = getattr(obj, name)
+    return data
+
+
+def seed(rows):
+    rng = random.Random(0)
+    start = datetime(2025, 1, 1)
+    db.session.bulk_insert_mappings(VoiceTest, [
+        dict({'user_id': 'bench', 'date': start + timedelta(minutes=i),
+              'probability': rng.random(), 'level': 'Bajo'},
+             **{name: rng.random() for name in FEATURE_NAMES})
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+def measure(label, fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    median = statistics.median(times)
+    print(f"  {label:55s} {median:9.1f} ms")
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de serialización JSON')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        seed(args.rows)
+        serialize = VoiceTest.serializer()
+        stmt = select_columns(VoiceTest).where(VoiceTest.user_id == 'bench')
+
+        def orm_objects():
+            db.session.expunge_all()
+            return VoiceTest.query.filter_by(user_id='bench').all()
+
+        print(f"=== {args.rows} filas de voice_test ===")
+        measure('ORM + to_dict manual + json (anterior)',
+                lambda: json.dumps([legacy_to_dict(o) for o in orm_objects()]), args.repeats)
+        measure('ORM + serializador por columnas + json',
+                lambda: json.dumps([serialize(o) for o in orm_objects()]), args.repeats)
+        measure('filas proyectadas + serializador por columnas + json',
+                lambda: json.dumps([serialize(r) for r in db.session.execute(stmt)]), args.repeats)
+        if orjson is not None:
+            measure('filas proyectadas + serializador por columnas + orjson',
+                    lambda: orjson.dumps([serialize(r) for r in db.session.execute(stmt)]), args.repeats)
+
+        rows = [serialize(r) for r in db.session.execute(stmt)]
+        print("\n=== Solo codificación JSON de la lista de dicts ===")
+        measure('json.dumps', lambda: json.dumps(rows), args.repeats)
+        if orjson is not None:
+            measure('orjson.dumps', lambda: orjson.dumps(rows), args.repeats)
+
+    print("\n=== Extremo a extremo: GET /voice_results/bench ===")
+    client = app.test_client()
+    providers = [('DefaultJSONProvider', DefaultJSONProvider(app))]
+    if orjson is not None:
+        providers.append(('OrjsonProvider', OrjsonProvider(app)))
+    original = app.json
+    for name, provider in providers:
+        app.json = provider
+        measure(name, lambda: client.get('/voice_results/bench').get_data(), args.repeats)
+    app.json = original
+
+
+if __name__ == '__main__':
+    main()
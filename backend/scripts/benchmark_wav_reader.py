@@ -0,0 +1,95 @@
+"""
+Benchmark de lectura de WAV: lector memmap (wav_reader) contra librosa.load.
+
+Lee todos los .wav de un directorio con ambos métodos y muestra el
+rendimiento (MB/s, segundos de audio por segundo). Ambos devuelven la señal
+completa en float32, así que no se compara la memoria. Si no se indica
+directorio, genera un corpus sintético temporal.
+
+Uso:
+    python scripts/benchmark_wav_reader.py [--dir grabaciones/] [--repeats 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from wav_reader import load_wav
+
+
+def _librosa_load(path):
+    import librosa
+    return librosa.load(path, sr=None)
+
+
+def time_loader(name, loader, paths, repeats):
+    total_bytes = sum(os.path.getsize(p) for p in paths) * repeats
+    audio_seconds = 0.0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for path in paths:
+            y, sr = loader(path)
+            audio_seconds += len(y) / sr
+    elapsed = time.perf_counter() - start
+    print(f"  {name:10s} {elapsed:8.3f} s  {total_bytes / elapsed / 1e6:8.1f} MB/s  "
+          f"{audio_seconds / elapsed:8.1f} s audio/s")
+    return elapsed
+
+
+def check_equivalence(paths):
+    """Verifica que ambos lectores devuelven la misma señal."""
+    worst = 0.0
+    for path in paths:
+        a, sr_a = load_wav(path)
+        b, sr_b = _librosa_load(path)
+        if sr_a != sr_b or len(a) != len(b):
+            print(f"[ERROR] {path}: sr/longitud distintos ({sr_a}/{len(a)} vs {sr_b}/{len(b)})")
+            return False
+        worst = max(worst, float(np.max(np.abs(a - b))) if len(a) else 0.0)
+    print(f"  Diferencia máxima entre lectores: {worst:.2e}")
+    return worst < 1e-6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark memmap WAV vs librosa.load')
+    parser.add_argument('--dir', help='Directorio con archivos .wav')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--files', type=int, default=20, help='Archivos sintéticos si no hay --dir')
+    parser.add_argument('--duration', type=float, default=30.0, help='Duración de los archivos sintéticos')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.dir:
+            paths = sorted(os.path.join(root, f) for root, _, files in os.walk(args.dir)
+                           for f in files if f.lower().endswith('.wav'))
+        else:
+            from synthetic_voice import generate_vowel, write_wav
+            paths = []
+            for i in range(args.files):
+                y, _ = generate_vowel(duration=args.duration, sr=44100, seed=i)
+                path = os.path.join(tmp_dir, f'synth_{i:03d}.wav')
+                write_wav(path, y, 44100)
+                paths.append(path)
+
+        if not paths:
+            print("No se encontraron archivos .wav")
+            return
+        print(f"{len(paths)} archivos, {sum(os.path.getsize(p) for p in paths) / 1e6:.1f} MB")
+
+        ok = check_equivalence(paths)
+        print("\n=== Lectura ===")
+        t_mmap = time_loader('memmap', load_wav, paths, args.repeats)
+        t_librosa = time_loader('librosa', _librosa_load, paths, args.repeats)
+        print(f"\nAceleración: {t_librosa / t_mmap:.2f}x")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
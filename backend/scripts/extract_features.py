@@ -5,55 +5,202 @@ Las características extraídas deben coincidir exactamente con las del dataset.
 
 import librosa
 import numpy as np
+import threading
+import time
+import tracemalloc
 import warnings
+from contextlib import contextmanager, nullcontext
+from wav_reader import WavFormatError, load_wav
 warnings.filterwarnings('ignore')
 
 
-def extract_features(audio_path):
+# tracemalloc es global al proceso y en el servidor puede haber varias
+# trazas a la vez (una por hilo). Se arranca con la primera traza activa y
+# se para con la última (solo si lo arrancó una traza). El pico también es
+# global: una etapa solo lo mide si su traza es la única activa y nadie lo
+# ha reiniciado mientras tanto; si no, peak_bytes es None.
+_trace_lock = threading.Lock()
+_active_traces = 0
+_started_tracemalloc = False
+_peak_epoch = 0
+
+
+class ExtractionTrace:
+    """
+    Traza opcional de la extracción: tiempo de pared, tiempo de CPU y pico de
+    memoria (tracemalloc) por etapa, más la duración y frecuencia de muestreo
+    del audio de entrada.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.duration = None
+        self.sample_rate = None
+        self.error = None
+        self._active = False
+
+    def start(self):
+        global _active_traces, _started_tracemalloc, _peak_epoch
+        with _trace_lock:
+            if _active_traces == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracemalloc = True
+            _active_traces += 1
+            # Invalida el pico que esté midiendo otra traza
+            _peak_epoch += 1
+            self._active = True
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def stop(self):
+        global _active_traces, _started_tracemalloc
+        self.total_wall = time.perf_counter() - self._wall_start
+        self.total_cpu = time.process_time() - self._cpu_start
+        with _trace_lock:
+            if not self._active:
+                return
+            self._active = False
+            _active_traces -= 1
+            if _active_traces == 0 and _started_tracemalloc:
+                tracemalloc.stop()
+                _started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name):
+        """Mide una etapa; si falla, registra el error antes de propagarlo."""
+        global _peak_epoch
+        with _trace_lock:
+            epoch = None
+            if _active_traces == 1:
+                current, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                _peak_epoch += 1
+                epoch = _peak_epoch
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        except Exception as e:
+            self.error = f"{name}: {e}"
+            raise
+        finally:
+            with _trace_lock:
+                peak = None
+                if epoch is not None and epoch == _peak_epoch:
+                    peak = max(tracemalloc.get_traced_memory()[1] - current, 0)
+            self.stages.append({
+                'stage': name,
+                'wall_ms': (time.perf_counter() - wall) * 1000.0,
+                'cpu_ms': (time.process_time() - cpu) * 1000.0,
+                'peak_bytes': peak,
+            })
+
+    def to_dict(self):
+        return {
+            'duration_s': self.duration,
+            'sample_rate': self.sample_rate,
+            'total_wall_ms': getattr(self, 'total_wall', 0.0) * 1000.0,
+            'total_cpu_ms': getattr(self, 'total_cpu', 0.0) * 1000.0,
+            'stages': self.stages,
+            'error': self.error,
+        }
+
+
+def _stage(tracer, name):
+    return tracer.stage(name) if tracer is not None else nullcontext()
+
+
+def load_audio(audio_path):
+    """
+    Carga el audio como (y, sr) en mono y a su frecuencia original.
+    Los WAV se leen con memmap; el resto de formatos (o WAV no soportados)
+    con librosa.load.
+    """
+    if str(audio_path).lower().endswith('.wav'):
+        try:
+            return load_wav(audio_path)
+        except WavFormatError:
+            pass
+    return librosa.load(audio_path, sr=None)
+
+
+def extract_features(audio_path, trace=False, raise_errors=False):
     """
     Extrae las 22 características acústicas de un archivo de audio.
-    
+
     Args:
         audio_path: Ruta al archivo de audio (.wav)
-    
+        trace: Si es True, también devuelve un ExtractionTrace con los
+            tiempos y la memoria de cada etapa
+        raise_errors: Si es True, un error de extracción se propaga en lugar
+            de devolver 22 ceros (para detectarlo sin activar la traza)
+
     Returns:
         Lista con 22 valores numéricos en el orden exacto del dataset:
-        [MDVP:Fo(Hz), MDVP:Fhi(Hz), MDVP:Flo(Hz), MDVP:Jitter(%), 
+        [MDVP:Fo(Hz), MDVP:Fhi(Hz), MDVP:Flo(Hz), MDVP:Jitter(%),
          MDVP:Jitter(Abs), MDVP:RAP, MDVP:PPQ, Jitter:DDP,
          MDVP:Shimmer, MDVP:Shimmer(dB), Shimmer:APQ3, Shimmer:APQ5,
          MDVP:APQ, Shimmer:DDA, NHR, HNR, RPDE, DFA, spread1, spread2, D2, PPE]
+        Con trace=True, una tupla (features, trace).
     """
+    tracer = ExtractionTrace() if trace else None
+    if tracer is not None:
+        tracer.start()
     try:
-        # Cargar audio
-        y, sr = librosa.load(audio_path, sr=None)
-        
-        # 1. MDVP:Fo(Hz) - Frecuencia fundamental (media)
+        features = _extract(audio_path, tracer)
+    except Exception as e:
+        if raise_errors:
+            if tracer is not None:
+                tracer.stop()
+            raise
+        print(f"Error extrayendo características: {e}")
+        # Retornar valores por defecto en caso de error
+        features = [0.0] * 22
+        if tracer is not None and tracer.error is None:
+            tracer.error = str(e)
+    if tracer is not None:
+        tracer.stop()
+        return features, tracer
+    return features
+
+
+def _extract(audio_path, tracer):
+    # Cargar audio
+    with _stage(tracer, 'load'):
+        y, sr = load_audio(audio_path)
+    if tracer is not None:
+        tracer.duration = len(y) / sr if sr else 0.0
+        tracer.sample_rate = sr
+
+    # 1. MDVP:Fo(Hz) - Frecuencia fundamental (media)
+    with _stage(tracer, 'pyin'):
         f0, voiced_flag, voiced_probs = librosa.pyin(
             y, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7')
         )
-        f0_clean = f0[~np.isnan(f0)]
-        mdvp_fo = np.mean(f0_clean) if len(f0_clean) > 0 else 0.0
-        
-        # 2. MDVP:Fhi(Hz) - Frecuencia máxima
-        mdvp_fhi = np.max(f0_clean) if len(f0_clean) > 0 else 0.0
-        
-        # 3. MDVP:Flo(Hz) - Frecuencia mínima
-        mdvp_flo = np.min(f0_clean) if len(f0_clean) > 0 else 0.0
-        
-        # 4-8. Jitter measures (variación de frecuencia)
+    f0_clean = f0[~np.isnan(f0)]
+    mdvp_fo = np.mean(f0_clean) if len(f0_clean) > 0 else 0.0
+
+    # 2. MDVP:Fhi(Hz) - Frecuencia máxima
+    mdvp_fhi = np.max(f0_clean) if len(f0_clean) > 0 else 0.0
+
+    # 3. MDVP:Flo(Hz) - Frecuencia mínima
+    mdvp_flo = np.min(f0_clean) if len(f0_clean) > 0 else 0.0
+
+    # 4-8. Jitter measures (variación de frecuencia)
+    with _stage(tracer, 'jitter'):
         if len(f0_clean) > 1:
             periods = 1.0 / f0_clean
             period_diffs = np.diff(periods)
-            
+
             # MDVP:Jitter(%) - Variación porcentual
             jitter_percent = np.mean(np.abs(period_diffs)) / np.mean(periods) * 100
-            
+
             # MDVP:Jitter(Abs) - Jitter absoluto
             jitter_abs = np.mean(np.abs(period_diffs))
-            
+
             # MDVP:RAP - Relative Average Perturbation
             rap = np.mean(np.abs(period_diffs)) / np.mean(periods)
-            
+
             # MDVP:PPQ - Pitch Period Quotient (5-point)
             if len(periods) >= 5:
                 ppq_values = []
@@ -63,7 +210,7 @@ def extract_features(audio_path):
                 ppq = np.mean(ppq_values) if ppq_values else 0.0
             else:
                 ppq = 0.0
-            
+
             # Jitter:DDP - Difference of Differences of Periods
             if len(period_diffs) > 1:
                 ddp = np.mean(np.abs(np.diff(period_diffs)))
@@ -75,24 +222,25 @@ def extract_features(audio_path):
             rap = 0.0
             ppq = 0.0
             ddp = 0.0
-        
-        # 9-14. Shimmer measures (variación de amplitud)
+
+    # 9-14. Shimmer measures (variación de amplitud)
+    with _stage(tracer, 'shimmer'):
         if len(f0_clean) > 1:
             # Obtener amplitudes en los puntos de F0
             frame_length = int(sr * 0.025)  # 25ms frames
             hop_length = int(sr * 0.010)    # 10ms hop
             amplitudes = np.abs(librosa.stft(y, n_fft=frame_length, hop_length=hop_length))
             rms = np.mean(amplitudes, axis=0)
-            
+
             if len(rms) > 1:
                 amp_diffs = np.diff(rms)
-                
+
                 # MDVP:Shimmer
                 shimmer = np.mean(np.abs(amp_diffs)) / np.mean(rms)
-                
+
                 # MDVP:Shimmer(dB)
                 shimmer_db = 20 * np.log10(np.mean(rms[1:]) / np.mean(rms[:-1])) if np.mean(rms[:-1]) > 0 else 0.0
-                
+
                 # Shimmer:APQ3 (3-point)
                 if len(rms) >= 3:
                     apq3_values = []
@@ -102,7 +250,7 @@ def extract_features(audio_path):
                     apq3 = np.mean(apq3_values) if apq3_values else 0.0
                 else:
                     apq3 = 0.0
-                
+
                 # Shimmer:APQ5 (5-point)
                 if len(rms) >= 5:
                     apq5_values = []
@@ -112,7 +260,7 @@ def extract_features(audio_path):
                     apq5 = np.mean(apq5_values) if apq5_values else 0.0
                 else:
                     apq5 = 0.0
-                
+
                 # MDVP:APQ (11-point)
                 if len(rms) >= 11:
                     apq_values = []
@@ -122,7 +270,7 @@ def extract_features(audio_path):
                     apq = np.mean(apq_values) if apq_values else 0.0
                 else:
                     apq = 0.0
-                
+
                 # Shimmer:DDA
                 if len(amp_diffs) > 1:
                     dda = np.mean(np.abs(np.diff(amp_diffs)))
@@ -142,24 +290,26 @@ def extract_features(audio_path):
             apq5 = 0.0
             apq = 0.0
             dda = 0.0
-        
-        # 15. NHR - Noise-to-Harmonics Ratio
-        # Usar análisis espectral
+
+    # 15. NHR - Noise-to-Harmonics Ratio
+    # Usar análisis espectral
+    with _stage(tracer, 'hpss'):
         stft = librosa.stft(y)
         magnitude = np.abs(stft)
         power = magnitude ** 2
-        
+
         # Estimar armónicos y ruido
         harmonic, percussive = librosa.decompose.hpss(magnitude)
         harmonic_power = np.sum(harmonic ** 2)
         noise_power = np.sum(percussive ** 2)
-        nhr = noise_power / harmonic_power if harmonic_power > 0 else 0.0
-        
-        # 16. HNR - Harmonics-to-Noise Ratio
-        hnr = harmonic_power / noise_power if noise_power > 0 else 0.0
-        
-        # 17. RPDE - Recurrence Period Density Entropy
-        # Simplificado: usar entropía de la señal
+    nhr = noise_power / harmonic_power if harmonic_power > 0 else 0.0
+
+    # 16. HNR - Harmonics-to-Noise Ratio
+    hnr = harmonic_power / noise_power if noise_power > 0 else 0.0
+
+    # 17. RPDE - Recurrence Period Density Entropy
+    # Simplificado: usar entropía de la señal
+    with _stage(tracer, 'rpde'):
         if len(f0_clean) > 0:
             hist, _ = np.histogram(f0_clean, bins=50)
             hist = hist[hist > 0]
@@ -167,9 +317,10 @@ def extract_features(audio_path):
             rpde = -np.sum(prob * np.log2(prob + 1e-10))
         else:
             rpde = 0.0
-        
-        # 18. DFA - Detrended Fluctuation Analysis
-        # Implementación simplificada
+
+    # 18. DFA - Detrended Fluctuation Analysis
+    # Implementación simplificada
+    with _stage(tracer, 'dfa'):
         if len(y) > 100:
             # Dividir en ventanas y calcular fluctuación
             window_size = min(100, len(y) // 10)
@@ -181,8 +332,9 @@ def extract_features(audio_path):
             dfa = np.mean(fluctuations) if fluctuations else 0.0
         else:
             dfa = 0.0
-        
-        # 19-20. spread1, spread2 - Parámetros del cepstrum
+
+    # 19-20. spread1, spread2 - Parámetros del cepstrum
+    with _stage(tracer, 'mfcc'):
         mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
         if mfccs.shape[1] > 0:
             # spread1: varianza de los primeros coeficientes
@@ -192,17 +344,19 @@ def extract_features(audio_path):
         else:
             spread1 = 0.0
             spread2 = 0.0
-        
-        # 21. D2 - Dimensión correlativa (simplificada)
-        # Usar correlación de la señal
+
+    # 21. D2 - Dimensión correlativa (simplificada)
+    # Usar correlación de la señal
+    with _stage(tracer, 'd2'):
         if len(y) > 100:
             autocorr = np.correlate(y[:1000], y[:1000], mode='full')
             autocorr = autocorr[len(autocorr)//2:]
             d2 = np.std(autocorr[:100]) if len(autocorr) >= 100 else 0.0
         else:
             d2 = 0.0
-        
-        # 22. PPE - Pitch Period Entropy
+
+    # 22. PPE - Pitch Period Entropy
+    with _stage(tracer, 'ppe'):
         if len(f0_clean) > 0:
             periods = 1.0 / f0_clean
             hist, _ = np.histogram(periods, bins=50)
@@ -211,42 +365,31 @@ def extract_features(audio_path):
             ppe = -np.sum(prob * np.log2(prob + 1e-10))
         else:
             ppe = 0.0
-        
-        # Retornar en el orden exacto del dataset
-        features = [
-            float(mdvp_fo),
-            float(mdvp_fhi),
-            float(mdvp_flo),
-            float(jitter_percent),
-            float(jitter_abs),
-            float(rap),
-            float(ppq),
-            float(ddp),
-            float(shimmer),
-            float(shimmer_db),
-            float(apq3),
-            float(apq5),
-            float(apq),
-            float(dda),
-            float(nhr),
-            float(hnr),
-            float(rpde),
-            float(dfa),
-            float(spread1),
-            float(spread2),
-            float(d2),
-            float(ppe),
-        ]
-        
-        return features
-        
-    except Exception as e:
-        print(f"Error extrayendo características: {e}")
-        # Retornar valores por defecto en caso de error
-        return [0.0] * 22
-
-
-
-
 
+    # Retornar en el orden exacto del dataset
+    features = [
+        float(mdvp_fo),
+        float(mdvp_fhi),
+        float(mdvp_flo),
+        float(jitter_percent),
+        float(jitter_abs),
+        float(rap),
+        float(ppq),
+        float(ddp),
+        float(shimmer),
+        float(shimmer_db),
+        float(apq3),
+        float(apq5),
+        float(apq),
+        float(dda),
+        float(nhr),
+        float(hnr),
+        float(rpde),
+        float(dfa),
+        float(spread1),
+        float(spread2),
+        float(d2),
+        float(ppe),
+    ]
 
+    return features
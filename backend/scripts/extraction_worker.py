@@ -0,0 +1,104 @@
+"""
+Trabajador de la cola de extracción (tabla trabajo_extraccion).
+
+Reclama trabajos encolados por /predict_voice?async=true, extrae las
+características del audio, predice y guarda el resultado en el trabajo (y,
+si se pidió, el VoiceTest). Se pueden lanzar tantos procesos como se quiera,
+en varias máquinas, contra la misma base de datos: en Postgres se reparten
+los trabajos con SELECT ... FOR UPDATE SKIP LOCKED. Cada máquina necesita
+acceso a AUDIO_STORE_DIR (p. ej. un volumen compartido con los servidores
+web) y a model.pkl/scaler.pkl.
+
+Un trabajo reclamado queda oculto JOB_VISIBILITY_SECONDS; si el proceso
+muere, otro lo reclama al caducar el plazo. Con SIGTERM o Ctrl+C cada
+proceso termina el trabajo en curso y sale.
+
+Uso:
+    python scripts/extraction_worker.py [--processes 4] [--worker-id hostA]
+    python scripts/extraction_worker.py --once    # vaciar la cola y salir
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_parar = False
+
+
+def _pedir_parada(signum, frame):
+    global _parar
+    _parar = True
+
+
+def work(worker_id, args):
+    """Bucle de un proceso trabajador. La aplicación se importa aquí, ya en el proceso hijo."""
+    signal.signal(signal.SIGTERM, _pedir_parada)
+    signal.signal(signal.SIGINT, _pedir_parada)
+    from app import app, db, claim_extraction_jobs, complete_job, fail_job, run_extraction_job
+
+    procesados = fallidos = 0
+    with app.app_context():
+        while not _parar:
+            try:
+                trabajos = claim_extraction_jobs(worker_id, args.batch)
+            except Exception as e:
+                # p. ej. "database is locked" en SQLite: se reintenta en la siguiente vuelta
+                db.session.rollback()
+                print(f"[{worker_id}] Error reclamando trabajos: {e}")
+                trabajos = []
+            if not trabajos:
+                if args.once:
+                    break
+                time.sleep(args.poll)
+                continue
+
+            for trabajo in trabajos:
+                inicio = time.perf_counter()
+                try:
+                    resultado = run_extraction_job(trabajo)
+                except Exception as e:
+                    db.session.rollback()
+                    fail_job(trabajo.id, worker_id, e)
+                    fallidos += 1
+                    print(f"[{worker_id}] Trabajo {trabajo.id} (intento {trabajo.intentos}) falló: {e}")
+                    continue
+                if not complete_job(trabajo.id, worker_id, resultado):
+                    print(f"[{worker_id}] Trabajo {trabajo.id}: el plazo caducó y lo tiene otro trabajador")
+                procesados += 1
+                print(f"[{worker_id}] Trabajo {trabajo.id} hecho en {time.perf_counter() - inicio:.2f} s")
+    print(f"[{worker_id}] Fin: {procesados} trabajos hechos, {fallidos} fallos")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trabajador de la cola de extracción')
+    parser.add_argument('--processes', type=int, default=1, help='Procesos trabajadores en esta máquina')
+    parser.add_argument('--worker-id', help='Prefijo del identificador (por defecto, host-pid)')
+    parser.add_argument('--batch', type=int, default=1, help='Trabajos reclamados por consulta')
+    parser.add_argument('--poll', type=float, default=1.0, help='Espera (s) cuando la cola está vacía')
+    parser.add_argument('--once', action='store_true', help='Salir cuando no queden trabajos visibles')
+    args = parser.parse_args()
+
+    prefijo = args.worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    if args.processes == 1:
+        work(prefijo, args)
+        return
+
+    procesos = [multiprocessing.Process(target=work, args=(f'{prefijo}-{i}', args))
+                for i in range(args.processes)]
+    for proceso in procesos:
+        proceso.start()
+    # Los hijos reciben también el SIGINT de la terminal; con SIGTERM se reenvía
+    signal.signal(signal.SIGTERM, lambda signum, frame: [p.terminate() for p in procesos])
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for proceso in procesos:
+        proceso.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Caché persistente de características extraídas.
+
+Cada entrada se indexa por (hash SHA-256 del audio, versión del extractor).
+La versión es un hash del código de extract_features.py, de los módulos de
+scripts/ que importa (wav_reader.py) y de la versión de librosa, así que al
+cambiar el extractor las entradas anteriores dejan de usarse
+automáticamente; `compact` las elimina del archivo.
+
+Uso:
+    python scripts/feature_store.py stats [--db data/feature_cache.sqlite]
+    python scripts/feature_store.py compact [--db data/feature_cache.sqlite]
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'feature_cache.sqlite')
+
+_version_cache = None
+
+
+def _local_modules(name, found=None):
+    """Módulo `name` de scripts/ y, recursivamente, los de scripts/ que importa."""
+    found = [] if found is None else found
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name + '.py')
+    if name in found or not os.path.exists(path):
+        return found
+    found.append(name)
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                _local_modules(alias.name, found)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            _local_modules(node.module, found)
+    return found
+
+
+def extractor_version():
+    """
+    Hash del código del extractor, de los módulos de scripts/ que importa
+    (p. ej. wav_reader.py) y de la versión de librosa.
+    """
+    global _version_cache
+    if _version_cache is None:
+        import librosa
+        scripts_dir = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha256()
+        for name in sorted(_local_modules('extract_features')):
+            h.update(name.encode())
+            with open(os.path.join(scripts_dir, name + '.py'), 'rb') as f:
+                h.update(f.read())
+        h.update(librosa.__version__.encode())
+        _version_cache = h.hexdigest()[:16]
+    return _version_cache
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 del contenido del archivo."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class FeatureStore:
+    """Almacén SQLite (audio_hash, extractor_version) -> 22 características."""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS features (
+                audio_hash TEXT NOT NULL,
+                extractor_version TEXT NOT NULL,
+                features TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (audio_hash, extractor_version)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def get(self, audio_hash, version=None):
+        row = self.conn.execute(
+            'SELECT features FROM features WHERE audio_hash = ? AND extractor_version = ?',
+            (audio_hash, version or extractor_version())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, audio_hash, features, version=None):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?)',
+            (audio_hash, version or extractor_version(), json.dumps(features), time.time())
+        )
+        self.conn.commit()
+
+    def extract(self, audio_path):
+        """
+        Devuelve las características del archivo, usando la caché si existen.
+        Los resultados con error no se guardan.
+
+        Returns:
+            (features, error, from_cache)
+        """
+        from extract_features import extract_features
+        audio_hash = file_hash(audio_path)
+        cached = self.get(audio_hash)
+        if cached is not None:
+            return cached, None, True
+        try:
+            features = extract_features(audio_path, raise_errors=True)
+        except Exception as e:
+            return None, str(e) or type(e).__name__, False
+        self.put(audio_hash, features)
+        return features, None, False
+
+    def stats(self):
+        current = extractor_version()
+        rows = self.conn.execute(
+            'SELECT extractor_version, COUNT(*) FROM features GROUP BY extractor_version'
+        ).fetchall()
+        return {'current_version': current,
+                'entries': {v: n for v, n in rows},
+                'stale': sum(n for v, n in rows if v != current)}
+
+    def compact(self):
+        """Elimina entradas de versiones anteriores del extractor y compacta el archivo."""
+        deleted = self.conn.execute(
+            'DELETE FROM features WHERE extractor_version != ?', (extractor_version(),)
+        ).rowcount
+        self.conn.commit()
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.execute('VACUUM')
+        return deleted
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Caché persistente de características')
+    parser.add_argument('command', choices=('stats', 'compact'))
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    args = parser.parse_args()
+
+    store = FeatureStore(args.db)
+    if args.command == 'stats':
+        print(json.dumps(store.stats(), indent=2))
+    else:
+        size_before = os.path.getsize(args.db)
+        deleted = store.compact()
+        print(f"[OK] {deleted} entradas obsoletas eliminadas "
+              f"({size_before / 1e6:.1f} MB -> {os.path.getsize(args.db) / 1e6:.1f} MB)")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Crea las particiones mensuales futuras de voice_test y resultado_prueba y
+desacopla las antiguas (migración e5c0a7d3b918, solo Postgres).
+
+La aplicación ya lo hace en segundo plano cada PARTITION_MAINTENANCE_SECONDS;
+este script sirve para lanzarlo desde cron (con PARTITION_MAINTENANCE_SECONDS=0
+en la aplicación) o a mano. Las particiones desacopladas quedan como tablas
+sueltas (voice_test_pAAAA_MM) hasta que se archiven o se borren.
+
+Uso:
+    python scripts/maintain_partitions.py [--ahead 3] [--retention 24] [--list]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, PARTITIONED_TABLES, is_partitioned, list_partitions, maintain_partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mantenimiento de las particiones mensuales')
+    parser.add_argument('--ahead', type=int, help='Meses futuros con partición (por defecto PARTITION_MONTHS_AHEAD)')
+    parser.add_argument('--retention', type=int,
+                        help='Meses que se mantienen adjuntos; 0 = todos (por defecto PARTITION_RETENTION_MONTHS)')
+    parser.add_argument('--list', action='store_true', help='Solo listar las particiones adjuntas')
+    args = parser.parse_args()
+
+    if args.ahead is not None:
+        app.config['PARTITION_MONTHS_AHEAD'] = args.ahead
+    if args.retention is not None:
+        app.config['PARTITION_RETENTION_MONTHS'] = args.retention
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            particionadas = [t for t in PARTITIONED_TABLES if is_partitioned(conn, t)]
+            if args.list:
+                for tabla in particionadas:
+                    meses = sorted(list_partitions(conn, tabla))
+                    rango = f"{meses[0]:%Y-%m} .. {meses[-1]:%Y-%m}" if meses else '-'
+                    print(f"{tabla}: {len(meses)} particiones ({rango})")
+        if not particionadas:
+            print("[OK] Las tablas no están particionadas (SQLite o migración e5c0a7d3b918 sin aplicar)")
+            return
+        if args.list:
+            return
+
+        for tabla, hecho in maintain_partitions().items():
+            print(f"[OK] {tabla}: creadas {hecho['creadas'] or '-'}, desacopladas {hecho['desacopladas'] or '-'}")
+
+
+if __name__ == '__main__':
+    main()
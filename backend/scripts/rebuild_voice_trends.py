@@ -0,0 +1,54 @@
+"""
+Recalcula la tabla tendencia_voz a partir del historial de voice_test.
+
+Las tendencias se mantienen de forma incremental en cada insert; este
+script solo hace falta tras crear la tabla (migración aeb8f92818d7) o si
+cambian los parámetros de la tendencia (TREND_EMA_ALPHA, TREND_BASELINE_N,
+TREND_LAST_N). Procesa los usuarios por lotes (keyset sobre user_id): lee
+el historial de cada lote en orden (date, id), incluidas las pruebas
+archivadas, y guarda sus tendencias en un commit. scripts/rescore_voice_tests.py ya recalcula las tendencias de los
+usuarios cuyas pruebas actualiza.
+
+Uso:
+    python scripts/rebuild_voice_trends.py [--user-id 42] [--batch 500]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, VoiceTest, rebuild_trends
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recalcula las tendencias de voz')
+    parser.add_argument('--user-id', help='Solo este usuario')
+    parser.add_argument('--batch', type=int, default=500, help='Usuarios por lote')
+    args = parser.parse_args()
+
+    with app.app_context():
+        usuarios_total = pruebas = 0
+        ultimo = None
+        while True:
+            if args.user_id:
+                usuarios = [args.user_id] if ultimo is None else []
+            else:
+                consulta = db.select(VoiceTest.user_id).distinct().order_by(VoiceTest.user_id).limit(args.batch)
+                if ultimo is not None:
+                    consulta = consulta.where(VoiceTest.user_id > ultimo)
+                usuarios = db.session.execute(consulta).scalars().all()
+            if not usuarios:
+                break
+
+            n_tendencias, n_pruebas = rebuild_trends(usuarios)
+            db.session.commit()
+            usuarios_total += n_tendencias
+            pruebas += n_pruebas
+            ultimo = usuarios[-1]
+    print(f"[OK] {usuarios_total} tendencias recalculadas a partir de {pruebas} pruebas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Recalcula las pruebas de voz guardadas tras reentrenar model.pkl o cambiar
+extract_features.py.
+
+Recorre las filas de voice_test con audio en el almacén de audio
+(archivo_referencia) cuya extractor_version o modelo_version no coincide con
+la actual, por lotes de --chunk filas en el orden del índice
+(user_id, date, id):
+
+  - si cambió el extractor, vuelve a extraer las características del audio
+    en un pool de procesos, usando la caché de feature_store (indexada por
+    el mismo SHA-256); si solo cambió el modelo, usa las ya guardadas;
+  - puntúa el lote con una sola llamada al modelo (predict_features_batch);
+  - actualiza las filas y recalcula las tendencias de sus usuarios en una
+    transacción por lote, que también invalida los ETag de su historial.
+
+Tras cada lote se guarda un checkpoint (posición y contadores): si se
+interrumpe, al relanzarlo continúa donde se quedó. Si entretanto cambia la
+versión del extractor o del modelo, empieza de nuevo. Las filas que fallan
+(audio que falta o que no se puede extraer) se saltan y se reintentan en la
+siguiente ejecución completa.
+
+Para no quitar recursos a la API, los procesos hijos se ejecutan con nice,
+--max-rate limita las filas por segundo y en Postgres cada transacción usa
+lock_timeout. Las pruebas ya archivadas en Parquet no se recalculan.
+
+Uso:
+    python scripts/rescore_voice_tests.py [--workers 4] [--chunk 200] [--max-rate 50]
+    python scripts/rescore_voice_tests.py --dry-run
+    python scripts/rescore_voice_tests.py --restart --user-id 42
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.exc import OperationalError
+
+from feature_store import DEFAULT_DB_PATH, FeatureStore, extractor_version
+from app import (app, basedir, db, FEATURE_NAMES, VoiceTest, audio_store, keyset_after,
+                 model_version, predict_features_batch, rebuild_trends, set_lock_timeout)
+
+DEFAULT_CHECKPOINT = os.path.join(basedir, 'data', 'rescore_checkpoint.json')
+KEY_COLUMNS = [VoiceTest.user_id, VoiceTest.date, VoiceTest.id]
+MAX_RETRIES = 5
+
+
+# ------------------- EXTRACCIÓN (PROCESOS HIJOS) -------------------
+
+_store = None
+
+
+def _init_worker(cache_path, nice):
+    global extract_features, _store
+    if nice:
+        os.nice(nice)
+    from extract_features import extract_features
+    if cache_path:
+        _store = FeatureStore(cache_path)
+
+
+def _extract_one(tarea):
+    """Se ejecuta en el proceso hijo. Devuelve (sha, features, error)."""
+    sha, path = tarea
+    if _store is not None:
+        cached = _store.get(sha)
+        if cached is not None:
+            return sha, cached, None
+    try:
+        features = extract_features(path, raise_errors=True)
+    except Exception as e:
+        return sha, None, str(e) or type(e).__name__
+    if _store is not None:
+        _store.put(sha, features)
+    return sha, features, None
+
+
+# ------------------- CHECKPOINT -------------------
+
+def load_checkpoint(path, versiones, restart):
+    vacio = dict(versiones, cursor=None, actualizadas=0, extraidas=0, fallidas=0)
+    if restart or not os.path.exists(path):
+        return vacio
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if {k: checkpoint.get(k) for k in versiones} != versiones:
+        print("El checkpoint es de otra versión del extractor o del modelo; se empieza de nuevo")
+        return vacio
+    print(f"Continuando desde el checkpoint: {checkpoint['actualizadas']} filas ya actualizadas")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporal = path + '.tmp'
+    with open(temporal, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, path)
+
+
+# ------------------- EJECUCIÓN -------------------
+
+def stale_filter(versiones, user_id=None):
+    condicion = db.and_(
+        VoiceTest.archivo_referencia.isnot(None),
+        db.or_(VoiceTest.extractor_version.is_distinct_from(versiones['extractor_version']),
+               VoiceTest.modelo_version.is_distinct_from(versiones['modelo_version'])),
+    )
+    if user_id is not None:
+        condicion = db.and_(condicion, VoiceTest.user_id == user_id)
+    return condicion
+
+
+def score_chunk(filas, pool, versiones, args):
+    """Extrae lo necesario y puntúa el lote. Devuelve (actualizaciones, extraidas, fallidas)."""
+    tareas = {}
+    fallidas = set()
+    for fila in filas:
+        if fila.extractor_version == versiones['extractor_version'] or fila.archivo_referencia in tareas:
+            continue
+        ruta = audio_store.find(fila.archivo_referencia)
+        if ruta is None:
+            print(f"[ERROR] voice_test {fila.id}: audio {fila.archivo_referencia} no encontrado")
+            fallidas.add(fila.id)
+        else:
+            tareas[fila.archivo_referencia] = ruta
+
+    extraidas = {}
+    for sha, features, error in pool.imap_unordered(_extract_one, list(tareas.items()), chunksize=args.chunksize):
+        if error:
+            print(f"[ERROR] audio {sha}: {error}")
+        else:
+            extraidas[sha] = features
+
+    validas, vectores = [], []
+    for fila in filas:
+        if fila.id in fallidas:
+            continue
+        if fila.extractor_version == versiones['extractor_version']:
+            features = [getattr(fila, name) for name in FEATURE_NAMES]
+        else:
+            features = extraidas.get(fila.archivo_referencia)
+        if features is None or any(v is None for v in features):
+            fallidas.add(fila.id)
+            continue
+        validas.append(fila)
+        vectores.append([float(v) for v in features])
+
+    actualizaciones = []
+    if vectores:
+        for fila, features, (probability, level) in zip(validas, vectores, predict_features_batch(vectores)):
+            actualizaciones.append(dict(
+                versiones, b_id=fila.id, b_date=fila.date, probability=probability, level=level,
+                **dict(zip(FEATURE_NAMES, features))
+            ))
+    return actualizaciones, len(extraidas), len(fallidas)
+
+
+def write_chunk(actualizaciones, usuarios):
+    """Actualiza las filas y las tendencias de sus usuarios en una transacción."""
+    tabla = VoiceTest.__table__
+    # date en el WHERE: en Postgres solo se toca la partición de cada fila.
+    # Las columnas del SET son las demás claves de cada diccionario.
+    stmt = tabla.update().where(tabla.c.id == db.bindparam('b_id'), tabla.c.date == db.bindparam('b_date'))
+    for intento in range(MAX_RETRIES):
+        try:
+            if db.session.get_bind().dialect.name == 'postgresql':
+                set_lock_timeout(db.session.connection())
+            db.session.execute(stmt, actualizaciones)
+            rebuild_trends(usuarios)
+            db.session.commit()
+            return
+        except OperationalError as e:
+            # lock_timeout: la API tiene prioridad, se reintenta más tarde
+            db.session.rollback()
+            if intento == MAX_RETRIES - 1:
+                raise
+            print(f"  Reintentando el lote tras un error de bloqueo: {e.orig}")
+            time.sleep(2 ** intento)
+
+
+def run(args, pool):
+    versiones = {'extractor_version': extractor_version(), 'modelo_version': model_version()}
+    if versiones['modelo_version'] is None:
+        raise SystemExit('Modelo no disponible. Ejecute train_model.py primero')
+    print(f"Extractor {versiones['extractor_version']}, modelo {versiones['modelo_version']}")
+    condicion = stale_filter(versiones, args.user_id)
+
+    if args.dry_run:
+        total = db.session.execute(db.select(db.func.count()).select_from(VoiceTest).where(condicion)).scalar()
+        extraer = db.session.execute(db.select(db.func.count()).select_from(VoiceTest).where(
+            condicion, VoiceTest.extractor_version.is_distinct_from(versiones['extractor_version'])
+        )).scalar()
+        print(f"{total} pruebas por recalcular, {extraer} de ellas con extracción")
+        return
+
+    checkpoint = load_checkpoint(args.checkpoint, versiones, args.restart)
+    columnas = [VoiceTest.id, VoiceTest.user_id, VoiceTest.date, VoiceTest.extractor_version,
+                VoiceTest.archivo_referencia, *[getattr(VoiceTest, name) for name in FEATURE_NAMES]]
+    inicio = time.time()
+    procesadas = 0
+    while True:
+        stmt = db.select(*columnas).where(condicion)
+        if checkpoint['cursor']:
+            user_id, fecha, id_ = checkpoint['cursor']
+            stmt = keyset_after(stmt, KEY_COLUMNS, [user_id, datetime.fromisoformat(fecha), id_], descending=True)
+        filas = db.session.execute(
+            stmt.order_by(*[c.desc() for c in KEY_COLUMNS]).limit(args.chunk)
+        ).all()
+        # Sin transacción abierta mientras se extrae
+        db.session.rollback()
+        if not filas:
+            break
+
+        lote_inicio = time.time()
+        actualizaciones, extraidas, fallidas = score_chunk(filas, pool, versiones, args)
+        if actualizaciones:
+            write_chunk(actualizaciones, sorted({f.user_id for f in filas}))
+        ultima = filas[-1]
+        checkpoint.update(cursor=[ultima.user_id, ultima.date.isoformat(), ultima.id],
+                          actualizadas=checkpoint['actualizadas'] + len(actualizaciones),
+                          extraidas=checkpoint['extraidas'] + extraidas,
+                          fallidas=checkpoint['fallidas'] + fallidas)
+        save_checkpoint(args.checkpoint, checkpoint)
+        procesadas += len(filas)
+        print(f"  {checkpoint['actualizadas']} actualizadas, {checkpoint['extraidas']} audios extraídos, "
+              f"{checkpoint['fallidas']} fallidas ({procesadas / (time.time() - inicio):.1f} filas/s)")
+
+        if args.max_rate:
+            espera = len(filas) / args.max_rate - (time.time() - lote_inicio)
+            if espera > 0:
+                time.sleep(espera)
+
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    print(f"\n[OK] {checkpoint['actualizadas']} pruebas recalculadas, {checkpoint['fallidas']} fallidas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recalcula las pruebas de voz guardadas')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--chunksize', type=int, default=2, help='Tareas por envío al pool')
+    parser.add_argument('--chunk', type=int, default=200, help='Filas por lote y transacción')
+    parser.add_argument('--max-rate', type=float, default=0, help='Máximo de filas por segundo (0: sin límite)')
+    parser.add_argument('--nice', type=int, default=10, help='Prioridad de los procesos de extracción')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT)
+    parser.add_argument('--restart', action='store_true', help='Ignorar el checkpoint')
+    parser.add_argument('--user-id', help='Solo este usuario')
+    parser.add_argument('--dry-run', action='store_true', help='Contar las pruebas por recalcular')
+    parser.add_argument('--cache', default=DEFAULT_DB_PATH, help='Caché persistente de características')
+    parser.add_argument('--no-cache', action='store_true', help='Extraer siempre, sin consultar la caché')
+    args = parser.parse_args()
+
+    # El pool se crea antes de abrir conexiones: los hijos no heredan ninguna
+    cache_path = None if args.no_cache else args.cache
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(cache_path, args.nice)) as pool:
+        with app.app_context():
+            run(args, pool)
+
+
+if __name__ == '__main__':
+    main()
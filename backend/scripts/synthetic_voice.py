@@ -0,0 +1,109 @@
+"""
+Generador de vocales sostenidas sintéticas para pruebas y benchmarks del
+extractor sin usar audio real de pacientes.
+
+Cada ciclo glotal tiene su propio periodo y amplitud, de modo que el jitter
+y el shimmer de la señal generada se conocen de antemano (ground truth).
+"""
+
+import itertools
+import os
+import wave
+
+import numpy as np
+
+# Pesos de armónicos aproximando una /a/ sostenida
+HARMONIC_WEIGHTS = np.array([1.0, 0.7, 0.55, 0.4, 0.3, 0.2, 0.15, 0.1, 0.07, 0.05])
+
+# |N(0,1) - N(0,1)| tiene media 2/sqrt(pi); se usa para convertir el jitter y
+# shimmer locales deseados (media de diferencias absolutas) en desviación típica
+_LOCAL_TO_STD = np.sqrt(np.pi) / 2.0
+
+
+def generate_vowel(f0=120.0, jitter=0.005, shimmer=0.03, noise=0.01,
+                   duration=2.0, sr=22050, seed=0):
+    """
+    Genera una vocal sostenida sintética.
+
+    Args:
+        f0: Frecuencia fundamental media (Hz)
+        jitter: Jitter local relativo deseado (0.005 = 0.5 %)
+        shimmer: Shimmer local relativo deseado
+        noise: Desviación típica del ruido blanco aditivo (amplitud pico ~1)
+        duration: Duración en segundos
+        sr: Frecuencia de muestreo
+        seed: Semilla del generador aleatorio
+
+    Returns:
+        (y, truth): señal float32 y dict con los valores reales de la señal
+        (f0 medio, jitter y shimmer locales de los ciclos generados)
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * sr)
+    n_cycles = int(duration * f0 * (1 + 4 * jitter)) + 2
+
+    period = sr / f0
+    periods = period * (1.0 + jitter * _LOCAL_TO_STD * rng.standard_normal(n_cycles))
+    periods = np.maximum(periods, 2.0)
+    amps = 1.0 + shimmer * _LOCAL_TO_STD * rng.standard_normal(n_cycles)
+    amps = np.maximum(amps, 0.05)
+
+    # Fase dentro del ciclo para cada muestra
+    starts = np.concatenate(([0.0], np.cumsum(periods)))
+    n = np.arange(n_samples, dtype=np.float64)
+    cycle = np.searchsorted(starts, n, side='right') - 1
+    used = int(cycle[-1]) + 1 if n_samples else 0
+    phase = (n - starts[cycle]) / periods[cycle]
+
+    y = np.zeros(n_samples)
+    for h, weight in enumerate(HARMONIC_WEIGHTS, start=1):
+        y += weight * np.sin(2 * np.pi * h * phase)
+    y *= amps[cycle] / HARMONIC_WEIGHTS.sum()
+    if noise > 0:
+        y += noise * rng.standard_normal(n_samples)
+
+    p = periods[:used] / sr
+    a = amps[:used]
+    truth = {
+        'f0': float(1.0 / np.mean(p)) if used else 0.0,
+        'jitter': float(np.mean(np.abs(np.diff(p))) / np.mean(p)) if used > 1 else 0.0,
+        'shimmer': float(np.mean(np.abs(np.diff(a))) / np.mean(a)) if used > 1 else 0.0,
+    }
+    return y.astype(np.float32), truth
+
+
+def write_wav(path, y, sr):
+    """Guarda la señal como WAV PCM de 16 bits."""
+    pcm = np.clip(y, -1.0, 1.0)
+    pcm = (pcm * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sr)
+        wf.writeframes(pcm.tobytes())
+
+
+def build_grid(f0s=(100.0, 200.0), jitters=(0.002, 0.01), shimmers=(0.02, 0.08),
+               noises=(0.0, 0.05), durations=(2.0,), srs=(22050,)):
+    """Producto cartesiano de parámetros como lista de dicts."""
+    keys = ('f0', 'jitter', 'shimmer', 'noise', 'duration', 'sr')
+    return [dict(zip(keys, values))
+            for values in itertools.product(f0s, jitters, shimmers, noises, durations, srs)]
+
+
+def generate_corpus(out_dir, grid, seed=0):
+    """
+    Escribe un WAV por punto de la rejilla.
+
+    Returns:
+        Lista de dicts con 'path', los parámetros y 'truth'
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = []
+    for i, params in enumerate(grid):
+        y, truth = generate_vowel(seed=seed + i, **params)
+        name = 'synth_f0{f0:g}_j{jitter:g}_s{shimmer:g}_n{noise:g}_d{duration:g}_sr{sr}.wav'.format(**params)
+        path = os.path.join(out_dir, name)
+        write_wav(path, y, params['sr'])
+        corpus.append({'path': path, 'params': params, 'truth': truth})
+    return corpus
@@ -0,0 +1,54 @@
+"""
+Script para verificar que /predict_voice?save=true no guarda resultados de
+audios que no se pueden extraer. Levanta la app sobre una base SQLite en
+memoria y sube un fichero que no es audio.
+
+Uso:
+    python scripts/test_predict_voice.py
+"""
+
+import io
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('COHORT_REFRESH_SECONDS', '0')
+os.environ.setdefault('AUDIO_STORE_DIR', tempfile.mkdtemp(prefix='audio_store_'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, VoiceTest
+
+
+def check(nombre, ok, detalle=''):
+    print(f"  [{'OK' if ok else 'ERROR'}] {nombre}{f': {detalle}' if detalle else ''}")
+    return ok
+
+
+def post_corrupt(client):
+    return client.post('/predict_voice?save=true', headers={'Idempotency-Key': 'abc'}, data={
+        'user_id': '1', 'audio': (io.BytesIO(b'esto no es audio' * 64), 'grabacion.wav'),
+    }, content_type='multipart/form-data')
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+
+    client = app.test_client()
+    print("=== Subida de un audio corrupto con save=true ===")
+    resultados = []
+    for intento in ('primer envío', 'reintento con la misma clave'):
+        response = post_corrupt(client)
+        resultados.append(check(f'{intento} responde 422', response.status_code == 422,
+                                f'{response.status_code} {response.get_json()}'))
+    with app.app_context():
+        filas = db.session.execute(db.select(db.func.count()).select_from(VoiceTest)).scalar()
+    resultados.append(check('no se guarda ningún VoiceTest', filas == 0, f'{filas} filas'))
+    if not all(resultados):
+        sys.exit(1)
+    print("\n[OK] Los audios corruptos no se guardan")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Script para verificar cuántas consultas SQL ejecuta cada endpoint.
+Levanta la app sobre una base SQLite en memoria, crea datos de prueba y
+falla si algún endpoint vuelve a generar consultas N+1 (lazy loads).
+
+Uso:
+    python scripts/test_query_counts.py
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+# Sin refresco de cohortes en segundo plano: sus consultas se contarían en cada endpoint
+os.environ.setdefault('COHORT_REFRESH_SECONDS', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from app import app, db, Usuario, Paciente, ResultadoPrueba, store_voice_test
+
+
+@contextmanager
+def count_queries():
+    """Cuenta las sentencias SQL ejecutadas dentro del bloque."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def assert_queries(client, method, url, expected, **kwargs):
+    with count_queries() as statements:
+        response = getattr(client, method)(url, **kwargs)
+        response.get_data()  # consumir respuestas en streaming
+    ok = len(statements) <= expected
+    print(f"  [{'OK' if ok else 'ERROR'}] {method.upper()} {url}: {len(statements)} consultas (máx. {expected})")
+    if not ok:
+        for statement in statements:
+            print(f"      {statement.splitlines()[0]}")
+    return ok
+
+
+def seed():
+    for i in range(20):
+        usuario = Usuario(nombre=f'Paciente {i}', correo=f'p{i}@test', contrasena='x', rol='Paciente')
+        usuario.paciente = Paciente(edad=50 + i)
+        db.session.add(usuario)
+    db.session.flush()
+    for paciente in Paciente.query.all():
+        for _ in range(5):
+            db.session.add(ResultadoPrueba(paciente_id=paciente.paciente_id, tipo_prueba='voz'))
+    db.session.commit()
+    for i in range(5):
+        store_voice_test('1', datetime(2026, 1, i + 1), 0.5, 'Bajo', {'fo': 120.0 + i})
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        seed()
+
+    client = app.test_client()
+    checks = [
+        ('post', '/login.json', 1, {'json': {'correo': 'p0@test', 'contrasena': 'x'}}),
+        # consulta de correo existente + INSERTs de usuario y paciente
+        ('post', '/registro.json', 3, {'json': {'nombre': 'N', 'correo': 'nuevo@test',
+                                                'contrasena': 'x', 'rol': 'Paciente'}}),
+        ('get', '/pacientes.json', 1, {}),
+        ('get', '/pacientes.json?limit=5', 1, {}),
+        ('get', '/resultados.json', 1, {}),
+        # versión del historial de resultados (ETag) + página
+        ('get', '/resultados.json?limit=10&paciente_id=1', 2, {}),
+        # versión del recurso (ETag) + historial
+        ('get', '/voice_results/1', 2, {}),
+        # el ETag sale del actualizado_en de la propia fila
+        ('get', '/pacientes/1.json', 1, {}),
+        # solo la fila de tendencia_voz, nunca el historial
+        ('get', '/voice_trends/1', 2, {}),
+    ]
+    # Con If-None-Match vigente se responde 304 tras leer solo la versión
+    for url in ('/voice_results/1', '/pacientes/1.json', '/resultados.json?paciente_id=1'):
+        etag = client.get(url).headers['ETag']
+        checks.append(('get', url, 1, {'headers': {'If-None-Match': etag}}))
+
+    print("=== Consultas por endpoint ===")
+    results = [assert_queries(client, method, url, expected, **kwargs)
+               for method, url, expected, kwargs in checks]
+    if not all(results):
+        sys.exit(1)
+    print("\n[OK] Sin consultas N+1")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Lector de WAV basado en numpy.memmap.
+
+Mapea directamente el chunk de datos PCM del archivo. Soporta PCM entero de
+8/16/24/32 bits y float de 32/64 bits (incluido WAVE_FORMAT_EXTENSIBLE). La
+conversión a float32 y la mezcla a mono se hacen por bloques al leer, con la
+misma escala que librosa.load.
+
+Solo read() y blocks() trabajan sin cargar el archivo: to_array() y
+load_wav(), que usa el extractor, devuelven la señal mono completa en
+float32 (4 bytes por muestra), porque pyin y el resto del extractor
+necesitan la señal entera. Lo que se evita es la copia intermedia del PCM
+decodificado.
+"""
+
+import struct
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+DEFAULT_BLOCK_FRAMES = 1 << 16
+
+
+class WavFormatError(ValueError):
+    pass
+
+
+class MmapWav:
+    """
+    WAV mapeado en memoria.
+
+    Atributos:
+        sr: Frecuencia de muestreo
+        channels: Número de canales
+        bits: Bits por muestra
+        n_frames: Número de muestras por canal
+    """
+
+    def __init__(self, path):
+        self.path = path
+        fmt, data_offset, data_size = self._parse_header(path)
+        self.format_tag, self.channels, self.sr, self.bits = fmt
+        width = self.bits // 8
+        self.n_frames = data_size // (width * self.channels)
+
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            if self.bits not in (32, 64):
+                raise WavFormatError(f'Float de {self.bits} bits no soportado')
+            dtype, self._scale = np.dtype(f'<f{width}'), None
+        elif self.bits == 8:
+            dtype, self._scale = np.dtype('u1'), None
+        elif self.bits in (16, 32):
+            dtype, self._scale = np.dtype(f'<i{width}'), float(1 << (self.bits - 1))
+        elif self.bits == 24:
+            dtype, self._scale = np.dtype('u1'), float(1 << 23)
+        else:
+            raise WavFormatError(f'PCM de {self.bits} bits no soportado')
+
+        if self.bits == 24:
+            shape = (self.n_frames, self.channels, 3)
+        else:
+            shape = (self.n_frames, self.channels)
+        self._data = np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=shape) \
+            if self.n_frames else np.zeros(shape, dtype=dtype)
+
+    @staticmethod
+    def _parse_header(path):
+        with open(path, 'rb') as f:
+            header = f.read(12)
+            if len(header) < 12:
+                raise WavFormatError('Archivo demasiado corto')
+            riff, _, wave_id = struct.unpack('<4sI4s', header)
+            if riff != b'RIFF' or wave_id != b'WAVE':
+                raise WavFormatError('No es un archivo RIFF/WAVE')
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise WavFormatError('Chunk de datos no encontrado')
+                chunk_id, size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    body = f.read(size)
+                    tag, channels, sr, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+                    if tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                        tag = struct.unpack('<H', body[24:26])[0]
+                    if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                        raise WavFormatError(f'Formato WAV {tag:#x} no soportado')
+                    fmt = (tag, channels, sr, bits)
+                    if size % 2:
+                        f.seek(1, 1)
+                elif chunk_id == b'data':
+                    if fmt is None:
+                        raise WavFormatError('Chunk de datos antes del chunk fmt')
+                    offset = f.tell()
+                    # Algunos grabadores dejan el tamaño en 0xFFFFFFFF al cortar la escritura
+                    f.seek(0, 2)
+                    size = min(size, f.tell() - offset)
+                    return fmt, offset, size
+                else:
+                    f.seek(size + (size % 2), 1)
+
+    def __len__(self):
+        return self.n_frames
+
+    @property
+    def duration(self):
+        return self.n_frames / self.sr if self.sr else 0.0
+
+    def _to_float(self, raw):
+        """Convierte un bloque crudo (frames, canales[, 3]) a float32."""
+        if self.bits == 24:
+            raw = raw.astype(np.int32)
+            block = (raw[..., 0] | (raw[..., 1] << 8) | (raw[..., 2] << 16))
+            block = np.where(block >= (1 << 23), block - (1 << 24), block).astype(np.float32)
+            return block / np.float32(self._scale)
+        if self.bits == 8:
+            return (raw.astype(np.float32) - 128.0) / 128.0
+        if self._scale is None:
+            return raw.astype(np.float32)
+        return raw.astype(np.float32) / np.float32(self._scale)
+
+    def read(self, start=0, stop=None, mono=True):
+        """Lee [start, stop) como float32; mezcla a mono si mono=True."""
+        block = self._to_float(self._data[start:stop])
+        if mono:
+            return block.mean(axis=1) if self.channels > 1 else block[:, 0]
+        return block
+
+    def blocks(self, block_frames=DEFAULT_BLOCK_FRAMES, mono=True):
+        """Itera sobre la señal en bloques de `block_frames` muestras."""
+        for start in range(0, self.n_frames, block_frames):
+            yield start, self.read(start, start + block_frames, mono=mono)
+
+    def to_array(self, block_frames=DEFAULT_BLOCK_FRAMES):
+        """
+        Señal mono completa en float32, convertida bloque a bloque. Ocupa en
+        memoria n_frames * 4 bytes más un bloque, como librosa.load.
+        """
+        out = np.empty(self.n_frames, dtype=np.float32)
+        for start, block in self.blocks(block_frames):
+            out[start:start + len(block)] = block
+        return out
+
+    def close(self):
+        if isinstance(self._data, np.memmap):
+            self._data._mmap.close()
+        self._data = None
+
+
+def load_wav(path):
+    """
+    Equivalente a librosa.load(path, sr=None) para WAV: devuelve (y, sr).
+    Carga la señal completa (ver to_array).
+    """
+    wav = MmapWav(path)
+    try:
+        return wav.to_array(), wav.sr
+    finally:
+        wav.close()
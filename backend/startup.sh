@@ -1,3 +1,5 @@
 # !/bin/bash
 flask db upgrade
-gunicorn app:app
\ No newline at end of file
+# Hilos por worker: con la extracción limitada (EXTRACTION_MAX_PER_PROCESS)
+# quedan hilos libres para las rutas ligeras
+gunicorn app:app --worker-class gthread --threads "${GUNICORN_THREADS:-8}"
@@ -1,14 +1,37 @@
 import 'dart:convert';
+import 'dart:io';
 import 'package:http/http.dart' as http;
 import '../models/usuario.dart';
 import '../models/paciente.dart';
 import '../models/resultado_prueba.dart';
+import '../models/voice_test.dart';
 
 /// Servicio para interactuar con la API del backend.
 class ApiService {
   // URL pública del servidor desplegado en Render.
   static const String baseUrl = 'https://mi-app-parkinson-backend.onrender.com';
 
+  // Respuestas con ETag guardadas en memoria: url -> (etag, cuerpo).
+  static final Map<String, MapEntry<String, String>> _etagCache = {};
+
+  /// GET condicional: envía If-None-Match y reutiliza el cuerpo guardado si el
+  /// servidor responde 304. Devuelve una respuesta 200 en ambos casos.
+  Future<http.Response> _getConditional(Uri url) async {
+    final cached = _etagCache[url.toString()];
+    final response = await http.get(
+      url,
+      headers: cached != null ? {'If-None-Match': cached.key} : null,
+    );
+    if (response.statusCode == 304 && cached != null) {
+      return http.Response(cached.value, 200, headers: response.headers);
+    }
+    final etag = response.headers['etag'];
+    if (response.statusCode == 200 && etag != null) {
+      _etagCache[url.toString()] = MapEntry(etag, response.body);
+    }
+    return response;
+  }
+
   /// Valida las credenciales de un usuario y devuelve el objeto Usuario si son correctas.
   Future<Usuario> validarUsuario(String correo, String contrasena) async {
     final url = Uri.parse('$baseUrl/login.json');
@@ -64,7 +87,7 @@ class ApiService {
 
   /// Obtiene un paciente específico por su ID.
   Future<Paciente> getPaciente(int id) async {
-    final response = await http.get(Uri.parse('$baseUrl/pacientes/$id.json'));
+    final response = await _getConditional(Uri.parse('$baseUrl/pacientes/$id.json'));
     if (response.statusCode == 200) {
       return Paciente.fromJson(jsonDecode(response.body));
     } else {
@@ -97,22 +120,79 @@ class ApiService {
     }
   }
 
-  /// Sube un archivo de audio para predicción y guarda el resultado.
-  Future<Map<String, dynamic>> postVoiceTest(String filePath, String userId) async {
-    final url = Uri.parse('$baseUrl/predict_voice');
-    var request = http.MultipartRequest('POST', url);
-    request.files.add(await http.MultipartFile.fromPath('audio', filePath));
-    request.fields['user_id'] = userId;
+  /// Sube un archivo de audio para predicción y guarda el resultado en la
+  /// misma petición (save=true). La clave de idempotencia evita filas
+  /// duplicadas si la petición se reintenta. Por defecto se deriva de la
+  /// grabación (ruta, fecha de modificación y tamaño), así que volver a
+  /// llamar con el mismo archivo no crea otra fila.
+  ///
+  /// Con [enCola] la extracción la hace un trabajador del servidor
+  /// (async=true): se consulta el trabajo cada [intervalo] hasta que termina.
+  /// Si el servidor está saturado (429), se reintenta hasta [reintentos]
+  /// veces esperando lo que indique Retry-After.
+  Future<Map<String, dynamic>> postVoiceTest(String filePath, String userId,
+      {String? idempotencyKey,
+      bool enCola = false,
+      Duration intervalo = const Duration(seconds: 1),
+      int reintentos = 3}) async {
+    final url = Uri.parse('$baseUrl/predict_voice?save=true${enCola ? '&async=true' : ''}');
+    final fecha = DateTime.now().toIso8601String();
+    final clave = idempotencyKey ?? await _claveGrabacion(filePath, userId);
 
-    final streamedResponse = await request.send();
-    final response = await http.Response.fromStream(streamedResponse);
+    late http.Response response;
+    for (int intento = 0;; intento++) {
+      // Un MultipartRequest no se puede reenviar: se construye en cada intento
+      final request = http.MultipartRequest('POST', url);
+      request.files.add(await http.MultipartFile.fromPath('audio', filePath));
+      request.fields['user_id'] = userId;
+      request.fields['date'] = fecha;
+      request.headers['Idempotency-Key'] = clave;
 
-    if (response.statusCode == 200) {
-      return await saveVoiceResult(userId, jsonDecode(response.body));
+      final streamedResponse = await request.send();
+      response = await http.Response.fromStream(streamedResponse);
+      if (response.statusCode != 429 || intento >= reintentos) break;
+      final espera = int.tryParse(response.headers['retry-after'] ?? '') ?? 1;
+      await Future.delayed(Duration(seconds: espera));
+    }
+
+    if (response.statusCode == 202) {
+      return _esperarTrabajo(jsonDecode(response.body)['id'], intervalo);
+    } else if (response.statusCode == 201 || response.statusCode == 200) {
+      return jsonDecode(response.body);
     } else {
       throw Exception('Error en la predicción de voz: ${response.body}');
     }
   }
+
+  /// Clave de idempotencia de una grabación: misma ruta, fecha de
+  /// modificación y tamaño dan la misma clave (máx. 100 caracteres).
+  static Future<String> _claveGrabacion(String filePath, String userId) async {
+    final stat = await File(filePath).stat();
+    // FNV-1a de 32 bits: String.hashCode no es estable entre ejecuciones
+    var hash = 0x811c9dc5;
+    for (final byte in utf8.encode(filePath)) {
+      hash = ((hash ^ byte) * 0x01000193) & 0xffffffff;
+    }
+    return '$userId-${hash.toRadixString(16)}-${stat.modified.microsecondsSinceEpoch}-${stat.size}';
+  }
+
+  /// Espera a que termine un trabajo de la cola de extracción y devuelve su
+  /// resultado (la misma respuesta que /predict_voice).
+  Future<Map<String, dynamic>> _esperarTrabajo(int trabajoId, Duration intervalo) async {
+    while (true) {
+      final response = await http.get(Uri.parse('$baseUrl/trabajos/$trabajoId'));
+      if (response.statusCode != 200) {
+        throw Exception('Error consultando el trabajo $trabajoId: ${response.body}');
+      }
+      final trabajo = jsonDecode(response.body);
+      if (trabajo['estado'] == 'hecho') {
+        return trabajo['resultado'];
+      } else if (trabajo['estado'] == 'fallido') {
+        throw Exception('Error en la predicción de voz: ${trabajo['error']}');
+      }
+      await Future.delayed(intervalo);
+    }
+  }
   
   /// Guarda el resultado de una prueba de voz.
   Future<Map<String, dynamic>> saveVoiceResult(String userId, Map<String, dynamic> predictionData) async {
@@ -136,10 +216,67 @@ class ApiService {
     }
   }
 
-  /// Obtiene el historial de resultados de voz de un usuario.
-  Future<List<dynamic>> getVoiceResults(String userId) async {
-    final url = Uri.parse('$baseUrl/voice_results/$userId');
-    final response = await http.get(url);
+  /// Sincroniza en una sola petición los resultados de voz guardados en el
+  /// dispositivo. La clave de idempotencia se deriva del registro local, así
+  /// que reenviar el mismo lote no crea duplicados en el servidor.
+  /// Devuelve el estado de cada registro ('creado', 'duplicado' o 'invalido').
+  Future<Map<String, dynamic>> syncVoiceTests(List<VoiceTest> tests) async {
+    final url = Uri.parse('$baseUrl/ingest/voice_results');
+    final response = await http.post(
+      url,
+      headers: {'Content-Type': 'application/json'},
+      body: jsonEncode({
+        'registros': tests
+            .map((t) => {
+                  ...t.toJson(),
+                  'idempotency_key': 'local-${t.userId}-${t.id ?? t.date}',
+                })
+            .toList(),
+      }),
+    );
+
+    if (response.statusCode == 200) {
+      return jsonDecode(response.body);
+    } else {
+      throw Exception('Error al sincronizar los resultados de voz: ${response.body}');
+    }
+  }
+
+  /// Descarga solo los cambios desde la última sincronización.
+  /// [marcas] guarda la marca de cada tabla ('voice_test', 'resultado_prueba',
+  /// 'paciente', 'medico') y se actualiza con las recibidas; se repite la
+  /// petición mientras el servidor indique que quedan cambios.
+  Future<Map<String, List<dynamic>>> sync(Map<String, String> marcas,
+      {String? userId, int? pacienteId, List<String>? tablas}) async {
+    final cambios = <String, List<dynamic>>{};
+    bool completo = false;
+    while (!completo) {
+      final url = Uri.parse('$baseUrl/sync').replace(queryParameters: {
+        ...marcas,
+        if (userId != null) 'user_id': userId,
+        if (pacienteId != null) 'paciente_id': pacienteId.toString(),
+        if (tablas != null) 'tablas': tablas.join(','),
+      });
+      final response = await http.get(url);
+      if (response.statusCode != 200) {
+        throw Exception('Error al sincronizar: ${response.body}');
+      }
+      final data = jsonDecode(response.body);
+      (data['tablas'] as Map<String, dynamic>).forEach((tabla, valor) {
+        cambios.putIfAbsent(tabla, () => []).addAll(valor['items']);
+        if (valor['marca'] != null) marcas[tabla] = valor['marca'];
+      });
+      completo = data['completo'];
+    }
+    return cambios;
+  }
+
+  /// Obtiene el historial de resultados de voz de un usuario. Con
+  /// [incluirArchivo] también devuelve las pruebas antiguas archivadas.
+  Future<List<dynamic>> getVoiceResults(String userId, {bool incluirArchivo = false}) async {
+    final url = Uri.parse('$baseUrl/voice_results/$userId')
+        .replace(queryParameters: incluirArchivo ? {'archivo': 'true'} : null);
+    final response = await _getConditional(url);
 
     if (response.statusCode == 200) {
       return jsonDecode(response.body);
@@ -147,4 +284,54 @@ class ApiService {
       throw Exception('Error al obtener los resultados de voz: ${response.body}');
     }
   }
+
+  /// Obtiene la tendencia del historial de voz de un usuario (medias, media
+  /// móvil, variación respecto a la línea base y últimas pruebas).
+  Future<Map<String, dynamic>> getVoiceTrends(String userId) async {
+    final url = Uri.parse('$baseUrl/voice_trends/$userId');
+    final response = await _getConditional(url);
+
+    if (response.statusCode == 200) {
+      return jsonDecode(response.body);
+    } else {
+      throw Exception('Error al obtener la tendencia de voz: ${response.body}');
+    }
+  }
+
+  /// Panel del médico: último resultado y última prueba de voz de cada
+  /// paciente asignado, por páginas (pasar el `next_cursor` recibido).
+  Future<Map<String, dynamic>> getMedicoDashboard(int medicoId, {String? cursor, int limit = 100}) async {
+    final url = Uri.parse('$baseUrl/medicos/$medicoId/dashboard.json').replace(queryParameters: {
+      'limit': limit.toString(),
+      if (cursor != null) 'cursor': cursor,
+    });
+    final response = await http.get(url);
+
+    if (response.statusCode == 200) {
+      return jsonDecode(response.body);
+    } else {
+      throw Exception('Error al cargar el panel del médico: ${response.body}');
+    }
+  }
+
+  /// Agregados de voz por cohorte (`dimension`: edad, genero o centro_medico).
+  /// Mientras el servidor calcula el primer resumen (503) se reintenta hasta
+  /// [reintentos] veces esperando lo que indique Retry-After.
+  Future<Map<String, dynamic>> getCohortAnalytics({String dimension = 'edad', int reintentos = 3}) async {
+    final url = Uri.parse('$baseUrl/analytics/cohortes').replace(queryParameters: {'dimension': dimension});
+    late http.Response response;
+    for (int intento = 0;; intento++) {
+      response = await http.get(url);
+      // 503 mientras el servidor calcula el primer resumen
+      if (response.statusCode != 503 || intento >= reintentos) break;
+      final espera = int.tryParse(response.headers['retry-after'] ?? '') ?? 1;
+      await Future.delayed(Duration(seconds: espera));
+    }
+
+    if (response.statusCode == 200) {
+      return jsonDecode(response.body);
+    } else {
+      throw Exception('Error al cargar la analítica por cohortes: ${response.body}');
+    }
+  }
 }